@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the channel metadata index in freesky.meta_index.
+
+Compares the previous per-worker json.load of meta.json plus regex-stripped
+exact lookups against building the normalized index, loading it from its
+pickle cache, and resolving one refresh worth of upstream names with it.
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.chdir(Path(__file__).parent)
+
+from freesky import meta_index
+from freesky.utils import normalize_name
+
+PARENTHESIZED = re.compile(r"\s*\(.*?\)")
+
+
+def upstream_names():
+    """Every meta.json name the way upstream tends to list it: with a parenthesized suffix."""
+    with open(meta_index.META_PATH, "r") as f:
+        return [f"{name} (HD)" for name in json.load(f)]
+
+
+def load_json():
+    with open(meta_index.META_PATH, "r") as f:
+        return json.load(f)
+
+
+def best(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main():
+    names = upstream_names()
+    number = 20
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "meta.index.pickle")
+        meta_index.load_index(cache_path=cache_path)  # Populate the cache
+        index = meta_index.load_index(cache_path=cache_path)
+        assert index.source == "pickle"
+
+        json_load = best(load_json, number)
+        build = best(lambda: (normalize_name.cache_clear(), meta_index.build_index()), number)
+        cached = best(lambda: meta_index.load_index(cache_path=cache_path), number)
+
+    meta = load_json()
+    before = best(lambda: [meta.get(PARENTHESIZED.sub("", name), {}) for name in names], number)
+    after = best(lambda: [index.lookup(name) or {} for name in names], number)
+    matched = sum(1 for name in names if index.lookup(name))
+
+    print("🚀 freesky metadata index benchmark")
+    print("=" * 50)
+    print(f"{'meta.json entries':<28} {len(meta):>10}")
+    print(f"{'json.load (before)':<28} {json_load:>8.2f}ms")
+    print(f"{'index build (cold start)':<28} {build:>8.2f}ms")
+    print(f"{'index from pickle cache':<28} {cached:>8.2f}ms   ({build / cached:.1f}x vs building)")
+    print(f"{'refresh lookups (before)':<28} {before:>8.2f}ms")
+    print(f"{'refresh lookups (after)':<28} {after:>8.2f}ms")
+    print(f"{'names matched':<28} {matched:>5}/{len(names)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Relay CPU benchmark for /content segment proxying.
+
+Compares the CPU cost per GB of the previous relay path (httpx re-chunking to
+4 KB pieces, chunked transfer framing per send) against the current one
+(raw upstream chunks, memoryview slices of cached segments, Content-Length
+framing). The ASGI send mimics uvicorn's httptools writer so framing costs
+are included.
+
+Both paths relay the same upstream network chunks. The first viewer of a
+segment follows its download while it is still in flight; later viewers of
+the current path are served the finished, compacted entry, which the
+previous path didn't have, so that row also counts the cache's effect.
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from httpx._decoders import ByteChunker
+from starlette.responses import StreamingResponse
+from freesky.segment_cache import SegmentEntry
+
+SEGMENT_SIZE = 2 * 1024 * 1024  # Typical 2 MB TS segment
+NETWORK_CHUNK = 16 * 1024  # Typical HTTP/2 DATA frame payload
+SEGMENTS = 256  # 512 MB per run
+
+
+def make_network_chunks() -> list:
+    payload = os.urandom(SEGMENT_SIZE)
+    return [payload[i:i + NETWORK_CHUNK] for i in range(0, SEGMENT_SIZE, NETWORK_CHUNK)]
+
+
+class Transport:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def make_send(transport: Transport, chunked: bool):
+    async def send(message):
+        if message["type"] != "http.response.body":
+            return
+        body = message.get("body", b"")
+        if chunked:
+            content = [b"%x\r\n" % len(body), body, b"\r\n"] if body else []
+            if not message.get("more_body", False):
+                content.append(b"0\r\n\r\n")
+            transport.write(b"".join(content))
+        else:
+            transport.write(body)
+    return send
+
+
+async def receive():
+    await asyncio.sleep(3600)
+
+
+async def relay_before(network_chunks: list, transport: Transport):
+    async def proxy_stream():
+        chunker = ByteChunker(chunk_size=4 * 1024)
+        for raw in network_chunks:
+            await asyncio.sleep(0)  # Each network read is a separate event-loop wakeup
+            for chunk in chunker.decode(raw):
+                yield chunk
+        for chunk in chunker.flush():
+            yield chunk
+
+    response = StreamingResponse(proxy_stream(), headers={"Transfer-Encoding": "chunked"})
+    await response({"type": "http", "method": "GET"}, receive, make_send(transport, chunked=True))
+
+
+async def relay_after(entry: SegmentEntry, transport: Transport):
+    response = StreamingResponse(entry.iter_chunks(), headers={"Content-Length": str(entry.size)})
+    await response({"type": "http", "method": "GET"}, receive, make_send(transport, chunked=False))
+
+
+async def relay_in_flight(network_chunks: list, transport: Transport):
+    """First viewer: relay the entry while the download appends network chunks to it."""
+    entry = SegmentEntry("https://edge.example/segment.ts")
+
+    async def download():
+        entry.start(SEGMENT_SIZE)
+        for chunk in network_chunks:
+            entry.append(chunk)
+            await asyncio.sleep(0)  # Each network read is a separate event-loop wakeup
+        entry.finish()
+
+    task = asyncio.create_task(download())
+    await relay_after(entry, transport)
+    await task
+
+
+def cached_entry(network_chunks: list) -> SegmentEntry:
+    entry = SegmentEntry("https://edge.example/segment.ts")
+    entry.start(SEGMENT_SIZE)
+    for chunk in network_chunks:
+        entry.append(chunk)
+    entry.finish()
+    return entry
+
+
+async def measure(name: str, relay) -> float:
+    transport = Transport()
+    started = time.process_time()
+    for _ in range(SEGMENTS):
+        await relay(transport)
+    cpu = time.process_time() - started
+    gigabytes = transport.written / (1024 ** 3)
+    per_gb = cpu / gigabytes
+    print(f"{name:<32} {cpu:7.3f}s CPU for {gigabytes:.2f} GB -> {per_gb:6.3f}s CPU/GB")
+    return per_gb
+
+
+async def main():
+    network_chunks = make_network_chunks()
+    entry = cached_entry(network_chunks)
+
+    print("🚀 freesky segment relay benchmark")
+    print("=" * 50)
+    before = await measure("before (4 KB, chunked)", lambda t: relay_before(network_chunks, t))
+    in_flight = await measure("after, first viewer (in flight)", lambda t: relay_in_flight(network_chunks, t))
+    cached = await measure("after, later viewers (cached)", lambda t: relay_after(entry, t))
+    print(f"\nRelay change alone (first viewer): {before / in_flight:.1f}x less CPU per GB relayed")
+    print(f"With the segment cache (later viewers): {before / cached:.1f}x less CPU per GB relayed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
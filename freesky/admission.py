@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Saturated(Exception):
+    """No upstream slot became available within the allowed wait."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class Slot:
+    """An admitted upstream transfer; release() must be called exactly when it ends."""
+
+    def __init__(self, controller: "AdmissionController", host: str):
+        self._controller = controller
+        self.host = host
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self.host)
+
+
+class _HostQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.flows: "OrderedDict[str, deque]" = OrderedDict()  # flow -> waiting futures
+
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self.flows.values())
+
+
+class AdmissionController:
+    """Admission control for upstream segment transfers.
+
+    Limits concurrency globally and per upstream host. Waiters are grouped by
+    flow (channel) and served round-robin so one busy channel cannot starve
+    the others. Waits are bounded; callers get Saturated when they expire or
+    when the queue is full.
+    """
+
+    def __init__(
+        self,
+        max_active: int = 200,
+        per_host: int = 50,
+        host_limits: Optional[Dict[str, int]] = None,
+        max_wait: float = 5.0,
+        max_queue: int = 1000,
+        retry_after: int = 2,
+    ):
+        self.max_active = max_active
+        self.per_host = per_host
+        self.host_limits = host_limits or {}
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._hosts: Dict[str, _HostQueue] = {}
+        self.active = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_time = 0.0
+
+    def _host(self, host: str) -> _HostQueue:
+        queue = self._hosts.get(host)
+        if queue is None:
+            queue = self._hosts[host] = _HostQueue(self.host_limits.get(host, self.per_host))
+        return queue
+
+    def queue_depth(self) -> int:
+        return sum(queue.queued() for queue in self._hosts.values())
+
+    async def acquire(self, host: str, flow: str) -> Slot:
+        slot = self.try_acquire(host, flow)
+        if slot is not None:
+            return slot
+
+        queue = self._host(host)
+        if self.queue_depth() >= self.max_queue:
+            self.rejected_full += 1
+            raise Saturated("Segment proxy queue is full", self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        queue.flows.setdefault(flow, deque()).append(future)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return future.result()  # Granted just as the wait expired
+            self._forget(queue, flow, future)
+            self.rejected_timeout += 1
+            raise Saturated("Timed out waiting for a segment proxy slot", self.retry_after)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                future.result().release()
+            else:
+                self._forget(queue, flow, future)
+            raise
+        finally:
+            self.wait_time += time.monotonic() - started
+        return future.result()
+
+    def try_acquire(self, host: str, flow: str) -> Optional[Slot]:
+        """Take a slot only if one is free right now and nobody is waiting for it."""
+        queue = self._host(host)
+        if self.active < self.max_active and queue.active < queue.limit and not queue.flows:
+            return self._grant(host, queue)
+        return None
+
+    def _grant(self, host: str, queue: _HostQueue) -> Slot:
+        queue.active += 1
+        self.active += 1
+        self.admitted += 1
+        return Slot(self, host)
+
+    def _forget(self, queue: _HostQueue, flow: str, future: asyncio.Future):
+        future.cancel()
+        waiters = queue.flows.get(flow)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del queue.flows[flow]
+
+    def _release(self, host: str):
+        queue = self._hosts[host]
+        queue.active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand freed capacity to waiters, rotating through flows within each host."""
+        progress = True
+        while progress and self.active < self.max_active:
+            progress = False
+            for host, queue in self._hosts.items():
+                if self.active >= self.max_active:
+                    break
+                while queue.flows and queue.active < queue.limit:
+                    flow, waiters = next(iter(queue.flows.items()))
+                    future = waiters.popleft()
+                    if waiters:
+                        queue.flows.move_to_end(flow)
+                    else:
+                        del queue.flows[flow]
+                    if future.done():
+                        continue
+                    future.set_result(self._grant(host, queue))
+                    progress = True
+                    break
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "queue_depth": self.queue_depth(),
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_time_total": round(self.wait_time, 3),
+            "hosts": {
+                host: {"active": queue.active, "limit": queue.limit, "queued": queue.queued()}
+                for host, queue in self._hosts.items()
+                if queue.active or queue.flows
+            },
+        }
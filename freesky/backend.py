@@ -3,16 +3,29 @@ import asyncio
 import httpx
 import logging
 import time
+import math
+import contextlib
 from functools import lru_cache
-from typing import Optional, Dict, Tuple
-from freesky.free_sky import StepDaddy, Channel
+from typing import Optional, Dict, List, Tuple
+from freesky.free_sky import StepDaddy, Channel, ChannelDiff, ChannelRegistry
 from fastapi import Response, status, FastAPI, Request
 from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .utils import urlsafe_base64_decode
+from .utils import urlsafe_base64_decode, tokens, TokenError, TokenExpired, share_token_secret, tokens_portable
+from .segment_cache import SegmentCache, SegmentEntry, UpstreamError
+from .admission import AdmissionController, Saturated
+from .spool import DiskSpool
+from .prefetch import Prefetcher
+from .cache_backend import create_backend
+from .cluster import Cluster, SECRET_HEADER, internal_request
+from .upstream import SEGMENT, PLAYLIST, METADATA
+from .latency import budget, remaining
+from .breaker import CircuitOpen
+from .logos import LogoStore, LogoNotFound, build_manifest
 import json
+import posixpath
 from urllib.parse import urlparse, urlunparse
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 
 # Set up logging
 logging.basicConfig(
@@ -47,20 +60,25 @@ fastapi_app.add_middleware(
     expose_headers=["*"],
 )
 
-# Create HTTP client with optimized settings for streaming
-client = httpx.AsyncClient(
-    http2=True,
-    timeout=httpx.Timeout(15.0, connect=5.0),  # Reasonable timeouts
-    limits=httpx.Limits(
-        max_keepalive_connections=50,  # Increased for better streaming
-        max_connections=200,            # Increased from 75
-        keepalive_expiry=60.0          # Increased from 30
-    ),
-    follow_redirects=True
-)
-
 free_sky = StepDaddy()
 
+# Segments, logos and cluster peers share StepDaddy's pooled upstream client
+upstream = free_sky.upstream
+
+# Cache shared by all workers (Redis when configured); the in-process caches below act as its L1
+shared_cache = create_backend(os.environ.get("CACHE_REDIS_URL", os.environ.get("REDIS_URL", "")))
+free_sky.shared_cache = shared_cache
+workers = int(os.environ.get("WORKERS", "1"))
+
+# Optional cluster mode: each channel and segment directory is owned by one node (CLUSTER_SELF_URL enables it)
+cluster_self_url = os.environ.get("CLUSTER_SELF_URL", "")
+cluster = Cluster(
+    cluster_self_url,
+    members=[member.strip() for member in os.environ.get("CLUSTER_MEMBERS", "").split(",") if member.strip()],
+    backend=shared_cache,
+    secret=os.environ.get("CLUSTER_SECRET", ""),
+) if cluster_self_url else None
+
 # Use OrderedDict for LRU cache behavior
 class LRUCache(OrderedDict):
     def __init__(self, maxsize=0, *args, **kwargs):
@@ -80,15 +98,289 @@ class LRUCache(OrderedDict):
             oldest = next(iter(self))
             del self[oldest]
 
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one shared task."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            # Run as a task so a disconnecting leader doesn't cancel the waiters' result
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved even if every waiter went away
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+class RequestRates:
+    """Exponentially decayed per-key request rates, used to find hot channels."""
+
+    def __init__(self, half_life: float = 30.0):
+        self._decay = math.log(2) / half_life
+        self._rates: Dict[str, Tuple[float, float]] = {}  # key -> (score, last_seen)
+
+    def hit(self, key: str):
+        now = time.time()
+        score, last_seen = self._rates.get(key, (0.0, now))
+        self._rates[key] = (score * math.exp(-self._decay * (now - last_seen)) + 1.0, now)
+
+    def forget(self, key: str):
+        self._rates.pop(key, None)
+
+    def hottest(self, n: int, idle_cutoff: float) -> list:
+        """Return up to n keys seen within idle_cutoff seconds, hottest first."""
+        now = time.time()
+        for key in [k for k, (_, seen) in self._rates.items() if now - seen > idle_cutoff]:
+            del self._rates[key]
+        ranked = sorted(
+            self._rates.items(),
+            key=lambda item: item[1][0] * math.exp(-self._decay * (now - item[1][1])),
+            reverse=True,
+        )
+        return [key for key, _ in ranked[:n]]
+
 # Cache with size limit and TTL optimized for streaming
 stream_cache = LRUCache(maxsize=100)  # Increased for better caching
 cache_ttl = 30  # 30 seconds for live streaming freshness
 
+# Playlists older than cache_ttl are still served for this long when upstream fails or its circuit is open
+stale_ttl = float(os.environ.get("STALE_TTL", "300"))
+stale_stats = {"served": 0}
+
+# Concurrent cache misses for the same channel share one upstream resolution
+stream_resolutions = SingleFlight()
+
+# AES keys rotate slowly; cache them by decrypted key URL and fetch each once at a time
+key_cache = LRUCache(maxsize=int(os.environ.get("KEY_CACHE_SIZE", "500")))
+key_cache_ttl = float(os.environ.get("KEY_CACHE_TTL", "300"))
+key_fetches = SingleFlight()
+key_stats = {"hits": 0, "misses": 0}
+
+# Background pre-warming of the hottest channels' playlists
+prewarm_top_n = int(os.environ.get("PREWARM_TOP_N", "20"))  # 0 disables pre-warming
+prewarm_lead = float(os.environ.get("PREWARM_LEAD", "5"))  # Seconds before TTL expiry to refresh
+prewarm_idle = float(os.environ.get("PREWARM_IDLE", "60"))  # Stop pre-warming after this long without viewers
+stream_rates = RequestRates()
+prewarm_stats = {"refreshes": 0, "failures": 0}
+# Playlists players actually poll per channel: "" for the master, else the variant token
+requested_variants: Dict[str, Dict[str, float]] = {}  # channel_id -> variant -> last requested
+prewarm_backoff: Dict[str, Tuple[int, float]] = {}  # cache key -> (consecutive failures, retry at)
+prewarm_max_backoff = 60.0
+
+def note_stream_request(channel_id: str, variant: Optional[str] = None):
+    stream_rates.hit(channel_id)
+    requested_variants.setdefault(channel_id, {})[variant or ""] = time.time()
+
+def segment_owner_key(url: str) -> str:
+    """Segments are owned per upstream directory, which is one per channel."""
+    parsed = urlparse(url)
+    return parsed.netloc + posixpath.dirname(parsed.path)
+
+async def fetch_segment(url: str, entry: SegmentEntry):
+    """Download a segment into a shared cache entry, from its owner node in cluster mode."""
+    owner = cluster.remote_owner(segment_owner_key(url)) if cluster else None
+    if owner:
+        try:
+            await relay_segment(cluster.internal_url(owner, f"content/{tokens.encode(url)}"), entry, cluster.headers())
+            cluster.forwarded += 1
+            return
+        except (httpx.TransportError, UpstreamError) as e:
+            if entry.size:
+                raise  # Part of the body was already relayed to viewers
+            # Unreachable, or refused (e.g. a token from another secret); upstream still has it
+            cluster.forward_failed(owner, e)
+    await relay_segment(url, entry)
+
+async def relay_segment(url: str, entry: SegmentEntry, headers: Optional[dict] = None):
+    async with upstream.stream("GET", url, SEGMENT, headers=headers, timeout=30) as response:
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code)
+        content_length = response.headers.get("content-length")
+        if "content-encoding" in response.headers:
+            # Decoded size differs from the wire size, so it can't be advertised
+            entry.start(None)
+            async for chunk in response.aiter_bytes():
+                entry.append(chunk)
+            return
+        entry.start(int(content_length) if content_length else None)
+        # Raw network chunks avoid httpx re-chunking and decoder copies
+        async for chunk in response.aiter_raw():
+            entry.append(chunk)
+
+# Optional on-disk spool (ideally tmpfs) shared by all workers in the container
+spool_dir = os.environ.get("SPOOL_DIR", "")
+spool = DiskSpool(
+    spool_dir,
+    max_bytes=int(os.environ.get("SPOOL_MAX_MB", "1024")) * 1024 * 1024,
+    max_ages={
+        "segment": float(os.environ.get("SPOOL_SEGMENT_TTL", "120")),
+        "key": float(os.environ.get("SPOOL_KEY_TTL", "300")),
+    },
+) if spool_dir else None
+spool_tasks = set()
+
+def spool_segment(entry: SegmentEntry):
+    """Write a completed segment to the spool in the background."""
+    task = asyncio.ensure_future(spool.store("segment", entry.url, entry.chunks))
+    spool_tasks.add(task)
+    task.add_done_callback(spool_tasks.discard)
+
+# Shared segment cache so each segment is pulled from upstream once per channel, not per viewer
+segment_cache = SegmentCache(
+    fetch_segment,
+    max_bytes=int(os.environ.get("SEGMENT_CACHE_MB", "256")) * 1024 * 1024,
+    ttl=float(os.environ.get("SEGMENT_CACHE_TTL", "60")),  # Roughly one live window
+    on_complete=spool_segment if spool else None,
+)
+
+async def fetch_logo(url: str) -> bytes:
+    response = await upstream.fetch(
+        "GET",
+        url,
+        METADATA,
+        headers={"user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:137.0) Gecko/20100101 Firefox/137.0"}
+    )
+    if response.status_code != 200:
+        raise LogoNotFound(url)
+    return response.content
+
+# Logos and their 64/128px thumbnails: memory LRU in front of ./logo-cache, one upstream fetch per logo
+logo_fetches = SingleFlight()
+logos = LogoStore(
+    os.environ.get("LOGO_CACHE_DIR", "./logo-cache"),
+    fetch_logo,
+    logo_fetches,
+    memory_bytes=int(os.environ.get("LOGO_CACHE_MB", "32")) * 1024 * 1024,
+)
+
+# After each channel refresh every logo is pre-warmed into the store, then a versioned manifest
+# (and sprite sheet) is shared with all workers for the channel grid
+logo_prewarm_concurrency = int(os.environ.get("LOGO_PREWARM_CONCURRENCY", "8"))
+logo_sprite = os.environ.get("LOGO_SPRITE", "TRUE").lower() == "true"
+logo_manifest_ttl = 86400.0
+logo_manifest = {"payload": None, "manifest": None, "checked": 0.0}  # This worker's copy of the shared manifest
+logo_prewarm_stats = {"runs": 0, "skipped": 0, "failures": 0, "logos": 0, "seconds": 0.0, "version": None}
+logo_prewarm_task: Optional[asyncio.Task] = None
+
+def channel_logos(channels: List[Channel]) -> Dict[str, str]:
+    """Proxied logo path -> upstream URL, for every channel with a remote logo."""
+    prefix = "/api/logo/"
+    return {
+        channel.logo: urlsafe_base64_decode(channel.logo[len(prefix):])
+        for channel in channels
+        if channel.logo.startswith(prefix)
+    }
+
+def schedule_logo_prewarm(diff: ChannelDiff):
+    global logo_prewarm_task
+    if diff.source != "upstream":
+        return  # The worker that scraped the list builds the shared manifest
+    if logo_prewarm_task is not None and not logo_prewarm_task.done():
+        if not diff:
+            return  # The running pre-warm already covers this list
+        logo_prewarm_task.cancel()  # Superseded by the newer channel list
+    logo_prewarm_task = asyncio.ensure_future(prewarm_logos(diff.channels, changed=bool(diff)))
+
+async def prewarm_logos(channels: List[Channel], changed: bool = True):
+    started = time.time()
+    try:
+        version = logo_prewarm_stats["version"]
+        if not changed and version is not None and await shared_logo_version() == version:
+            # Same channels and the manifest built for them is still shared; nothing to redo
+            logo_prewarm_stats["skipped"] += 1
+            return
+        manifest, sprite = await build_manifest(
+            logos, channel_logos(channels), sprite=logo_sprite, concurrency=logo_prewarm_concurrency
+        )
+        # Sprite first, so no worker sees a manifest pointing at a missing sprite
+        if sprite is not None:
+            await shared_cache.set(f"logos:sprite:{manifest['version']}", sprite, logo_manifest_ttl * 2)
+        payload = json.dumps(manifest).encode()
+        await shared_cache.set("logos:manifest", payload, logo_manifest_ttl)
+        logo_manifest.update(payload=payload, manifest=manifest, checked=time.time())
+        logo_prewarm_stats["runs"] += 1
+        logo_prewarm_stats["logos"] = len(manifest["logos"])
+        logo_prewarm_stats["version"] = manifest["version"]
+        logger.info(f"Pre-warmed {len(manifest['logos'])} logos, manifest {manifest['version']}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logo_prewarm_stats["failures"] += 1
+        logger.error(f"Error pre-warming logos: {str(e)}")
+    finally:
+        logo_prewarm_stats["seconds"] = round(time.time() - started, 3)
+
+free_sky.channel_listeners.append(schedule_logo_prewarm)
+
+async def shared_logo_version() -> Optional[str]:
+    payload = await shared_cache.get("logos:manifest")
+    return json.loads(payload)["version"] if payload is not None else None
+
+async def current_logo_manifest() -> Optional[dict]:
+    """The latest shared logo manifest, re-read at most every 10 seconds."""
+    if time.time() - logo_manifest["checked"] > 10:
+        logo_manifest["checked"] = time.time()
+        payload = await shared_cache.get("logos:manifest")
+        if payload is not None and payload != logo_manifest["payload"]:
+            logo_manifest.update(payload=payload, manifest=json.loads(payload))
+    return logo_manifest["manifest"]
+
+def grid_logo(logo: str, versioned: Dict[str, str]) -> str:
+    """Thumbnail URL for the channel grid: versioned when pre-warmed, else the 128px variant."""
+    if logo in versioned:
+        return versioned[logo]
+    return f"{logo}?size=128" if logo.startswith("/api/logo/") else logo
+
 # Track active tasks for cleanup
 active_tasks: Dict[str, asyncio.Task] = {}
 
-# Concurrency control for streaming
-_stream_semaphore = asyncio.Semaphore(10)
+def parse_host_limits(value: str) -> Dict[str, int]:
+    """Parse "host=limit,host=limit" overrides for per-host upstream concurrency."""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            host, limit = item.split("=", 1)
+            limits[host.strip()] = int(limit)
+    return limits
+
+# Admission control for upstream segment transfers, held until each download finishes
+segment_admission = AdmissionController(
+    max_active=int(os.environ.get("SEGMENT_MAX_CONCURRENCY", "200")),
+    per_host=int(os.environ.get("SEGMENT_HOST_CONCURRENCY", "50")),
+    host_limits=parse_host_limits(os.environ.get("SEGMENT_HOST_LIMITS", "")),
+    max_wait=float(os.environ.get("SEGMENT_QUEUE_WAIT", "5")),
+    max_queue=int(os.environ.get("SEGMENT_QUEUE_MAX", "1000")),
+)
+
+# Prefetch the newest segments of watched channels into the segment cache (PREFETCH_SEGMENTS=0 disables)
+prefetch_segments = int(os.environ.get("PREFETCH_SEGMENTS", "2"))
+prefetcher = Prefetcher(
+    segment_cache,
+    segment_admission,
+    depth=prefetch_segments,
+    concurrency=int(os.environ.get("PREFETCH_CONCURRENCY", "8")),
+    max_bytes_per_sec=float(os.environ.get("PREFETCH_MAX_MBPS", "50")) * 1024 * 1024,
+    idle_after=float(os.environ.get("PREFETCH_IDLE", "20")),
+) if prefetch_segments > 0 else None
 
 logger.info("Backend initialized with connection pooling")
 
@@ -98,10 +390,29 @@ channel_update_task = None
 @fastapi_app.on_event("startup")
 async def startup_event():
     global channel_update_task
+    # Tokens go into shared playlists and to other workers' clients, so every worker must decode them
+    if not await share_token_secret(shared_cache) and workers > 1:
+        raise RuntimeError(
+            "WORKERS > 1 needs TOKEN_SECRETS, CLUSTER_SECRET or a Redis cache so all workers can decode URL tokens"
+        )
     # Start the channel update background task
     channel_update_task = asyncio.create_task(update_channels())
     active_tasks["channel_update"] = channel_update_task
     logger.info("Channel update background task started")
+    if prewarm_top_n > 0:
+        active_tasks["prewarm"] = asyncio.create_task(prewarm_streams())
+        logger.info(f"Playlist pre-warmer started for top {prewarm_top_n} channels")
+    if prefetcher:
+        active_tasks["prefetch"] = asyncio.create_task(prefetcher.run())
+        logger.info(f"Segment prefetcher started ({prefetch_segments} segments ahead)")
+    if spool:
+        active_tasks["spool_janitor"] = asyncio.create_task(spool.janitor())
+        logger.info(f"Disk spool enabled at {spool.directory}")
+    if cluster:
+        active_tasks["cluster"] = asyncio.create_task(cluster.run())
+        logger.info(f"Cluster mode enabled as {cluster.self_url}")
+        if not cluster.secret:
+            logger.warning("CLUSTER_SECRET is not set, so URL tokens cannot be decoded by other nodes")
 
 @fastapi_app.on_event("shutdown")
 async def shutdown_event():
@@ -114,10 +425,33 @@ async def shutdown_event():
             except asyncio.CancelledError:
                 logger.info(f"Task {task_name} cancelled")
     
-    # Close HTTP client
-    await client.aclose()
+    if logo_prewarm_task is not None:
+        logo_prewarm_task.cancel()
+
+    if cluster:
+        await cluster.leave()
+
+    # Stop in-flight segment downloads and close HTTP client
+    await segment_cache.close()
+    await upstream.aclose()
+    await shared_cache.close()
     logger.info("HTTP client and background tasks closed")
 
+@contextlib.asynccontextmanager
+async def lifespan():
+    """Run startup and shutdown around the app's lifetime.
+
+    Under Reflex the FastAPI app is mounted inside Reflex's own, so its
+    startup/shutdown hooks never fire; freesky.py registers this as a Reflex
+    lifespan task instead. backend_app.py serves the FastAPI app alone and
+    relies on the hooks above.
+    """
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
 @fastapi_app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
@@ -140,88 +474,313 @@ async def stream_options(channel_id: str):
         }
     )
 
+async def resolve_stream(channel_id: str, variant: Optional[str] = None, min_ttl: float = 0.0) -> str:
+    """Resolve a channel's (or variant's) playlist upstream and cache it, coalescing concurrent callers.
+
+    Playlists resolved by another worker are reused unless they expire within min_ttl seconds.
+    """
+    cache_key = stream_cache_key(channel_id, variant)
+
+    async def fetch() -> bytes:
+        # Whatever waiting on another worker left of the budget
+        stream_data = await asyncio.wait_for(fetch_playlist(channel_id, variant), timeout=remaining())
+        return json.dumps({"data": stream_data, "time": time.time()}).encode()
+
+    async def resolve():
+        # One 10 second budget covers waiting on another worker and the upstream hops
+        with budget(10.0):
+            if tokens_portable():
+                payload = json.loads(await shared_cache.single_flight(cache_key, cache_ttl, fetch, min_ttl=min_ttl))
+            else:
+                # Its tokens only decode in this process, so the playlist stays out of the shared cache
+                payload = json.loads(await fetch())
+        # Cache the result (LRU cache handles cleanup), aged from when it was resolved
+        stream_cache[cache_key] = (payload["data"], payload["time"])
+        return payload["data"]
+
+    return await stream_resolutions.do(cache_key, resolve)
+
+async def fetch_playlist(channel_id: str, variant: Optional[str] = None) -> str:
+    """Resolve a playlist here, or fetch it from the channel's owner node in cluster mode."""
+    owner = cluster.remote_owner(channel_id) if cluster else None
+    if owner:
+        path = f"stream/{channel_id}/{variant}.m3u8" if variant else f"stream/{channel_id}.m3u8"
+        try:
+            response = await upstream.fetch(
+                "GET", cluster.internal_url(owner, path), PLAYLIST, headers=cluster.headers(), timeout=10
+            )
+        except httpx.TransportError as e:
+            cluster.forward_failed(owner, e)
+        else:
+            if response.status_code == 200:
+                cluster.forwarded += 1
+                return response.text
+            # Whatever the owner's trouble, this node can still resolve the playlist itself
+            cluster.forward_failed(owner, UpstreamError(response.status_code))
+    return await free_sky.stream(channel_id, variant)
+
+def stream_cache_key(channel_id: str, variant: Optional[str] = None) -> str:
+    return f"stream_{channel_id}/{variant}" if variant else f"stream_{channel_id}"
+
+def invalidate_changed_channels(diff: ChannelDiff):
+    """Drop cached playlists and sessions of removed or renamed channels; every other channel stays warm."""
+    channel_refresh_stats["commits"] += 1
+    if not diff:
+        channel_refresh_stats["unchanged"] += 1
+        return
+    for change, count in diff.summary().items():
+        channel_refresh_stats[change] += count
+    stale = set(diff.stale_ids)
+    if not stale:
+        return
+    keys = [key for key in stream_cache if key.removeprefix("stream_").split("/", 1)[0] in stale]
+    for key in keys:
+        del stream_cache[key]
+    for channel_id in stale:
+        stream_rates.forget(channel_id)
+        for variant in requested_variants.pop(channel_id, {}):
+            prewarm_backoff.pop(stream_cache_key(channel_id, variant or None), None)
+    channel_refresh_stats["invalidated"] += len(keys)
+    task = asyncio.ensure_future(forget_channels(stale, keys))
+    invalidation_tasks.add(task)
+    task.add_done_callback(invalidation_tasks.discard)
+
+async def forget_channels(channel_ids, keys):
+    try:
+        for key in set(keys) | {stream_cache_key(channel_id) for channel_id in channel_ids}:
+            await shared_cache.delete(key)
+        for channel_id in channel_ids:
+            await free_sky.invalidate_session(channel_id)
+    except Exception as e:
+        logger.error(f"Error invalidating changed channels: {str(e)}")
+
+invalidation_tasks = set()
+channel_refresh_stats = {"commits": 0, "unchanged": 0, "added": 0, "removed": 0, "renamed": 0, "changed": 0, "invalidated": 0}
+free_sky.channel_listeners.append(invalidate_changed_channels)
+
+def playlist_headers() -> dict:
+    return {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Expose-Headers": "*",
+        "Cache-Control": "no-cache, no-store, must-revalidate",
+        "Pragma": "no-cache",
+        "Expires": "0",
+        "Accept-Ranges": "bytes"
+    }
+
+def prewarm_due(now: float, interval: float) -> List[Tuple[str, Optional[str]]]:
+    """(channel_id, variant) playlists of the hottest channels that expire soon and aren't backing off."""
+    for channel_id, variants in list(requested_variants.items()):
+        for variant, seen in list(variants.items()):
+            if now - seen > prewarm_idle:
+                del variants[variant]
+                prewarm_backoff.pop(stream_cache_key(channel_id, variant or None), None)
+        if not variants:
+            del requested_variants[channel_id]
+    due = []
+    for channel_id in stream_rates.hottest(prewarm_top_n, prewarm_idle):
+        for variant in requested_variants.get(channel_id, {}):
+            key = stream_cache_key(channel_id, variant or None)
+            if prewarm_backoff.get(key, (0, 0.0))[1] > now:
+                continue
+            cached = stream_cache.get(key)
+            if cached is None or now - cached[1] >= cache_ttl - prewarm_lead:
+                due.append((channel_id, variant or None))
+    return due
+
+async def prewarm_tick(interval: float = 1.0):
+    """Refresh every due playlist once; failing ones back off exponentially."""
+    async def refresh(channel_id: str, variant: Optional[str]):
+        key = stream_cache_key(channel_id, variant)
+        try:
+            # Another worker may have refreshed it already; only accept a copy that isn't due too
+            await resolve_stream(channel_id, variant, min_ttl=prewarm_lead + interval)
+            prewarm_stats["refreshes"] += 1
+            prewarm_backoff.pop(key, None)
+        except Exception as e:
+            failures = prewarm_backoff.get(key, (0, 0.0))[0] + 1
+            prewarm_backoff[key] = (failures, time.time() + min(prewarm_max_backoff, interval * 2 ** failures))
+            prewarm_stats["failures"] += 1
+            logger.warning(f"Pre-warm failed for {key} ({failures} in a row): {str(e)}")
+
+    due = prewarm_due(time.time(), interval)
+    if due:
+        await asyncio.gather(*(refresh(channel_id, variant) for channel_id, variant in due))
+
+async def prewarm_streams():
+    """Refresh the hottest channels' playlists just before their cache entries expire."""
+    interval = 1.0
+    while True:
+        try:
+            await prewarm_tick(interval)
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            logger.info("Playlist pre-warm task cancelled")
+            break
+        except Exception as e:
+            logger.error(f"Unexpected error in pre-warm loop: {str(e)}")
+            await asyncio.sleep(interval)
+
 @fastapi_app.get("/stream/{channel_id}.m3u8")
 async def stream(channel_id: str):
+    return await serve_stream(channel_id)
+
+@fastapi_app.options("/stream/{channel_id}/{variant}.m3u8")
+async def variant_options(channel_id: str, variant: str):
+    return await stream_options(channel_id)
+
+@fastapi_app.get("/stream/{channel_id}/{variant}.m3u8")
+async def variant_stream(channel_id: str, variant: str):
+    """Proxied media playlist for one variant of a master playlist, cached independently."""
+    return await serve_stream(channel_id, variant)
+
+async def serve_stream(channel_id: str, variant: Optional[str] = None):
+    try:
+        # Refuse foreign, forged or expired variant tokens before they reach the caches
+        free_sky.variant_url(channel_id, variant)
+    except TokenError as e:
+        return token_error_response(e)
     try:
+        note_stream_request(channel_id, variant)
         # Check cache first
-        cache_key = f"stream_{channel_id}"
+        cache_key = stream_cache_key(channel_id, variant)
         current_time = time.time()
         
         if cache_key in stream_cache:
             cached_data, cached_time = stream_cache[cache_key]
             if current_time - cached_time < cache_ttl:
                 logger.info(f"Serving cached stream for channel {channel_id}")
+                schedule_prefetch(channel_id, cached_data)
                 return Response(
                     content=cached_data,
                     media_type="application/vnd.apple.mpegurl",
-                    headers={
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                        "Access-Control-Allow-Headers": "*",
-                        "Access-Control-Expose-Headers": "*",
-                        "Cache-Control": "no-cache, no-store, must-revalidate",
-                        "Pragma": "no-cache",
-                        "Expires": "0",
-                        "Accept-Ranges": "bytes"
-                    }
+                    headers=playlist_headers()
                 )
         
-        # Generate new stream with timeout
+        # Generate new stream with timeout, shared by all concurrent misses
         try:
-            stream_data = await asyncio.wait_for(
-                free_sky.stream(channel_id),
-                timeout=10.0  # 10 second timeout for stream generation
-            )
+            stream_data = await resolve_stream(channel_id, variant)
         except asyncio.TimeoutError:
             logger.error(f"Timeout generating stream for channel {channel_id}")
+            stale = stale_stream(cache_key)
+            if stale is not None:
+                return stale
             return JSONResponse(
                 content={"error": "Stream generation timeout"},
                 status_code=status.HTTP_504_GATEWAY_TIMEOUT
             )
         
-        # Cache the result (LRU cache handles cleanup)
-        stream_cache[cache_key] = (stream_data, current_time)
-        
+        schedule_prefetch(channel_id, stream_data)
         return Response(
             content=stream_data,
             media_type="application/vnd.apple.mpegurl",
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                "Access-Control-Allow-Headers": "*",
-                "Access-Control-Expose-Headers": "*",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0",
-                "Accept-Ranges": "bytes"
-            }
+            headers=playlist_headers()
         )
     except IndexError:
         return JSONResponse(content={"error": "Stream not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    except TokenError as e:
+        return token_error_response(e)
     except Exception as e:
         logger.error(f"Error streaming channel {channel_id}: {str(e)}")
-        return JSONResponse(content={"error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        stale = stale_stream(stream_cache_key(channel_id, variant))
+        if stale is not None:
+            return stale
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE if isinstance(e, CircuitOpen) else status.HTTP_500_INTERNAL_SERVER_ERROR
+        return JSONResponse(content={"error": str(e)}, status_code=status_code)
+
+def schedule_prefetch(channel_id: str, playlist: str):
+    """Queue a served playlist's newest segments; prefetching never fails the playlist response."""
+    if prefetcher is None:
+        return
+    try:
+        prefetcher.schedule(channel_id, playlist)
+    except Exception as e:
+        logger.error(f"Error scheduling prefetch for channel {channel_id}: {str(e)}")
+
+def stale_stream(cache_key: str) -> Optional[Response]:
+    """The last good playlist, if recent enough, for when upstream fails (stale-if-error)."""
+    cached = stream_cache.get(cache_key)
+    if cached is None or time.time() - cached[1] >= stale_ttl:
+        return None
+    stale_stats["served"] += 1
+    headers = playlist_headers()
+    headers["Warning"] = '110 - "Response is Stale"'
+    return Response(content=cached[0], media_type="application/vnd.apple.mpegurl", headers=headers)
+
+async def serve_internal(request: Request, handler, *args):
+    """Serve a request from another cluster node locally, without forwarding it again."""
+    if cluster is None or not cluster.authorized(request.headers.get(SECRET_HEADER)):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=status.HTTP_403_FORBIDDEN)
+    token = internal_request.set(True)
+    try:
+        return await handler(*args)
+    finally:
+        internal_request.reset(token)
+
+@fastapi_app.get("/cluster/stream/{channel_id}.m3u8")
+async def cluster_stream(channel_id: str, request: Request):
+    return await serve_internal(request, serve_stream, channel_id)
+
+@fastapi_app.get("/cluster/stream/{channel_id}/{variant}.m3u8")
+async def cluster_variant_stream(channel_id: str, variant: str, request: Request):
+    return await serve_internal(request, serve_stream, channel_id, variant)
+
+@fastapi_app.get("/cluster/content/{path}")
+async def cluster_content(path: str, request: Request):
+    return await serve_internal(request, content, path)
+
+def key_response(key_data: bytes) -> Response:
+    return Response(
+        content=key_data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": "attachment; filename=key"}
+    )
 
 @fastapi_app.get("/key/{url}/{host}")
 async def key(url: str, host: str):
+    key_url = None
     try:
-        # Add timeout to key retrieval
-        key_data = await asyncio.wait_for(
-            free_sky.key(url, host),
-            timeout=5.0  # 5 second timeout for key retrieval
-        )
-        return Response(
-            content=key_data,
-            media_type="application/octet-stream",
-            headers={"Content-Disposition": "attachment; filename=key"}
-        )
+        key_url = free_sky.key_url(url)
+        if key_url in key_cache:
+            key_data, cached_time = key_cache[key_url]
+            if time.time() - cached_time < key_cache_ttl:
+                key_stats["hits"] += 1
+                return key_response(key_data)
+        key_stats["misses"] += 1
+
+        async def fetch_upstream() -> bytes:
+            key_data = await spool.read("key", key_url) if spool else None
+            if key_data is None:
+                # Add timeout to key retrieval
+                with budget(5.0):
+                    key_data = await asyncio.wait_for(
+                        free_sky.key(url, host),
+                        timeout=5.0  # 5 second timeout for key retrieval
+                    )
+                if spool:
+                    await spool.store("key", key_url, [key_data])
+            return key_data
+
+        async def fetch():
+            key_data = await shared_cache.single_flight(f"key:{key_url}", key_cache_ttl, fetch_upstream, lock_ttl=10.0)
+            key_cache[key_url] = (key_data, time.time())
+            return key_data
+
+        key_data = await key_fetches.do(key_url, fetch)
+        return key_response(key_data)
+    except TokenError as e:
+        return token_error_response(e)
     except asyncio.TimeoutError:
+        key_cache.pop(key_url, None)
         logger.error(f"Timeout getting key for {url}")
         return JSONResponse(
             content={"error": "Key retrieval timeout"},
             status_code=status.HTTP_504_GATEWAY_TIMEOUT
         )
     except Exception as e:
+        key_cache.pop(key_url, None)
         logger.error(f"Error getting key: {str(e)}")
         return JSONResponse(content={"error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -238,31 +797,87 @@ async def content_options(path: str):
         }
     )
 
+def content_headers() -> dict:
+    return {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Expose-Headers": "*",
+        "Cache-Control": "public, max-age=3600",
+        "Accept-Ranges": "bytes",
+    }
+
+def token_error_response(e: TokenError) -> JSONResponse:
+    """Expired links are gone for good (410); malformed or forged ones are refused (403)."""
+    status_code = status.HTTP_410_GONE if isinstance(e, TokenExpired) else status.HTTP_403_FORBIDDEN
+    return JSONResponse(content={"error": str(e)}, status_code=status_code)
+
+# Proxied segment bytes per channel, attributed from the channel id inside each /content token
+content_bytes = Counter()
+
 @fastapi_app.get("/content/{path}")
 async def content(path: str):
     try:
-        async with _stream_semaphore:  # Control concurrent streams
-            async def proxy_stream():
-                async with client.stream("GET", free_sky.content_url(path), timeout=30) as response:
-                    async for chunk in response.aiter_bytes(chunk_size=4 * 1024):  # Optimized chunks for lower latency
-                        yield chunk
-            return StreamingResponse(
-                proxy_stream(), 
-                media_type="application/octet-stream",
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Expose-Headers": "*",
-                    "Cache-Control": "public, max-age=3600",
-                    "Accept-Ranges": "bytes",
-                    "Transfer-Encoding": "chunked"
-                }
-            )
+        token = tokens.resolve(path)
+        url = token.url
+        if prefetcher:
+            prefetcher.claim(url)
+        slot = None
+        if segment_cache.live(url) is None:
+            if spool:
+                # Another worker may already have fetched this segment
+                spooled = await spool.lookup("segment", url)
+                if spooled:
+                    return FileResponse(spooled, media_type="application/octet-stream", headers=content_headers())
+            # Only segments that need an upstream transfer are admitted, fairly per channel
+            parsed = urlparse(url)
+            flow = token.channel_id or posixpath.dirname(parsed.path)
+            slot = await segment_admission.acquire(parsed.hostname or "", flow)
+        # Attach to the cached or in-flight download of this segment
+        entry = segment_cache.get(url, on_done=slot.release if slot else None)
+        await entry.ready()
+        headers = content_headers()
+        body_length = entry.body_length()
+        if body_length is not None:
+            # A known length lets the server write each piece as-is instead of framing chunks
+            headers["Content-Length"] = str(body_length)
+            if token.channel_id:
+                content_bytes[token.channel_id] += body_length
+        else:
+            headers["Transfer-Encoding"] = "chunked"
+        return StreamingResponse(
+            entry.iter_chunks(),
+            media_type="application/octet-stream",
+            headers=headers
+        )
+    except Saturated as e:
+        logger.warning(f"Rejecting content request: {str(e)}")
+        return JSONResponse(
+            content={"error": str(e)},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except UpstreamError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
+    except TokenError as e:
+        return token_error_response(e)
     except Exception as e:
         logger.error(f"Error proxying content: {str(e)}")
         return JSONResponse(content={"error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+async def refresh_channels(ttl: float):
+    """Scrape the channel list once per cluster and adopt the shared copy in this worker."""
+    async def scrape() -> bytes:
+        await free_sky.load_channels()
+        if not free_sky.channels:
+            raise Exception("No channels loaded from primary source")
+        return json.dumps([channel.dict() for channel in free_sky.channels]).encode()
+
+    payload = await shared_cache.single_flight("channels", ttl, scrape, lock_ttl=60.0)
+    channels = [Channel(**data) for data in json.loads(payload)]
+    if channels != free_sky.channels:
+        free_sky.commit_channels(channels, source="shared")
+
 async def update_channels():
     update_interval = 300  # 5 minutes
     retry_interval = 60   # 1 minute on failure
@@ -276,12 +891,11 @@ async def update_channels():
             
             while not success and retries < max_retries:
                 try:
-                    await free_sky.load_channels()
+                    await refresh_channels(update_interval)
                     if free_sky.channels:
                         success = True
                         logger.info(f"Successfully loaded {len(free_sky.channels)} channels")
-                        # Clear stream cache when channels are updated
-                        stream_cache.clear()
+                        # Changed channels were invalidated when the list was committed
                         await asyncio.sleep(update_interval)
                     else:
                         raise Exception("No channels loaded from primary source")
@@ -293,17 +907,12 @@ async def update_channels():
             
             if not success:
                 # All retries failed, try fallback
-                if os.path.exists("freesky/fallback_channels.json"):
-                    logger.info("Loading channels from fallback file...")
-                    with open("freesky/fallback_channels.json", "r") as f:
-                        fallback_data = json.load(f)
-                        free_sky.channels = [Channel(**channel_data) for channel_data in fallback_data]
-                    if free_sky.channels:
-                        logger.info(f"Loaded {len(free_sky.channels)} channels from fallback")
-                    else:
-                        logger.error("No channels in fallback file")
+                fallback_channels = load_fallback_channels()
+                if fallback_channels:
+                    free_sky.commit_channels(fallback_channels, source="fallback")
+                    logger.info(f"Loaded {len(free_sky.channels)} channels from fallback")
                 else:
-                    logger.error("No fallback file available")
+                    logger.error("No channels available from fallback file")
                 
                 # Wait before next attempt even if using fallback
                 await asyncio.sleep(update_interval)
@@ -315,26 +924,32 @@ async def update_channels():
             logger.error(f"Unexpected error in channel update loop: {str(e)}")
             await asyncio.sleep(retry_interval)
 
+@lru_cache(maxsize=1)
+def load_fallback_channels() -> List[Channel]:
+    """Parse the fallback channel file once per process."""
+    if not os.path.exists("freesky/fallback_channels.json"):
+        logger.error("No fallback channels file found")
+        return []
+    with open("freesky/fallback_channels.json", "r") as f:
+        fallback_data = json.load(f)
+    channels = [Channel(**channel_data) for channel_data in fallback_data]
+    logger.info(f"Loaded {len(channels)} channels from fallback file")
+    return channels
+
+@lru_cache(maxsize=1)
+def fallback_registry() -> ChannelRegistry:
+    return ChannelRegistry(load_fallback_channels())
+
 def get_channels():
     """Get current channels with fallback handling."""
     try:
-        logger.debug("Attempting to get channels from free_sky instance")
         channels = free_sky.channels
         if channels:
-            logger.info(f"Successfully retrieved {len(channels)} channels")
+            logger.debug(f"Retrieved {len(channels)} channels")
             return channels
-        
-        logger.warning("No channels available from primary source, trying fallback")
-        # Try loading from fallback synchronously if no channels available
-        if os.path.exists("freesky/fallback_channels.json"):
-            with open("freesky/fallback_channels.json", "r") as f:
-                fallback_data = json.load(f)
-                channels = [Channel(**channel_data) for channel_data in fallback_data]
-            logger.info(f"Loaded {len(channels)} channels from fallback in get_channels()")
-            return channels
-        else:
-            logger.error("No fallback channels file found")
-            return []
+
+        logger.warning("No channels available from primary source, using fallback")
+        return load_fallback_channels()
     except Exception as e:
         logger.error(f"Error in get_channels(): {str(e)}", exc_info=True)
         return []
@@ -342,8 +957,9 @@ def get_channels():
 def get_channel(channel_id) -> Optional[Channel]:
     if not channel_id or channel_id == "":
         return None
-    channels = get_channels()  # Use get_channels() to ensure fallback handling
-    return next((channel for channel in channels if channel.id == channel_id), None)
+    # Registries are rebuilt on every refresh, so this is a dict lookup
+    registry = free_sky.registry if free_sky.channels else fallback_registry()
+    return registry.get(channel_id)
 
 @fastapi_app.options("/playlist.m3u8")
 def playlist_options():
@@ -358,23 +974,29 @@ def playlist_options():
         }
     )
 
+def playlist_response(request: Request) -> Response:
+    """Serve the precomputed playlist, honouring If-None-Match and Accept-Encoding."""
+    snapshot = free_sky.playlist_snapshot
+    body, encoding = snapshot.negotiate(request.headers.get("accept-encoding", ""))
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Expose-Headers": "*",
+        "Cache-Control": "no-cache",  # Clients revalidate with the ETag instead of re-downloading
+        "ETag": snapshot.etags[encoding],
+        "Vary": "Accept-Encoding",
+    }
+    if snapshot.matches(request.headers.get("if-none-match", ""), encoding):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/vnd.apple.mpegurl", headers=headers)
+
 @fastapi_app.get("/playlist.m3u8")
-def playlist():
+async def playlist(request: Request):
     """Return the playlist as a response"""
-    return Response(
-        content=free_sky.playlist(),
-        media_type="application/vnd.apple.mpegurl",
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Expose-Headers": "*",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-            "Accept-Ranges": "bytes"
-        }
-    )
+    return playlist_response(request)
 
 @fastapi_app.options("/api/playlist.m3u8")
 def api_playlist_options():
@@ -390,56 +1012,48 @@ def api_playlist_options():
     )
 
 @fastapi_app.get("/api/playlist.m3u8")
-def api_playlist():
+async def api_playlist(request: Request):
     """Return the playlist as a response (API endpoint)"""
-    return Response(
-        content=free_sky.playlist(),
-        media_type="application/vnd.apple.mpegurl",
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Expose-Headers": "*",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-            "Accept-Ranges": "bytes"
-        }
-    )
+    return playlist_response(request)
 
 async def get_schedule():
     return await free_sky.schedule()
 
 @fastapi_app.get("/logo/{logo}")
-async def logo(logo: str):
-    url = urlsafe_base64_decode(logo)
-    file = url.split("/")[-1]
-    if not os.path.exists("./logo-cache"):
-        os.makedirs("./logo-cache")
-    if os.path.exists(f"./logo-cache/{file}"):
-        return FileResponse(
-            f"./logo-cache/{file}",
-            headers={"Cache-Control": "public, max-age=86400"}  # Cache for 24 hours
-        )
+async def logo(logo: str, request: Request, size: int = 0, v: str = ""):
+    """Serve a channel logo; size=64 or size=128 returns a WebP thumbnail."""
     try:
-        response = await client.get(
-            url, 
-            headers={"user-agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:137.0) Gecko/20100101 Firefox/137.0"}
-        )
-        if response.status_code == 200:
-            with open(f"./logo-cache/{file}", "wb") as f:
-                f.write(response.content)
-            return FileResponse(
-                f"./logo-cache/{file}",
-                headers={"Cache-Control": "public, max-age=86400"}
-            )
-        else:
-            return JSONResponse(content={"error": "Logo not found"}, status_code=status.HTTP_404_NOT_FOUND)
-    except httpx.ConnectTimeout:
+        image = await logos.get(urlsafe_base64_decode(logo), size)
+    except LogoNotFound:
+        return JSONResponse(content={"error": "Logo not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    except (httpx.TimeoutException, asyncio.TimeoutError):
         return JSONResponse(content={"error": "Request timed out"}, status_code=status.HTTP_504_GATEWAY_TIMEOUT)
     except Exception as e:
         logger.error(f"Error fetching logo: {str(e)}")
         return JSONResponse(content={"error": str(e)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Versioned manifest URLs change whenever the image does; others are cached for 24 hours
+    cache_control = "public, max-age=31536000, immutable" if v else "public, max-age=86400"
+    headers = {"Cache-Control": cache_control, "ETag": image.etag}
+    if image.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image.body, media_type=image.media_type, headers=headers)
+
+@fastapi_app.get("/logos/manifest.json")
+async def logo_manifest_endpoint(request: Request):
+    manifest = await current_logo_manifest()
+    if manifest is None:
+        return JSONResponse(content={"error": "Logo manifest not built yet"}, status_code=status.HTTP_404_NOT_FOUND)
+    headers = {"Cache-Control": "public, max-age=60", "ETag": f"\"{manifest['version']}\""}
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(content=manifest, headers=headers)
+
+@fastapi_app.get("/logos/sprite/{version}.webp")
+async def logo_sprite_endpoint(version: str):
+    sprite = await shared_cache.get(f"logos:sprite:{version}")
+    if sprite is None:
+        return JSONResponse(content={"error": "Sprite not found"}, status_code=status.HTTP_404_NOT_FOUND)
+    return Response(content=sprite, media_type="image/webp", headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 @fastapi_app.get("/ping")
 async def ping():
@@ -451,6 +1065,28 @@ async def health():
         "status": "healthy",
         "channels_count": len(free_sky.channels),
         "cache_size": len(stream_cache),
+        "stream_resolution": stream_resolutions.stats(),
+        "channel_sessions": free_sky.session_stats(),
+        "segment_cache": segment_cache.stats(),
+        "segment_admission": segment_admission.stats(),
+        "prefetch": prefetcher.stats() if prefetcher else None,
+        "key_cache": dict(key_stats, entries=len(key_cache), **key_fetches.stats()),
+        "spool": spool.stats() if spool else None,
+        "url_tokens": tokens.stats(),
+        "content_bytes_by_channel": dict(content_bytes.most_common(10)),
+        "shared_cache": shared_cache.stats(),
+        "cluster": cluster.stats() if cluster else None,
+        "upstream": upstream.stats(),
+        "upstream_latency": free_sky.latency.stats(),
+        "circuit_breaker": free_sky.breaker.stats(),
+        "stale_playlists": stale_stats,
+        "logos": dict(logos.stats(), **logo_fetches.stats(), prewarm=logo_prewarm_stats),
+        "channel_refresh": channel_refresh_stats,
+        "prewarm": dict(
+            prewarm_stats,
+            hot_channels=stream_rates.hottest(prewarm_top_n, prewarm_idle),
+            backing_off=len(prewarm_backoff),
+        ),
         "uptime": time.time()
     }
 
@@ -459,17 +1095,26 @@ async def channels_endpoint():
     """Get all channels as JSON."""
     try:
         channels = get_channels()
+        manifest = await current_logo_manifest() or {}
+        versioned = manifest.get("logos", {})
+        sprite = manifest.get("sprite")
         return {
             "channels": [
                 {
                     "id": ch.id,
                     "name": ch.name,
                     "logo": ch.logo,
+                    "thumbnail": grid_logo(ch.logo, versioned),
                     "tags": ch.tags
                 }
                 for ch in channels
             ],
-            "count": len(channels)
+            "count": len(channels),
+            "logo_sprite": {
+                "src": sprite["src"],
+                "background_size": sprite["background_size"],
+                "positions": {ch.id: sprite["positions"][ch.logo] for ch in channels if ch.logo in sprite["positions"]},
+            } if sprite else None,
         }
     except Exception as e:
         logger.error(f"Error in channels endpoint: {str(e)}")
@@ -0,0 +1,109 @@
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Upstream host is failing; calls are rejected until the breaker lets a probe through."""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit open for {host}, retrying in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # Consecutive
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker for upstream calls.
+
+    failure_threshold consecutive failures open a host's circuit. After
+    reset_timeout seconds one probe is let through (half-open); its success
+    closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def _circuit(self, host: str) -> _Circuit:
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits[host] = _Circuit()
+        return circuit
+
+    def check(self, host: str):
+        """Raise CircuitOpen unless a call to host may go ahead."""
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.state == CLOSED:
+            return
+        if circuit.state == OPEN:
+            waited = time.time() - circuit.opened_at
+            if waited < self.reset_timeout:
+                circuit.rejected += 1
+                raise CircuitOpen(host, self.reset_timeout - waited)
+            circuit.state = HALF_OPEN
+            logger.info(f"Circuit for {host} half-open, probing")
+        if circuit.probing:
+            circuit.rejected += 1
+            raise CircuitOpen(host, 1)
+        circuit.probing = True
+
+    def success(self, host: str):
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            return
+        if circuit.state != CLOSED:
+            logger.info(f"Circuit for {host} closed")
+        circuit.state = CLOSED
+        circuit.failures = 0
+        circuit.probing = False
+
+    def failure(self, host: str):
+        circuit = self._circuit(host)
+        circuit.failures += 1
+        circuit.probing = False
+        if circuit.state == HALF_OPEN or (circuit.state == CLOSED and circuit.failures >= self.failure_threshold):
+            circuit.state = OPEN
+            circuit.opened_at = time.time()
+            circuit.opens += 1
+            logger.warning(f"Circuit for {host} opened after {circuit.failures} failures")
+
+    def abandon(self, host: str):
+        """A call was cancelled without an outcome; let another probe through."""
+        circuit = self._circuits.get(host)
+        if circuit is not None:
+            circuit.probing = False
+
+    def state(self, host: str) -> str:
+        circuit = self._circuits.get(host)
+        return CLOSED if circuit is None else circuit.state
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            host: {
+                "state": circuit.state,
+                "failures": circuit.failures,
+                "opens": circuit.opens,
+                "rejected": circuit.rejected,
+                "retry_in": round(max(0.0, self.reset_timeout - (now - circuit.opened_at)), 1) if circuit.state == OPEN else 0,
+            }
+            for host, circuit in self._circuits.items()
+            if circuit.opens or circuit.failures
+        }
@@ -0,0 +1,330 @@
+"""
+Cache backends shared by all workers.
+
+Stream playlists, channel sessions, AES keys and the channel list are kept in
+a CacheBackend as bytes with a TTL. The in-process caches in backend.py and
+StepDaddy stay in front of it as a local L1. With Redis, single_flight()
+uses a lock so each value is resolved once per cluster instead of once per
+worker.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .latency import remaining
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # Only needed when a Redis URL is configured
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderFailed(Exception):
+    """The worker resolving a single-flight key failed; its waiters share the failure."""
+
+
+class CacheBackend:
+    """Byte values with a TTL, plus short-lived locks for distributed single-flight."""
+
+    name = "base"
+    shared = False  # Whether other workers see the same values
+    poll_interval = 0.05
+    failure_ttl = 2.0  # How long a leader's failure is handed to its waiters
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.leaders = 0
+        self.followers = 0
+        self.fallbacks = 0
+        self.failed = 0
+
+    async def get(self, key: str, min_ttl: float = 0.0) -> Optional[bytes]:
+        """Return the value for key, or None if it is missing or expires within min_ttl seconds."""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def claim(self, key: str, value: bytes) -> bytes:
+        """Store value under key without expiry unless a value is already there; return the stored one."""
+        raise NotImplementedError
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        """Take the lock for ttl seconds; returns a release token, or None if someone holds it."""
+        raise NotImplementedError
+
+    async def release_lock(self, key: str, token: str):
+        raise NotImplementedError
+
+    async def register(self, group: str, member: str, ttl: float):
+        """Announce member in group for ttl seconds; repeat to stay listed."""
+        raise NotImplementedError
+
+    async def unregister(self, group: str, member: str):
+        raise NotImplementedError
+
+    async def members(self, group: str) -> List[str]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def single_flight(
+        self,
+        key: str,
+        ttl: float,
+        factory: Callable[[], Awaitable[bytes]],
+        min_ttl: float = 0.0,
+        lock_ttl: float = 15.0,
+    ) -> bytes:
+        """Return the cached value for key, computing it with factory at most once across workers.
+
+        The lock holder stores its result; everyone else polls for it. If the
+        holder fails, its waiters get LeaderFailed instead of retrying one after
+        another. Waiting is capped by the caller's request budget, if any, and
+        runs out with asyncio.TimeoutError; without a budget, a value that
+        doesn't show up within lock_ttl is computed locally rather than failing.
+        """
+        value = await self.get(key, min_ttl)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        lock = f"lock:{key}"
+        failure = f"failed:{key}"
+        left = remaining()
+        deadline = time.monotonic() + (lock_ttl if left is None else max(0.0, min(lock_ttl, left)))
+        while True:
+            token = await self.acquire_lock(lock, lock_ttl)
+            if token is not None:
+                try:
+                    await self.delete(failure)  # Left by an earlier leader, not this round's
+                    try:
+                        value = await factory()
+                    except Exception as e:
+                        await self.set(failure, (str(e) or type(e).__name__).encode(), self.failure_ttl)
+                        raise
+                    await self.set(key, value, ttl)
+                    self.leaders += 1
+                    return value
+                finally:
+                    await self.release_lock(lock, token)
+            if time.monotonic() >= deadline:
+                break
+            # Another worker is resolving this key; its result (or failure) lands in the cache
+            await asyncio.sleep(self.poll_interval)
+            value = await self.get(key, min_ttl)
+            if value is not None:
+                self.followers += 1
+                return value
+            error = await self.get(failure)
+            if error is not None:
+                self.failed += 1
+                raise LeaderFailed(f"Resolving {key} failed on another worker: {error.decode()}")
+        if left is not None and left <= lock_ttl:
+            raise asyncio.TimeoutError(f"No time left in the budget waiting for {key}")
+        self.fallbacks += 1
+        logger.warning(f"Timed out waiting for another worker to resolve {key}, resolving locally")
+        return await factory()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "fallbacks": self.fallbacks,
+            "failed": self.failed,
+        }
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process backend, used when no Redis is configured."""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int = 10000):
+        super().__init__()
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()  # key -> (value, expires_at)
+        self._locks: Dict[str, Tuple[str, float]] = {}  # key -> (token, expires_at)
+        self._groups: Dict[str, Dict[str, float]] = {}  # group -> member -> expires_at
+
+    async def get(self, key: str, min_ttl: float = 0.0) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            del self._data[key]
+            return None
+        if remaining < min_ttl:
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._data[key] = (value, time.time() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def claim(self, key: str, value: bytes) -> bytes:
+        stored = await self.get(key)
+        if stored is None:
+            await self.set(key, value, float("inf"))
+            stored = value
+        return stored
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        held = self._locks.get(key)
+        if held is not None and held[1] > time.time():
+            return None
+        token = uuid.uuid4().hex
+        self._locks[key] = (token, time.time() + ttl)
+        return token
+
+    async def release_lock(self, key: str, token: str):
+        held = self._locks.get(key)
+        if held is not None and held[0] == token:
+            del self._locks[key]
+
+    async def register(self, group: str, member: str, ttl: float):
+        self._groups.setdefault(group, {})[member] = time.time() + ttl
+
+    async def unregister(self, group: str, member: str):
+        self._groups.get(group, {}).pop(member, None)
+
+    async def members(self, group: str) -> List[str]:
+        now = time.time()
+        return sorted(member for member, expires_at in self._groups.get(group, {}).items() if expires_at > now)
+
+    def stats(self) -> dict:
+        return dict(super().stats(), entries=len(self._data))
+
+
+class RedisBackend(CacheBackend):
+    """Backend shared through Redis. Redis errors degrade to cache misses and local resolution."""
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, client, prefix: str = "freesky:"):
+        super().__init__()
+        self._client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    def _error(self, operation: str, e: Exception):
+        self.errors += 1
+        logger.warning(f"Redis {operation} failed: {str(e)}")
+
+    async def get(self, key: str, min_ttl: float = 0.0) -> Optional[bytes]:
+        try:
+            if min_ttl <= 0:
+                return await self._client.get(self.prefix + key)
+            async with self._client.pipeline(transaction=False) as pipe:
+                pipe.get(self.prefix + key)
+                pipe.pttl(self.prefix + key)
+                value, remaining_ms = await pipe.execute()
+        except redis.RedisError as e:
+            self._error("get", e)
+            return None
+        if value is None or 0 <= remaining_ms < min_ttl * 1000:
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        try:
+            await self._client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+        except redis.RedisError as e:
+            self._error("set", e)
+
+    async def delete(self, key: str):
+        try:
+            await self._client.delete(self.prefix + key)
+        except redis.RedisError as e:
+            self._error("delete", e)
+
+    async def claim(self, key: str, value: bytes) -> bytes:
+        # Unlike the cache operations, errors propagate: callers can't fall back to a local value
+        await self._client.set(self.prefix + key, value, nx=True)
+        return await self._client.get(self.prefix + key)
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self._client.set(self.prefix + key, token, nx=True, px=max(1, int(ttl * 1000)))
+        except redis.RedisError as e:
+            self._error("lock", e)
+            return token  # Without Redis every worker resolves for itself
+        return token if acquired else None
+
+    async def release_lock(self, key: str, token: str):
+        # Only delete the lock if it is still ours; it may have expired and been retaken
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.prefix + key)
+                held = await pipe.get(self.prefix + key)
+                if held is not None and held.decode() == token:
+                    pipe.multi()
+                    pipe.delete(self.prefix + key)
+                    await pipe.execute()
+                else:
+                    await pipe.unwatch()
+        except redis.WatchError:
+            pass
+        except redis.RedisError as e:
+            self._error("unlock", e)
+
+    async def register(self, group: str, member: str, ttl: float):
+        # Sorted set scored by expiry, so stale members can be trimmed by score
+        try:
+            await self._client.zadd(self.prefix + group, {member: time.time() + ttl})
+        except redis.RedisError as e:
+            self._error("register", e)
+
+    async def unregister(self, group: str, member: str):
+        try:
+            await self._client.zrem(self.prefix + group, member)
+        except redis.RedisError as e:
+            self._error("unregister", e)
+
+    async def members(self, group: str) -> List[str]:
+        try:
+            await self._client.zremrangebyscore(self.prefix + group, "-inf", time.time())
+            members = await self._client.zrange(self.prefix + group, 0, -1)
+        except redis.RedisError as e:
+            self._error("members", e)
+            return []
+        return sorted(member.decode() for member in members)
+
+    async def close(self):
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        return dict(super().stats(), errors=self.errors)
+
+
+def create_backend(url: str = "") -> CacheBackend:
+    """RedisBackend for a redis:// URL, otherwise a MemoryBackend."""
+    if not url:
+        return MemoryBackend()
+    if redis is None:
+        logger.warning("Redis URL configured but the redis package is not installed, caching per worker")
+        return MemoryBackend()
+    return RedisBackend(redis.from_url(url))
@@ -0,0 +1,131 @@
+"""
+Cluster mode: several freesky nodes splitting upstream work by ownership.
+
+Every channel (and every segment directory) has one owner node, picked by
+rendezvous hashing over the member list. Other nodes fetch playlists and
+segments from the owner's /cluster endpoints instead of from upstream, so
+upstream load grows with the number of channels rather than the number of
+nodes. Members come from a static list or register themselves in the shared
+cache backend.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+from .cache_backend import CacheBackend
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Freesky-Cluster"
+
+# Set while handling a request from another node, which must be served locally and never forwarded
+internal_request: ContextVar[bool] = ContextVar("internal_request", default=False)
+
+
+def score(member: str, key: str) -> int:
+    digest = hashlib.blake2b(f"{member}|{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Cluster:
+    """Rendezvous-hash ownership over the current member list."""
+
+    def __init__(
+        self,
+        self_url: str,
+        members: Iterable[str] = (),
+        backend: Optional[CacheBackend] = None,
+        secret: str = "",
+        member_ttl: float = 15.0,
+        down_for: float = 10.0,
+    ):
+        self.self_url = self_url.rstrip("/")
+        self.static = bool(members)
+        self.backend = backend
+        self.secret = secret
+        self.member_ttl = member_ttl
+        self.down_for = down_for
+        self.members: List[str] = []
+        self._owners: Dict[str, str] = {}  # key -> owner, reset whenever membership changes
+        self._down: Dict[str, float] = {}  # member -> retry after
+        self.forwarded = 0
+        self.forward_failures = 0
+        self.set_members(members)
+
+    def set_members(self, members: Iterable[str]):
+        members = sorted({member.rstrip("/") for member in members} | {self.self_url})
+        if members != self.members:
+            if self.members:
+                logger.info(f"Cluster membership changed: {members}")
+            self.members = members
+            self._owners.clear()
+
+    def owner(self, key: str) -> str:
+        owner = self._owners.get(key)
+        if owner is None:
+            owner = self._owners[key] = max(self.members, key=lambda member: score(member, key))
+        return owner
+
+    def remote_owner(self, key: str) -> Optional[str]:
+        """The owner of key if it is another reachable node and this request may be forwarded."""
+        if internal_request.get():
+            return None
+        owner = self.owner(key)
+        if owner == self.self_url or self._down.get(owner, 0) > time.time():
+            return None
+        return owner
+
+    def internal_url(self, owner: str, path: str) -> str:
+        return f"{owner}/cluster/{quote(path)}"
+
+    def headers(self) -> dict:
+        return {SECRET_HEADER: self.secret} if self.secret else {}
+
+    def authorized(self, header_value: Optional[str]) -> bool:
+        return not self.secret or hmac.compare_digest(header_value or "", self.secret)
+
+    def forward_failed(self, owner: str, error: Exception):
+        """Serve locally for a while after an owner could not be reached or refused a request.
+
+        The caller resolves the failed request locally too.
+        """
+        self.forward_failures += 1
+        self._down[owner] = time.time() + self.down_for
+        logger.warning(f"Cluster owner {owner} failed, serving locally: {str(error)}")
+
+    async def run(self, interval: float = 5.0):
+        """Keep this node registered and refresh the member list from the shared backend."""
+        if self.static or self.backend is None:
+            return
+        while True:
+            try:
+                await self.backend.register("cluster", self.self_url, self.member_ttl)
+                self.set_members(await self.backend.members("cluster"))
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                logger.info("Cluster membership task cancelled")
+                break
+            except Exception as e:
+                logger.error(f"Error refreshing cluster membership: {str(e)}")
+                await asyncio.sleep(interval)
+
+    async def leave(self):
+        """Drop this node from the shared member list so peers stop routing to it right away."""
+        if self.static or self.backend is None:
+            return
+        await self.backend.unregister("cluster", self.self_url)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "self": self.self_url,
+            "members": self.members,
+            "down": [member for member, until in self._down.items() if until > now],
+            "forwarded": self.forwarded,
+            "forward_failures": self.forward_failures,
+        }
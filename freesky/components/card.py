@@ -2,20 +2,43 @@ import reflex as rx
 from freesky.free_sky import Channel
 
 
-def card(channel: Channel) -> rx.Component:
+def logo_image(channel: Channel, sprite, sprite_size, tiles, object_fit: str, **style) -> rx.Component:
+    """The channel logo: a tile of the shared sprite sheet when it has one, else its own image."""
+    image = rx.image(src=channel.logo, object_fit=object_fit, loading="lazy", **style)
+    if tiles is None:
+        return image
+    return rx.cond(
+        tiles.contains(channel.id),
+        rx.box(
+            background_image="url(" + sprite + ")",
+            background_size=sprite_size,
+            background_position=tiles[channel.id],
+            background_repeat="no-repeat",
+            background_origin="content-box",
+            background_clip="content-box",
+            **style,
+        ),
+        image,
+    )
+
+
+def card(channel: Channel, sprite="", sprite_size="", tiles=None) -> rx.Component:
+    # channel.logo is the grid thumbnail; the blurred background and the icon share it (or the sprite)
     return rx.link(
         rx.box(
-            rx.image(
-                src=channel.logo,
+            logo_image(
+                channel,
+                sprite,
+                sprite_size,
+                tiles,
+                object_fit="cover",
                 position="absolute",
                 width="100%",
                 height="100%",
-                object_fit="cover",
                 filter="blur(10px)",
                 opacity="0.4",
                 z_index="0",
                 padding="1rem",
-                loading="lazy",
             ),
             rx.card(
                 rx.box(
@@ -32,14 +55,16 @@ def card(channel: Channel) -> rx.Component:
                         width="calc(50% - 35px)",
                     ),
                     rx.center(
-                        rx.image(
-                            src=channel.logo,
+                        logo_image(
+                            channel,
+                            sprite,
+                            sprite_size,
+                            tiles,
+                            object_fit="contain",
                             width="64px",
                             height="64px",
-                            object_fit="contain",
                             position="relative",
                             border_radius="8px",
-                            loading="lazy",
                         ),
                     ),
                     position="relative",
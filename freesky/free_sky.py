@@ -1,14 +1,27 @@
 import json
 import re
+import gzip
+import hashlib
 import reflex as rx
 import logging
 import asyncio
+import time
+from dataclasses import asdict, dataclass, field
 from urllib.parse import quote, urlparse
-from curl_cffi import AsyncSession
-from typing import List
-from .utils import encrypt, decrypt, urlsafe_base64, extract_and_decode_var
+from typing import Callable, Dict, List, Optional, Tuple
+from . import m3u8 as m3u8_rewriter
+from .upstream import UpstreamClient, KEY, PLAYLIST, METADATA
+from .latency import LatencyTracker
+from .breaker import CircuitBreaker
+from .utils import tokens, urlsafe_base64, extract_and_decode_var, TokenError
+from .meta_index import MetaIndex, load_index
 from rxconfig import config
 
+try:
+    import brotli
+except ImportError:  # Optional, gzip is always available
+    brotli = None
+
 # Set up logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -17,6 +30,16 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Upstream page patterns, compiled once
+CHANNELS_BLOCK = re.compile("<center><h1(.+?)tab-2", re.MULTILINE | re.DOTALL)
+CHANNEL_ENTRY = re.compile("href=\"(.*)\" target(.*)<strong>(.*)</strong>")
+# Upstream hops of a channel handshake, in order; the media playlist fetch ("m3u8") follows them
+RESOLVE_HOPS = ("stream_page", "source", "auth", "server_lookup")
+
+IFRAME_SRC = re.compile("iframe src=\"(.*)\" width")
+CHANNEL_KEY = re.compile(r"var\s+channelKey\s*=\s*\"(.*?)\";")
+
+
 class Channel(rx.Base):
     id: str
     name: str
@@ -24,24 +47,152 @@ class Channel(rx.Base):
     logo: str
 
 
+@dataclass
+class ChannelSession:
+    """Resolved upstream location of a channel, reused across playlist refreshes."""
+    channel_id: str
+    source_url: str
+    channel_key: str
+    server_url: str
+    key_host: str
+    expires_at: float
+
+
+@dataclass
+class ChannelDiff:
+    """What changed, by channel id, when a new channel list was committed."""
+    channels: List[Channel]  # The committed list
+    source: str  # "upstream" (scraped by this worker), "shared" (adopted from another worker) or "fallback"
+    added: List[Channel] = field(default_factory=list)
+    removed: List[Channel] = field(default_factory=list)
+    renamed: List[Tuple[Channel, Channel]] = field(default_factory=list)  # (old, new)
+    changed: List[Tuple[Channel, Channel]] = field(default_factory=list)  # Logo or tags changed, (old, new)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.renamed or self.changed)
+
+    @property
+    def stale_ids(self) -> List[str]:
+        """Channels whose cached streams and sessions no longer apply: gone, or the id now names another channel."""
+        return [channel.id for channel in self.removed] + [new.id for _, new in self.renamed]
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "renamed": len(self.renamed),
+            "changed": len(self.changed),
+        }
+
+
+def diff_channels(old: List[Channel], new: List[Channel], source: str = "upstream") -> ChannelDiff:
+    previous: Dict[str, Channel] = {}
+    for channel in old:
+        previous.setdefault(channel.id, channel)
+    diff = ChannelDiff(channels=new, source=source)
+    seen = set()
+    for channel in new:
+        if channel.id in seen:
+            continue
+        seen.add(channel.id)
+        before = previous.get(channel.id)
+        if before is None:
+            diff.added.append(channel)
+            continue
+        if before.name != channel.name:
+            diff.renamed.append((before, channel))
+        if before.logo != channel.logo or before.tags != channel.tags:
+            diff.changed.append((before, channel))
+    diff.removed = [channel for channel_id, channel in previous.items() if channel_id not in seen]
+    return diff
+
+
+class SessionExpired(Exception):
+    """Upstream rejected a cached channel session (403/404)."""
+
+
+class PlaylistSnapshot:
+    """The M3U playlist rendered once per channel list, with precompressed variants."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f"\"{digest}\""
+        self.variants = {"gzip": gzip.compress(body, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body)
+        # Strong validators must differ between representations, so each encoding has its own
+        self.etags = {None: self.etag, "gzip": f"\"{digest}-gz\"", "br": f"\"{digest}-br\""}
+
+    def negotiate(self, accept_encoding: str):
+        """Return (body, content_encoding) for the client's Accept-Encoding header."""
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return self.variants[encoding], encoding
+        return self.body, None
+
+    def matches(self, if_none_match: str, encoding: Optional[str] = None) -> bool:
+        """True if an If-None-Match header validates the snapshot in this encoding."""
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == self.etags[encoding] for tag in tags)
+
+
+class ChannelRegistry:
+    """Id index over one channel list, built once and swapped atomically on refresh."""
+
+    def __init__(self, channels: List[Channel]):
+        self.channels = channels
+        self.by_id: Dict[str, Channel] = {}
+        for channel in channels:
+            self.by_id.setdefault(channel.id, channel)
+
+    def get(self, channel_id: str) -> Optional[Channel]:
+        return self.by_id.get(channel_id)
+
+
 class StepDaddy:
     def __init__(self):
         socks5 = config.socks5
-        session_config = {
-            "timeout": 30,  # Add timeout to prevent hanging requests
-            "impersonate": "chrome110",  # Better browser impersonation
-            "max_redirects": 5,  # Limit redirects
-        }
-        
-        if socks5:
-            session_config["proxy"] = f"socks5://{socks5}"
-        
-        self._session = AsyncSession(**session_config)
+        # One pooled client for all upstream traffic, so provider and media pools are tuned together
+        self.upstream = UpstreamClient(
+            max_connections=config.upstream_max_connections,
+            per_host=config.upstream_host_connections,
+            session_connections=config.upstream_session_connections,
+            keepalive=config.upstream_keepalive,
+            reserved=config.upstream_reserved,
+            proxy=f"socks5://{socks5}" if socks5 else None,
+        )
         self._base_url = config.daddylive_uri
-        self.channels = []
+        self.channels = []  # Setter also builds the registry and playlist snapshot
         self._load_lock = asyncio.Lock()  # Prevent concurrent channel loading
-        with open("freesky/meta.json", "r") as f:
-            self._meta = json.load(f)
+        self.latency = LatencyTracker()  # Per-hop percentiles driving timeouts and hedging
+        self.breaker = CircuitBreaker(config.breaker_failures, config.breaker_reset)
+        self._sessions: Dict[str, ChannelSession] = {}  # Long-lived channel sessions
+        self.session_hits = 0
+        self.session_misses = 0
+        self.shared_cache = None  # Optional CacheBackend so workers share sessions
+        self.channel_listeners: List[Callable[[ChannelDiff], None]] = []  # Told what changed on every commit_channels
+        self._meta_index: Optional[MetaIndex] = None  # Loaded on first use, see meta_index
+
+    @property
+    def meta_index(self) -> MetaIndex:
+        if self._meta_index is None:
+            self._meta_index = load_index()
+        return self._meta_index
+
+    @property
+    def channels(self) -> List[Channel]:
+        return self._channels
+
+    @channels.setter
+    def channels(self, channels: List[Channel]):
+        # Render derived views before publishing so readers never see a partial update
+        registry = ChannelRegistry(channels)
+        snapshot = PlaylistSnapshot(self._render_playlist(channels).encode())
+        self._channels = channels
+        self.registry = registry
+        self.playlist_snapshot = snapshot
 
     def _headers(self, referer: str = None, origin: str = None):
         if referer is None:
@@ -59,8 +210,10 @@ class StepDaddy:
         async with self._load_lock:
             channels = []
             try:
+                if self._meta_index is None:
+                    self._meta_index = await asyncio.to_thread(load_index)
                 logger.debug(f"Starting channel load from {self._base_url}/24-7-channels.php")
-                response = await self._session.get(f"{self._base_url}/24-7-channels.php", headers=self._headers())
+                response = await self._request("GET", f"{self._base_url}/24-7-channels.php", METADATA, headers=self._headers())
                 
                 logger.debug(f"Got response with status {response.status_code}")
                 if response.status_code != 200:
@@ -68,7 +221,7 @@ class StepDaddy:
                     return
 
                 logger.debug("Looking for channels block in response")
-                channels_block = re.compile("<center><h1(.+?)tab-2", re.MULTILINE | re.DOTALL).findall(str(response.text))
+                channels_block = CHANNELS_BLOCK.findall(str(response.text))
 
                 if not channels_block:
                     logger.error("No channels block found in response")
@@ -76,7 +229,7 @@ class StepDaddy:
                     return
 
                 logger.debug("Found channels block, extracting channel data")
-                channels_data = re.compile("href=\"(.*)\" target(.*)<strong>(.*)</strong>").findall(channels_block[0])
+                channels_data = CHANNEL_ENTRY.findall(channels_block[0])
                 logger.debug(f"Found {len(channels_data)} raw channel entries")
 
                 # Process channels concurrently for better performance
@@ -101,10 +254,23 @@ class StepDaddy:
             finally:
                 if channels:  # Only update if we successfully loaded channels
                     logger.debug(f"Updating channels list with {len(channels)} channels")
-                    self.channels = sorted(channels, key=lambda channel: (channel.name.startswith("18"), channel.name))
+                    self.commit_channels(sorted(channels, key=lambda channel: (channel.name.startswith("18"), channel.name)))
                 else:
                     logger.warning("No channels were loaded, keeping existing channels list")
 
+    def commit_channels(self, channels: List[Channel], source: str = "upstream") -> ChannelDiff:
+        """Publish a new channel list and tell the listeners what changed."""
+        diff = diff_channels(self._channels, channels, source)
+        self.channels = channels
+        if diff:
+            logger.info(f"Channel list changed ({source}): {diff.summary()}")
+        for listener in self.channel_listeners:
+            try:
+                listener(diff)
+            except Exception as e:
+                logger.error(f"Channel listener failed: {str(e)}")
+        return diff
+
     async def _process_channel_data(self, channel_data):
         """Process a single channel data asynchronously"""
         try:
@@ -115,70 +281,199 @@ class StepDaddy:
 
     def _get_channel(self, channel_data) -> Channel:
         channel_id = channel_data[0].split('-')[1].replace('.php', '')
-        channel_name = channel_data[2]
-        if channel_id == "666":
-            channel_name = "Nick Music"
-        if channel_id == "609":
-            channel_name = "Yas TV UAE"
-        if channel_data[2] == "#0 Spain":
-            channel_name = "Movistar Plus+"
-        elif channel_data[2] == "#Vamos Spain":
-            channel_name = "Vamos Spain"
-        clean_channel_name = re.sub(r"\s*\(.*?\)", "", channel_name)
-        meta = self._meta.get(clean_channel_name, {})
+        channel_name = self.meta_index.display_name(channel_id, channel_data[2])
+        meta = self.meta_index.lookup(channel_name) or {}
         logo = meta.get("logo", "/missing.png")
         if logo.startswith("http"):
             logo = f"/api/logo/{urlsafe_base64(logo)}"
         return Channel(id=channel_id, name=channel_name, tags=meta.get("tags", []), logo=logo)
 
-    async def stream(self, channel_id: str):
+    async def stream(self, channel_id: str, variant: Optional[str] = None):
+        """Return the rewritten playlist for a channel, or for one of its variants."""
+        url = self.variant_url(channel_id, variant)
         try:
-            url = f"{self._base_url}/stream/stream-{channel_id}.php"
-            if len(channel_id) > 3:
-                url = f"{self._base_url}/stream/bet.php?id=bet{channel_id}"
-            
-            # Use semaphore to limit concurrent stream requests
-            semaphore = self._get_stream_semaphore()
-            async with semaphore:
-                response = await self._session.post(url, headers=self._headers())
-                source_url = re.compile("iframe src=\"(.*)\" width").findall(response.text)[0]
-                source_response = await self._session.post(source_url, headers=self._headers(url))
-
-                # Not generic
-                channel_key = re.compile(r"var\s+channelKey\s*=\s*\"(.*?)\";").findall(source_response.text)[-1]
-                auth_ts = extract_and_decode_var("__c", source_response.text)
-                auth_sig = extract_and_decode_var("__e", source_response.text)
-                auth_path = extract_and_decode_var("__b", source_response.text)
-                auth_rnd = extract_and_decode_var("__d", source_response.text)
-                auth_url = extract_and_decode_var("__a", source_response.text)
-                auth_request_url = f"{auth_url}{auth_path}?channel_id={channel_key}&ts={auth_ts}&rnd={auth_rnd}&sig={auth_sig}"
-                auth_response = await self._session.get(auth_request_url, headers=self._headers(source_url))
-                if auth_response.status_code != 200:
-                    raise ValueError("Failed to get auth response")
-                key_url = urlparse(source_url)
-                key_url = f"{key_url.scheme}://{key_url.netloc}/server_lookup.php?channel_id={channel_key}"
-                key_response = await self._session.get(key_url, headers=self._headers(source_url))
-                server_key = key_response.json().get("server_key")
-                if not server_key:
-                    raise ValueError("No server key found in response")
-                if server_key == "top1/cdn":
-                    server_url = f"https://top1.newkso.ru/top1/cdn/{channel_key}/mono.m3u8"
-                else:
-                    server_url = f"https://{server_key}new.newkso.ru/{server_key}/{channel_key}/mono.m3u8"
-                m3u8 = await self._session.get(server_url, headers=self._headers(quote(str(source_url))))
-                m3u8_data = ""
-                for line in m3u8.text.split("\n"):
-                    if line.startswith("#EXT-X-KEY:"):
-                        original_url = re.search(r'URI="(.*?)"', line).group(1)
-                        line = line.replace(original_url, f"/api/key/{encrypt(original_url)}/{encrypt(urlparse(source_url).netloc)}")
-                    elif line.startswith("http") and config.proxy_content:
-                        line = f"/api/content/{encrypt(line)}"
-                    m3u8_data += line + "\n"
-                return m3u8_data
+            session = await self.channel_session(channel_id)
+            try:
+                # Leave room in the budget to redo the handshake if this session turns out stale
+                return await self.media_playlist(session, url, then=RESOLVE_HOPS + ("m3u8",))
+            except (SessionExpired, asyncio.TimeoutError) as e:
+                if not self.latency.fits(RESOLVE_HOPS + ("m3u8",)):
+                    raise
+                # Upstream rejected or stalled on the cached session, redo the handshake once
+                logger.info(f"Channel session for {channel_id} failed ({e!r}), re-resolving")
+                await self.invalidate_session(channel_id)
+                session = await self.channel_session(channel_id)
+                return await self.media_playlist(session, url)
         except Exception as e:
             logger.error(f"Error in stream method for channel {channel_id}: {str(e)}")
             raise
 
+    @staticmethod
+    def variant_url(channel_id: str, variant: Optional[str]) -> Optional[str]:
+        """Upstream URL of a variant token minted for this channel, raising TokenError otherwise."""
+        if not variant:
+            return None
+        token = tokens.resolve(variant)
+        if token.channel_id != channel_id:
+            raise TokenError("Token belongs to another channel")
+        return token.url
+
+    async def channel_session(self, channel_id: str) -> "ChannelSession":
+        """Return a cached channel session, running the auth handshake on miss."""
+        session = self._sessions.get(channel_id)
+        if session is not None and time.time() < session.expires_at:
+            self.session_hits += 1
+            return session
+        self.session_misses += 1
+        if self.shared_cache is None:
+            session = await self._resolve_session(channel_id)
+        else:
+            async def resolve():
+                return json.dumps(asdict(await self._resolve_session(channel_id))).encode()
+
+            # One worker runs the handshake, the others pick up its session
+            payload = await self.shared_cache.single_flight(f"session:{channel_id}", config.session_ttl, resolve)
+            session = ChannelSession(**json.loads(payload))
+        self._sessions[channel_id] = session
+        return session
+
+    async def invalidate_session(self, channel_id: str):
+        self._sessions.pop(channel_id, None)
+        if self.shared_cache is not None:
+            await self.shared_cache.delete(f"session:{channel_id}")
+
+    def session_stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.session_hits,
+            "misses": self.session_misses,
+        }
+
+    async def _resolve_session(self, channel_id: str) -> "ChannelSession":
+        url = f"{self._base_url}/stream/stream-{channel_id}.php"
+        if len(channel_id) > 3:
+            url = f"{self._base_url}/stream/bet.php?id=bet{channel_id}"
+
+        # Use semaphore to limit concurrent stream requests
+        semaphore = self._get_stream_semaphore()
+        async with semaphore:
+            response = await self._hop("stream_page", "POST", url, headers=self._headers())
+            source_url = IFRAME_SRC.findall(response.text)[0]
+            source_response = await self._hop("source", "POST", source_url, headers=self._headers(url))
+
+            # Not generic
+            channel_key = CHANNEL_KEY.findall(source_response.text)[-1]
+            auth_ts = extract_and_decode_var("__c", source_response.text)
+            auth_sig = extract_and_decode_var("__e", source_response.text)
+            auth_path = extract_and_decode_var("__b", source_response.text)
+            auth_rnd = extract_and_decode_var("__d", source_response.text)
+            auth_url = extract_and_decode_var("__a", source_response.text)
+            auth_request_url = f"{auth_url}{auth_path}?channel_id={channel_key}&ts={auth_ts}&rnd={auth_rnd}&sig={auth_sig}"
+            auth_response = await self._hop("auth", "GET", auth_request_url, headers=self._headers(source_url))
+            if auth_response.status_code != 200:
+                raise ValueError("Failed to get auth response")
+            key_url = urlparse(source_url)
+            key_url = f"{key_url.scheme}://{key_url.netloc}/server_lookup.php?channel_id={channel_key}"
+            key_response = await self._hop("server_lookup", "GET", key_url, hedge=True, headers=self._headers(source_url))
+            server_key = key_response.json().get("server_key")
+            if not server_key:
+                raise ValueError("No server key found in response")
+            if server_key == "top1/cdn":
+                server_url = f"https://top1.newkso.ru/top1/cdn/{channel_key}/mono.m3u8"
+            else:
+                server_url = f"https://{server_key}new.newkso.ru/{server_key}/{channel_key}/mono.m3u8"
+            return ChannelSession(
+                channel_id=channel_id,
+                source_url=source_url,
+                channel_key=channel_key,
+                server_url=server_url,
+                key_host=urlparse(source_url).netloc,
+                expires_at=time.time() + config.session_ttl,
+            )
+
+    async def media_playlist(self, session: "ChannelSession", url: Optional[str] = None, then=()) -> str:
+        """Fetch and rewrite a playlist for an already resolved session.
+
+        url defaults to the session's playlist; variant playlists of a master
+        playlist are fetched with the same session. then names the hops that
+        should still fit in the budget afterwards.
+        """
+        url = url or session.server_url
+        m3u8 = await self._hop(
+            "m3u8", "GET", url, then=then, hedge=True, headers=self._headers(quote(str(session.source_url)))
+        )
+        if m3u8.status_code in (403, 404):
+            raise SessionExpired(f"HTTP {m3u8.status_code} from {url}")
+        if m3u8_rewriter.is_master(m3u8.text):
+            return self._rewrite_master(session, m3u8.text, url)
+        key_host = tokens.encode(session.key_host)
+
+        def rewrite_uri(kind: str, url: str, tag: str):
+            if kind == m3u8_rewriter.KEY:
+                return f"/api/key/{tokens.encode(url, session.channel_id)}/{key_host}"
+            if kind == m3u8_rewriter.SEGMENT and config.proxy_content:
+                return f"/api/content/{tokens.encode(url, session.channel_id)}"
+            return None
+
+        return m3u8_rewriter.rewrite(m3u8.text, url, rewrite_uri)
+
+    def _rewrite_master(self, session: "ChannelSession", text: str, url: str) -> str:
+        """Point every variant and rendition at /api/stream/{id}/{variant}.m3u8."""
+        cap = config.max_bitrate
+        bandwidths = m3u8_rewriter.variant_bandwidths(text)
+        if cap and bandwidths and min(bandwidths) > cap:
+            cap = min(bandwidths)  # Never drop every variant, keep the lowest
+
+        def rewrite_uri(kind: str, uri: str, tag: str):
+            if kind == m3u8_rewriter.KEY:
+                return f"/api/key/{tokens.encode(uri, session.channel_id)}/{tokens.encode(session.key_host)}"
+            if kind == m3u8_rewriter.VARIANT and cap:
+                bandwidth = m3u8_rewriter.bandwidth(tag)
+                if bandwidth is not None and bandwidth > cap:
+                    return m3u8_rewriter.DROP
+            # Players keep re-polling variant URLs for as long as they play, so they never expire
+            return f"/api/stream/{session.channel_id}/{tokens.encode(uri, session.channel_id, expires=0)}.m3u8"
+
+        return m3u8_rewriter.rewrite(text, url, rewrite_uri)
+
+    async def _hop(self, hop: str, method: str, url: str, purpose: int = PLAYLIST, then=(), hedge: bool = False, **kwargs):
+        """One timed upstream request; timeouts follow the hop's latency, GETs may be hedged."""
+        if not then and hop in RESOLVE_HOPS:
+            then = RESOLVE_HOPS[RESOLVE_HOPS.index(hop) + 1:] + ("m3u8",)
+
+        sent = False
+
+        async def send(timeout: float):
+            nonlocal sent
+            sent = True
+            return await self._request(method, url, purpose, timeout=timeout, **kwargs)
+
+        try:
+            return await self.latency.call(hop, send, then=then, hedge=hedge)
+        except asyncio.TimeoutError:
+            # An exhausted budget raises before anything is sent; that's not the host's fault
+            if sent:
+                self.breaker.failure(urlparse(url).netloc)
+            raise
+
+    async def _request(self, method: str, url: str, purpose: int, **kwargs):
+        """Upstream request guarded by the host's circuit breaker; 5xx and errors count as failures."""
+        host = urlparse(url).netloc
+        self.breaker.check(host)
+        try:
+            response = await self.upstream.request(method, url, purpose, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.abandon(host)
+            raise
+        except Exception:
+            self.breaker.failure(host)
+            raise
+        if response.status_code >= 500:
+            self.breaker.failure(host)
+        else:
+            self.breaker.success(host)
+        return response
+
     # Semaphore for limiting concurrent stream requests
     _stream_semaphore = None
     
@@ -189,24 +484,32 @@ class StepDaddy:
         return self._stream_semaphore
 
     async def key(self, url: str, host: str):
-        url = decrypt(url)
-        host = decrypt(host)
-        response = await self._session.get(url, headers=self._headers(f"{host}/", host), timeout=60)
+        url = tokens.decode(url)
+        host = tokens.decode(host)
+        response = await self._hop("key", "GET", url, KEY, hedge=True, headers=self._headers(f"{host}/", host))
         if response.status_code != 200:
             raise Exception(f"Failed to get key")
         return response.content
 
     @staticmethod
     def content_url(path: str):
-        return decrypt(path)
+        return tokens.decode(path)
+
+    @staticmethod
+    def key_url(path: str):
+        return tokens.decode(path)
 
     def playlist(self):
-        data = "#EXTM3U\n"
-        for channel in self.channels:
+        return self.playlist_snapshot.body.decode()
+
+    @staticmethod
+    def _render_playlist(channels: List[Channel]) -> str:
+        lines = ["#EXTM3U\n"]
+        for channel in channels:
             entry = f" tvg-logo=\"{channel.logo}\",{channel.name}" if channel.logo else f",{channel.name}"
-            data += f"#EXTINF:-1{entry}\n{config.api_url}/api/stream/{channel.id}.m3u8\n"
-        return data
+            lines.append(f"#EXTINF:-1{entry}\n{config.api_url}/api/stream/{channel.id}.m3u8\n")
+        return "".join(lines)
 
     async def schedule(self):
-        response = await self._session.get(f"{self._base_url}/schedule/schedule-generated.php", headers=self._headers())
+        response = await self._request("GET", f"{self._base_url}/schedule/schedule-generated.php", METADATA, headers=self._headers())
         return response.json()
@@ -1,7 +1,7 @@
 import reflex as rx
 import asyncio
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional
 import freesky.pages
 from freesky import backend
 from freesky.components import navbar, card
@@ -13,6 +13,9 @@ class State(rx.State):
     
     # Channel data
     channels: List[Channel] = []
+    logo_sprite: str = ""  # Sprite sheet of every grid logo, from the backend's logo manifest
+    logo_sprite_size: str = ""
+    logo_tiles: Dict[str, str] = {}  # Channel id -> background-position in logo_sprite
     search_query: str = ""
     
     # Real-time status
@@ -95,7 +98,20 @@ class State(rx.State):
                     if response.status_code == 200:
                         data = response.json()
                         if data.get("channels"):
-                            self.channels = [Channel(**channel_data) for channel_data in data["channels"]]
+                            # The grid shows the small versioned thumbnail rather than the full logo
+                            self.channels = [
+                                Channel(
+                                    id=channel_data["id"],
+                                    name=channel_data["name"],
+                                    tags=channel_data["tags"],
+                                    logo=channel_data.get("thumbnail") or channel_data["logo"],
+                                )
+                                for channel_data in data["channels"]
+                            ]
+                            sprite = data.get("logo_sprite") or {}
+                            self.logo_sprite = sprite.get("src", "")
+                            self.logo_sprite_size = sprite.get("background_size", "")
+                            self.logo_tiles = sprite.get("positions", {})
                             self.channels_count = len(self.channels)
                             self.connection_status = "connected"
                             self.ws_connected = True
@@ -354,7 +370,7 @@ def channels_grid() -> rx.Component:
                     rx.grid(
                         rx.foreach(
                             State.filtered_channels,
-                            lambda channel: card(channel),
+                            lambda channel: card(channel, State.logo_sprite, State.logo_sprite_size, State.logo_tiles),
                         ),
                         grid_template_columns="repeat(auto-fill, minmax(250px, 1fr))",
                         spacing=rx.breakpoints(
@@ -429,5 +445,6 @@ app = rx.App(
     api_transformer=backend.fastapi_app,
 )
 
-# Register the background channel update task
-app.register_lifespan_task(backend.update_channels)
+# Reflex runs its own lifespan, not the mounted FastAPI app's: start the channel
+# updates, pre-warmer, prefetcher, spool janitor and cluster membership from it
+app.register_lifespan_task(backend.lifespan)
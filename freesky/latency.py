@@ -0,0 +1,175 @@
+"""
+Per-hop upstream latency tracking, adaptive timeouts and hedged requests.
+
+Each named hop of stream resolution (and key fetching) keeps a rolling
+window of latencies. Hop timeouts follow that hop's p95, and are capped so
+the hops still to come (or a retry) fit in the caller's budget. Idempotent
+GETs can be hedged: once the p95 has passed without an answer, a second
+identical request is sent and whichever answers first wins.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional
+
+# Monotonic time by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("upstream_deadline", default=None)
+
+
+@contextmanager
+def budget(seconds: float):
+    """Give upstream calls made in this context (and tasks it starts) seconds to finish."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class _Hop:
+    def __init__(self, window: int):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self._sorted: Optional[List[float]] = None
+        self.timeouts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, q: float) -> float:
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class LatencyTracker:
+    """Rolling p50/p95 per hop, and the timeouts and hedge delays derived from them."""
+
+    def __init__(
+        self,
+        window: int = 200,
+        min_samples: int = 10,
+        multiplier: float = 3.0,
+        floor: float = 1.0,
+        ceiling: float = 15.0,
+        initial: float = 8.0,
+        expected: float = 0.5,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.initial = initial
+        self.default_expected = expected
+        self._hops: Dict[str, _Hop] = {}
+
+    def _hop(self, hop: str) -> _Hop:
+        state = self._hops.get(hop)
+        if state is None:
+            state = self._hops[hop] = _Hop(self.window)
+        return state
+
+    def _warm(self, hop: str) -> Optional[_Hop]:
+        state = self._hops.get(hop)
+        return state if state is not None and len(state.samples) >= self.min_samples else None
+
+    def expected(self, hop: str) -> float:
+        """Typical (p50) latency of a hop."""
+        state = self._warm(hop)
+        return state.percentile(0.5) if state else self.default_expected
+
+    def fits(self, hops: Iterable[str]) -> bool:
+        """True if the hops would typically finish within the remaining budget."""
+        left = remaining()
+        return left is None or left >= sum(self.expected(hop) for hop in hops)
+
+    def timeout(self, hop: str, then: Iterable[str] = ()) -> float:
+        """Timeout for hop: a multiple of its p95, leaving typical time for the hops in then."""
+        state = self._warm(hop)
+        adaptive = self.initial if state is None else min(self.ceiling, max(self.floor, state.percentile(0.95) * self.multiplier))
+        left = remaining()
+        if left is None:
+            return adaptive
+        if left <= 0:
+            raise asyncio.TimeoutError(f"No time left in the budget for {hop}")
+        share = left - sum(self.expected(later) for later in then)
+        return min(adaptive, share if share >= self.floor else left)
+
+    async def call(
+        self,
+        hop: str,
+        send: Callable[[float], Awaitable],
+        then: Iterable[str] = (),
+        hedge: bool = False,
+    ):
+        """Run send(timeout) for hop, timing it and hedging it if allowed."""
+        state = self._hop(hop)
+        timeout = self.timeout(hop, then)
+        started = time.monotonic()
+        try:
+            if hedge and self._warm(hop) and state.percentile(0.95) < timeout:
+                result = await self._hedged(state, send, timeout)
+            else:
+                result = await asyncio.wait_for(send(timeout), timeout)
+        except asyncio.TimeoutError:
+            state.timeouts += 1
+            state.observe(timeout)  # Slow hops must push the percentiles up
+            raise
+        state.observe(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, state: _Hop, send: Callable[[float], Awaitable], timeout: float):
+        started = time.monotonic()
+        first = asyncio.ensure_future(send(timeout))
+        hedge = None
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=state.percentile(0.95))
+            if not done:
+                # Slower than 95% of its peers, race an identical second request
+                state.hedged += 1
+                hedge = asyncio.ensure_future(send(timeout - (time.monotonic() - started)))
+                pending.add(hedge)
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            state.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    raise done.pop().exception()
+                left = timeout - (time.monotonic() - started)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, left), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        hops = {}
+        for hop, state in self._hops.items():
+            if not state.samples:
+                continue
+            hops[hop] = {
+                "samples": len(state.samples),
+                "p50": round(state.percentile(0.5), 3),
+                "p95": round(state.percentile(0.95), 3),
+                "timeout": round(self.timeout(hop), 3),
+                "timeouts": state.timeouts,
+                "hedged": state.hedged,
+                "hedge_wins": state.hedge_wins,
+            }
+        return hops
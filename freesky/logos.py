@@ -0,0 +1,295 @@
+"""
+Channel logo store: upstream originals and pre-resized WebP thumbnails.
+
+Logos are keyed by a hash of their upstream URL, so different URLs sharing
+a file name never collide. Encoded images sit in an in-memory byte LRU in
+front of the on-disk cache, disk reads and writes run in a thread, and
+concurrent requests for the same logo share one upstream fetch and one
+resize. Thumbnails need Pillow; without it the original is served.
+
+After each channel refresh every logo is pre-warmed and a versioned
+manifest is built: immutable thumbnail URLs for the channel grid and,
+with Pillow, one sprite sheet holding all of them.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .spool import read_file, write_atomic
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SIZES = (64, 128)
+
+_SIGNATURES = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"<svg", "image/svg+xml"),
+    (b"<?xml", "image/svg+xml"),
+)
+
+
+class LogoNotFound(Exception):
+    """Upstream has no logo at this URL."""
+
+
+class Logo:
+    """An encoded logo ready to send."""
+
+    __slots__ = ("body", "media_type", "etag")
+
+    def __init__(self, body: bytes, media_type: str, etag: str):
+        self.body = body
+        self.media_type = media_type
+        self.etag = etag
+
+    @classmethod
+    def from_bytes(cls, body: bytes) -> "Logo":
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        return cls(body, media_type(body), f'"{digest}"')
+
+
+def media_type(body: bytes) -> str:
+    if body[:4] == b"RIFF" and body[8:12] == b"WEBP":
+        return "image/webp"
+    head = body[:64].lstrip()
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return "application/octet-stream"
+
+
+def snap_size(size: int) -> int:
+    """The smallest thumbnail size covering size, or 0 (the original) if none does."""
+    if size <= 0:
+        return 0
+    return next((candidate for candidate in SIZES if candidate >= size), 0)
+
+
+def thumbnail(body: bytes, size: int) -> Optional[bytes]:
+    """Resize an image to fit size x size as WebP, or None if it can't be decoded."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            image = image.convert("RGBA")
+            image.thumbnail((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "WEBP", quality=80, method=4)
+            return out.getvalue()
+    except Exception as e:
+        logger.debug(f"Can't thumbnail logo: {str(e)}")
+        return None
+
+
+class LogoStore:
+    """Memory LRU -> disk -> upstream lookup for logos and their thumbnails."""
+
+    def __init__(
+        self,
+        directory: str,
+        fetch: Callable[[str], Awaitable[bytes]],
+        flights,
+        memory_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.fetch = fetch  # url -> original bytes, raising LogoNotFound
+        self.flights = flights  # SingleFlight shared with the caller
+        self.memory_bytes = memory_bytes
+        self.memory_used = 0
+        self._memory: "OrderedDict[Tuple[str, int], Logo]" = OrderedDict()
+        self.stats_by_tier: Dict[str, int] = {"memory": 0, "disk": 0, "upstream": 0, "resized": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def path_for(self, digest: str, size: int) -> str:
+        return os.path.join(self.directory, f"{digest}-{size}.webp" if size else digest)
+
+    async def get(self, url: str, size: int = 0) -> Logo:
+        """The logo at url, resized to a thumbnail size if size is one of SIZES."""
+        size = snap_size(size)
+        digest = self.key(url)
+        logo = self._memory.get((digest, size))
+        if logo is not None:
+            self._memory.move_to_end((digest, size))
+            self.stats_by_tier["memory"] += 1
+            return logo
+        return await self.flights.do(f"logo:{digest}:{size}", lambda: self._load(url, digest, size))
+
+    async def _load(self, url: str, digest: str, size: int) -> Logo:
+        body = await self._read(self.path_for(digest, size))
+        if body is not None:
+            self.stats_by_tier["disk"] += 1
+        elif size:
+            original = await self.get(url)
+            body = await asyncio.to_thread(thumbnail, original.body, size)
+            if body is None:
+                # Not resizable (e.g. SVG) or no Pillow; remember that so the decode isn't retried
+                self._remember((digest, size), original)
+                return original
+            self.stats_by_tier["resized"] += 1
+            await self._write(self.path_for(digest, size), body)
+        else:
+            body = await self.fetch(url)
+            self.stats_by_tier["upstream"] += 1
+            await self._write(self.path_for(digest, size), body)
+        logo = Logo.from_bytes(body)
+        self._remember((digest, size), logo)
+        return logo
+
+    async def _read(self, path: str) -> Optional[bytes]:
+        try:
+            return await asyncio.to_thread(read_file, path)
+        except FileNotFoundError:
+            return None
+
+    async def _write(self, path: str, body: bytes):
+        try:
+            await asyncio.to_thread(write_atomic, path, [body])
+        except OSError as e:
+            logger.warning(f"Failed to cache logo to {path}: {str(e)}")
+
+    def _remember(self, key: Tuple[str, int], logo: Logo):
+        if len(logo.body) > self.memory_bytes // 4:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self.memory_used -= len(previous.body)
+        self._memory[key] = logo
+        self.memory_used += len(logo.body)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_used -= len(evicted.body)
+
+    async def prewarm(self, urls: List[str], size: int, concurrency: int = 8) -> Dict[str, Logo]:
+        """Load every url at size with bounded concurrency; failures are left out."""
+        semaphore = asyncio.Semaphore(concurrency)
+        results: Dict[str, Logo] = {}
+
+        async def load(url: str):
+            async with semaphore:
+                try:
+                    results[url] = await self.get(url, size)
+                except Exception as e:
+                    logger.debug(f"Failed to pre-warm logo {url}: {str(e)}")
+
+        await asyncio.gather(*(load(url) for url in urls))
+        return results
+
+    def stats(self) -> dict:
+        return dict(
+            self.stats_by_tier,
+            entries=len(self._memory),
+            memory_bytes=self.memory_used,
+            thumbnails=Image is not None,
+        )
+
+
+def render_sprite(bodies: List[bytes], tile: int) -> Optional[Tuple[bytes, int, int, List[int]]]:
+    """Paste thumbnails into one WebP grid.
+
+    Returns (sprite, columns, rows, placed) where placed lists the indexes of
+    the bodies that could be decoded, in grid order; None without Pillow.
+    """
+    if Image is None or not bodies:
+        return None
+    images = []
+    for index, body in enumerate(bodies):
+        try:
+            with Image.open(io.BytesIO(body)) as image:
+                image = image.convert("RGBA")
+                image.thumbnail((tile, tile), Image.LANCZOS)
+                images.append((index, image))
+        except Exception:
+            continue
+    if not images:
+        return None
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    sheet = Image.new("RGBA", (columns * tile, rows * tile), (0, 0, 0, 0))
+    for slot, (_, image) in enumerate(images):
+        row, column = divmod(slot, columns)
+        # Centre each logo in its tile
+        sheet.paste(image, (column * tile + (tile - image.width) // 2, row * tile + (tile - image.height) // 2))
+    out = io.BytesIO()
+    sheet.save(out, "WEBP", quality=80, method=4)
+    return out.getvalue(), columns, rows, [index for index, _ in images]
+
+
+def versioned(path: str, size: int, logo: Logo) -> str:
+    """Immutable URL of a thumbnail: its content hash changes the URL whenever the image does."""
+    version = logo.etag.strip('"')
+    return f"{path}?size={size}&v={version}"
+
+
+def tile_position(slot: int, columns: int, rows: int) -> str:
+    """CSS background-position of a sprite tile, in percentages so it scales to any box size."""
+    row, column = divmod(slot, columns)
+    x = column * 100 / (columns - 1) if columns > 1 else 0
+    y = row * 100 / (rows - 1) if rows > 1 else 0
+    return f"{x:g}% {y:g}%"
+
+
+async def build_manifest(
+    store: LogoStore,
+    logos: Dict[str, str],
+    size: int = 128,
+    tile: int = 64,
+    sprite: bool = True,
+    concurrency: int = 8,
+) -> Tuple[dict, Optional[bytes]]:
+    """Pre-warm logos (path -> upstream URL) and describe them for the channel grid.
+
+    Returns the manifest and the sprite sheet bytes (None when disabled or
+    unavailable). The version hashes every thumbnail's ETag, so it changes
+    whenever any logo does.
+    """
+    urls = sorted(set(logos.values()))
+    thumbnails = await store.prewarm(urls, size, concurrency)
+    version = hashlib.blake2b(
+        "".join(f"{url}{thumbnails[url].etag}" for url in urls if url in thumbnails).encode(),
+        digest_size=8,
+    ).hexdigest()
+    manifest = {
+        "version": version,
+        "size": size,
+        "logos": {
+            path: versioned(path, size, thumbnails[url])
+            for path, url in logos.items()
+            if url in thumbnails
+        },
+        "sprite": None,
+    }
+    if not sprite or Image is None:
+        return manifest, None
+    tiles = await store.prewarm(urls, tile, concurrency)
+    sprite_urls = [url for url in urls if url in tiles]
+    rendered = await asyncio.to_thread(render_sprite, [tiles[url].body for url in sprite_urls], tile)
+    if rendered is None:
+        return manifest, None
+    body, columns, rows, placed = rendered
+    slots = {sprite_urls[index]: slot for slot, index in enumerate(placed)}
+    manifest["sprite"] = {
+        "src": f"/api/logos/sprite/{version}.webp",
+        "background_size": f"{columns * 100}% {rows * 100}%",
+        "positions": {
+            path: tile_position(slots[url], columns, rows)
+            for path, url in logos.items()
+            if url in slots
+        },
+    }
+    return manifest, body
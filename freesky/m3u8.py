@@ -0,0 +1,126 @@
+"""
+Single-pass HLS playlist rewriter.
+
+Walks an upstream playlist once, resolves every URI (segment lines, variant
+lines and URI="..." attributes) against the upstream base URL, and lets the
+caller replace each one. Output is built with a list join.
+"""
+import re
+from typing import Callable, List, Optional
+from urllib.parse import urljoin
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+BANDWIDTH_ATTRIBUTE = re.compile(r'(?:^|,)BANDWIDTH=(\d+)')
+
+# Returned by a rewrite callback to remove a variant (its tag and URI line, or its
+# #EXT-X-I-FRAME-STREAM-INF tag) from a master playlist
+DROP = object()
+
+# URI kinds passed to the rewrite callback
+SEGMENT = "segment"
+KEY = "key"
+VARIANT = "variant"
+MEDIA = "media"
+
+# Tags carrying a URI="..." attribute, and the kind of resource it points to
+URI_TAGS = {
+    "#EXT-X-KEY:": KEY,
+    "#EXT-X-SESSION-KEY:": KEY,
+    "#EXT-X-MAP:": SEGMENT,
+    "#EXT-X-PART:": SEGMENT,
+    "#EXT-X-PRELOAD-HINT:": SEGMENT,
+    "#EXT-X-MEDIA:": MEDIA,
+    "#EXT-X-I-FRAME-STREAM-INF:": VARIANT,
+    "#EXT-X-RENDITION-REPORT:": MEDIA,
+}
+STREAM_INF = "#EXT-X-STREAM-INF:"
+ABSOLUTE = ("https://", "http://")
+
+
+def is_master(text: str) -> bool:
+    """True if the playlist lists variants rather than segments."""
+    return STREAM_INF in text
+
+
+def rewrite(text: str, base_url: str, rewrite_uri: Callable[[str, str, str], Optional[str]]) -> str:
+    """Rewrite every URI in a playlist.
+
+    rewrite_uri(kind, url, tag_line) receives the absolute URL and returns
+    its replacement, None to keep the absolute URL, or DROP to remove a
+    variant. tag_line is the tag the URI belongs to (the preceding
+    #EXT-X-STREAM-INF for variant lines).
+    """
+    out: List[str] = []
+    pending_tag = ""
+    pending_index = 0
+    for line in text.splitlines():
+        if not line:
+            out.append(line)
+            continue
+        if line[0] == "#":
+            if line.startswith("#EXTINF"):
+                pass  # By far the most common tag, and it never carries a URI
+            elif line.startswith(STREAM_INF):
+                pending_tag = line
+                pending_index = len(out)
+            else:
+                kind = _uri_tag_kind(line)
+                if kind is not None:
+                    line = _rewrite_attribute(line, kind, base_url, rewrite_uri)
+                    if line is DROP:
+                        continue
+            out.append(line)
+            continue
+        url = line if line.startswith(ABSOLUTE) else resolve(base_url, line.strip())
+        if not url.startswith("http"):
+            pending_tag = ""
+            out.append(line)
+            continue
+        if pending_tag:
+            replacement = rewrite_uri(VARIANT, url, pending_tag)
+            pending_tag = ""
+            if replacement is DROP:
+                del out[pending_index:]
+                continue
+        else:
+            replacement = rewrite_uri(SEGMENT, url, line)
+        out.append(url if replacement is None else replacement)
+    out.append("")
+    return "\n".join(out)
+
+
+def variant_bandwidths(text: str) -> List[int]:
+    """BANDWIDTH of every #EXT-X-STREAM-INF variant in a master playlist."""
+    return [bw for bw in (bandwidth(line) for line in text.splitlines() if line.startswith(STREAM_INF)) if bw is not None]
+
+
+def resolve(base_url: str, uri: str) -> str:
+    """Resolve a playlist URI against the playlist URL; absolute URIs skip urljoin."""
+    if uri.startswith(ABSOLUTE):
+        return uri
+    return urljoin(base_url, uri)
+
+
+def bandwidth(tag_line: str) -> Optional[int]:
+    """BANDWIDTH attribute of an #EXT-X-STREAM-INF tag, if present."""
+    match = BANDWIDTH_ATTRIBUTE.search(tag_line.partition(":")[2])
+    return int(match.group(1)) if match else None
+
+
+def _uri_tag_kind(line: str) -> Optional[str]:
+    tag = line[:line.find(":") + 1]
+    return URI_TAGS.get(tag)
+
+
+def _rewrite_attribute(line: str, kind: str, base_url: str, rewrite_uri):
+    """The tag with its URI attribute rewritten, or DROP if the callback dropped it."""
+    match = URI_ATTRIBUTE.search(line)
+    if match is None:
+        return line
+    url = resolve(base_url, match.group(1))
+    if not url.startswith("http"):
+        return line  # data: and skd: URIs are left alone
+    replacement = rewrite_uri(kind, url, line)
+    if replacement is DROP:
+        return DROP
+    return f"{line[:match.start(1)]}{url if replacement is None else replacement}{line[match.end(1):]}"
@@ -0,0 +1,106 @@
+"""
+Channel metadata (logo and tags) indexed by normalized channel name.
+
+meta.json is keyed by display name, but upstream names drift in case,
+punctuation, accents and parenthesized suffixes. The index keys every entry
+by normalize_name() and adds the aliases from meta_aliases.json, which also
+holds the display-name overrides for upstream channels. Building it means
+parsing and normalizing the whole file, so the result is pickled next to
+meta.json and reused while both source files are unchanged.
+"""
+import json
+import logging
+import os
+import pickle
+from typing import Dict, Optional, Tuple
+
+from .spool import read_file, write_atomic
+from .utils import normalize_name
+
+logger = logging.getLogger(__name__)
+
+META_PATH = "freesky/meta.json"
+ALIASES_PATH = "freesky/meta_aliases.json"
+INDEX_FORMAT = 1  # Bump when normalize_name() or the index layout changes
+
+
+class MetaIndex:
+    """Normalized-name lookups over meta.json, plus the upstream rename table."""
+
+    def __init__(
+        self,
+        meta: Dict[str, dict],
+        aliases: Optional[Dict[str, str]] = None,
+        renames_by_id: Optional[Dict[str, str]] = None,
+        renames_by_name: Optional[Dict[str, str]] = None,
+    ):
+        self.entries: Dict[str, dict] = {}
+        for name, entry in meta.items():
+            self.entries.setdefault(normalize_name(name), entry)
+        for alias, target in (aliases or {}).items():
+            entry = self.entries.get(normalize_name(target))
+            if entry is None:
+                logger.warning(f"Channel alias {alias!r} points at unknown meta entry {target!r}")
+                continue
+            self.entries.setdefault(normalize_name(alias), entry)
+        self.renames_by_id = dict(renames_by_id or {})
+        self.renames_by_name = dict(renames_by_name or {})
+        self.source = "json"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def display_name(self, channel_id: str, name: str) -> str:
+        """The name to show for an upstream channel; overrides by upstream name win over those by id."""
+        return self.renames_by_name.get(name) or self.renames_by_id.get(channel_id) or name
+
+    def lookup(self, name: str) -> Optional[dict]:
+        return self.entries.get(normalize_name(name))
+
+
+def build_index(meta_path: str = META_PATH, aliases_path: str = ALIASES_PATH) -> MetaIndex:
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    aliases = {}
+    if os.path.exists(aliases_path):
+        with open(aliases_path, "r") as f:
+            aliases = json.load(f)
+    renames = aliases.get("renames", {})
+    return MetaIndex(meta, aliases.get("aliases"), renames.get("by_id"), renames.get("by_name"))
+
+
+def _cache_key(meta_path: str, aliases_path: str) -> Tuple:
+    key = [INDEX_FORMAT]
+    for path in (meta_path, aliases_path):
+        try:
+            stat = os.stat(path)
+            key.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            key.append(None)
+    return tuple(key)
+
+
+def load_index(
+    meta_path: str = META_PATH,
+    aliases_path: str = ALIASES_PATH,
+    cache_path: Optional[str] = None,
+) -> MetaIndex:
+    """The metadata index, from the pickle cache if it matches the sources' mtimes, else rebuilt."""
+    if cache_path is None:
+        cache_path = os.path.splitext(meta_path)[0] + ".index.pickle"
+    key = _cache_key(meta_path, aliases_path)
+    try:
+        cached_key, index = pickle.loads(read_file(cache_path))
+        if cached_key == key:
+            index.source = "pickle"
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable metadata index cache {cache_path}: {str(e)}")
+    index = build_index(meta_path, aliases_path)
+    try:
+        write_atomic(cache_path, [pickle.dumps((key, index), protocol=pickle.HIGHEST_PROTOCOL)])
+    except OSError as e:
+        logger.warning(f"Failed to cache metadata index to {cache_path}: {str(e)}")
+    return index
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import posixpath
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
+from .admission import AdmissionController
+from .segment_cache import SegmentCache
+from .utils import TokenError, tokens
+
+logger = logging.getLogger(__name__)
+
+CONTENT_PREFIX = "/api/content/"
+
+
+class Prefetcher:
+    """Pulls the newest segments of watched channels into the segment cache ahead of players.
+
+    Work is bounded by a worker count and a token-bucket bandwidth budget, only
+    uses spare admission capacity, and is dropped or cancelled once a channel
+    has had no playlist requests for idle_after seconds.
+    """
+
+    def __init__(
+        self,
+        segment_cache: SegmentCache,
+        admission: AdmissionController,
+        depth: int = 2,
+        concurrency: int = 8,
+        max_bytes_per_sec: float = 50 * 1024 * 1024,
+        idle_after: float = 20.0,
+    ):
+        self.segment_cache = segment_cache
+        self.admission = admission
+        self.depth = depth
+        self.concurrency = concurrency
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.idle_after = idle_after
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * depth * 8)
+        self._queued: set = set()
+        self._inflight: Dict[str, str] = {}  # url -> channel_id
+        self._last_seen: Dict[str, float] = {}  # channel_id -> last playlist request
+        self._prefetched: Dict[str, Tuple[int, float]] = {}  # url -> (bytes, completed_at), until claimed
+        self._claimed: set = set()  # Queued or in-flight urls a viewer already asked for
+        self._budget = max_bytes_per_sec  # Token bucket, may go negative after a large segment
+        self._budget_time = time.monotonic()
+        self.scheduled = 0
+        self.completed = 0
+        self.hits = 0
+        self.wasted = 0
+        self.wasted_bytes = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    def schedule(self, channel_id: str, playlist: str):
+        """Queue the newest segments of a just-served media playlist."""
+        self._last_seen[channel_id] = time.time()
+        urls = []
+        for line in playlist.splitlines():
+            if not line.startswith(CONTENT_PREFIX):
+                continue
+            try:
+                urls.append(tokens.decode(line[len(CONTENT_PREFIX):]))
+            except TokenError:
+                continue  # Minted under another key or expired; the player will get the error itself
+        for url in urls[-self.depth:]:
+            if url in self._queued or url in self._prefetched or self.segment_cache.live(url) is not None:
+                continue
+            try:
+                self._queue.put_nowait((channel_id, url))
+            except asyncio.QueueFull:
+                self.skipped += 1
+                return
+            self._queued.add(url)
+            self.scheduled += 1
+
+    def claim(self, url: str):
+        """Record that a viewer requested url, counting a hit if it was prefetched."""
+        if self._prefetched.pop(url, None) is not None:
+            self.hits += 1
+        elif url in self._inflight or url in self._queued:
+            # The viewer joins the prefetch's download; it counts once that completes
+            self._claimed.add(url)
+
+    def _idle(self, channel_id: str) -> bool:
+        return time.time() - self._last_seen.get(channel_id, 0) > self.idle_after
+
+    async def _spend(self, size: int):
+        """Wait until the bandwidth budget is positive, then charge size bytes to it."""
+        while True:
+            now = time.monotonic()
+            self._budget = min(self.max_bytes_per_sec, self._budget + (now - self._budget_time) * self.max_bytes_per_sec)
+            self._budget_time = now
+            if self._budget > 0:
+                self._budget -= size
+                return
+            await asyncio.sleep(-self._budget / self.max_bytes_per_sec)
+
+    async def _fetch(self, channel_id: str, url: str):
+        if self._idle(channel_id) or self.segment_cache.live(url) is not None:
+            self.skipped += 1
+            return
+        await self._spend(0)
+        parsed = urlparse(url)
+        slot = self.admission.try_acquire(parsed.hostname or "", posixpath.dirname(parsed.path))
+        if slot is None:
+            self.skipped += 1  # Viewers' own requests take priority over prefetching
+            return
+        entry = self.segment_cache.get(url, on_done=slot.release)
+        self._inflight[url] = channel_id
+        try:
+            await entry.wait_done()
+        finally:
+            self._inflight.pop(url, None)
+        if entry.error is None:
+            self._budget -= entry.size
+            self.completed += 1
+            if url in self._claimed:
+                self.hits += 1
+            else:
+                self._prefetched[url] = (entry.size, time.time())
+
+    async def _worker(self):
+        while True:
+            channel_id, url = await self._queue.get()
+            try:
+                await self._fetch(channel_id, url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Prefetch failed for {url}: {str(e)}")
+            finally:
+                self._queued.discard(url)
+                self._claimed.discard(url)
+                self._queue.task_done()
+
+    def _sweep(self):
+        """Cancel downloads for channels nobody watches and expire unclaimed prefetches."""
+        for url, channel_id in list(self._inflight.items()):
+            if self._idle(channel_id) and self.segment_cache.cancel(url):
+                self.cancelled += 1
+        cutoff = time.time() - self.segment_cache.ttl
+        for url, (size, completed_at) in list(self._prefetched.items()):
+            if completed_at < cutoff:
+                del self._prefetched[url]
+                self.wasted += 1
+                self.wasted_bytes += size
+        for channel_id in [c for c, seen in self._last_seen.items() if time.time() - seen > self.idle_after * 10]:
+            del self._last_seen[channel_id]
+
+    async def run(self, interval: float = 2.0):
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self._sweep()
+        except asyncio.CancelledError:
+            logger.info("Segment prefetch task cancelled")
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    def stats(self) -> dict:
+        resolved = self.hits + self.wasted
+        return {
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "in_flight": len(self._inflight),
+            "queued": self._queue.qsize(),
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / resolved, 3) if resolved else 0.0,
+            "wasted": self.wasted,
+            "wasted_bytes": self.wasted_bytes,
+            "skipped": self.skipped,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Relay send sizes and the per-send durations that count as a fast or slow client
+MIN_RELAY_CHUNK = 64 * 1024
+MAX_RELAY_CHUNK = 1024 * 1024
+FAST_SEND = 0.001
+SLOW_SEND = 0.05
+
+
+class UpstreamError(Exception):
+    """Upstream answered a segment request with a non-200 status."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Upstream returned HTTP {status_code}")
+        self.status_code = status_code
+
+
+class SegmentEntry:
+    """A single segment, readable by many viewers while it is still downloading."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.content_length: Optional[int] = None
+        self.complete = False
+        self.error: Optional[BaseException] = None
+        self.created = time.time()
+        self.task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()  # Set once upstream headers arrive (or the fetch fails)
+        self._changed = asyncio.Event()  # Pulsed on every new chunk and on completion
+
+    def start(self, content_length: Optional[int] = None):
+        self.content_length = content_length
+        self._ready.set()
+
+    def append(self, chunk: bytes):
+        if not chunk:
+            return
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._pulse()
+
+    def finish(self):
+        if len(self.chunks) > 1:
+            # One contiguous buffer lets readers send zero-copy memoryview slices.
+            # Readers already following the download keep the old list.
+            self.chunks = [b"".join(self.chunks)]
+        self.complete = True
+        self._ready.set()
+        self._pulse()
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self._ready.set()
+        self._pulse()
+
+    def _pulse(self):
+        # Waking every waiter then clearing keeps the event edge-triggered
+        self._changed.set()
+        self._changed.clear()
+
+    async def ready(self):
+        """Wait for upstream headers, raising if the fetch failed before any data."""
+        await self._ready.wait()
+        if self.error is not None and not self.chunks:
+            raise self.error
+
+    async def wait_done(self):
+        """Wait until the download completes or fails."""
+        while not self.complete and self.error is None:
+            await self._changed.wait()
+
+    def body_length(self) -> Optional[int]:
+        """Total body size if known up front, so responses can skip chunked framing."""
+        return self.size if self.complete else self.content_length
+
+    async def iter_chunks(self, min_chunk: int = MIN_RELAY_CHUNK, max_chunk: int = MAX_RELAY_CHUNK):
+        """Yield the body in adaptively sized pieces, following the download if in flight.
+
+        The send size starts proportional to the segment size, grows while the
+        client drains quickly and shrinks when sends block, which bounds the
+        data parked in a slow client's transport buffer.
+        """
+        target = min(max(min_chunk, (self.body_length() or 0) // 8), max_chunk)
+        chunks = self.chunks
+        index = 0
+        offset = 0
+        while True:
+            if index < len(chunks):
+                chunk = chunks[index]
+                if offset == 0 and len(chunk) <= target:
+                    pending = len(chunk)
+                    end = index + 1
+                    while end < len(chunks) and pending + len(chunks[end]) <= target:
+                        pending += len(chunks[end])
+                        end += 1
+                    # Coalesce small pieces into one send, pass single chunks through untouched
+                    piece = chunk if end == index + 1 else b"".join(chunks[index:end])
+                    index = end
+                else:
+                    piece = memoryview(chunk)[offset:offset + target]
+                    offset += len(piece)
+                    if offset >= len(chunk):
+                        index += 1
+                        offset = 0
+                started = time.monotonic()
+                yield piece
+                elapsed = time.monotonic() - started
+                if elapsed < FAST_SEND:
+                    target = min(target * 2, max_chunk)
+                elif elapsed > SLOW_SEND:
+                    target = max(target // 2, min_chunk)
+                continue
+            if self.complete:
+                return
+            if self.error is not None:
+                raise self.error
+            await self._changed.wait()
+
+
+class SegmentCache:
+    """Byte-budgeted LRU of live segments keyed by upstream URL.
+
+    Each segment is downloaded once; concurrent viewers attach to the in-flight
+    download and receive chunks as they arrive.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str, SegmentEntry], Awaitable[None]],
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 60.0,
+        on_complete: Optional[Callable[[SegmentEntry], None]] = None,
+    ):
+        self._fetch = fetch
+        self._on_complete = on_complete
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, SegmentEntry]" = OrderedDict()
+        self._tasks: set = set()
+        self.bytes = 0
+        self.hits = 0
+        self.joins = 0
+        self.misses = 0
+        self.evictions = 0
+        self.upstream_bytes = 0
+
+    def get(self, url: str, on_done: Optional[Callable[[], None]] = None) -> SegmentEntry:
+        """Return the entry for url, starting a download if it is not cached.
+
+        on_done is called once the download started by this call ends, or
+        immediately if the segment was already cached or in flight.
+        """
+        entry = self.live(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+            if entry.complete:
+                self.hits += 1
+            else:
+                self.joins += 1
+            if on_done is not None:
+                on_done()
+            return entry
+
+        self.misses += 1
+        entry = SegmentEntry(url)
+        self._entries[url] = entry
+        task = asyncio.ensure_future(self._download(entry, on_done))
+        entry.task = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return entry
+
+    def live(self, url: str) -> Optional[SegmentEntry]:
+        """Return the cached or in-flight entry for url without counting a lookup."""
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        if entry.error is not None or (entry.complete and time.time() - entry.created > self.ttl):
+            self._remove(url)
+            return None
+        return entry
+
+    def cached(self, url: str) -> Optional[SegmentEntry]:
+        """Return a fully downloaded, fresh entry without starting a fetch."""
+        entry = self._entries.get(url)
+        if entry is None or not entry.complete or time.time() - entry.created > self.ttl:
+            return None
+        return entry
+
+    def cancel(self, url: str) -> bool:
+        """Abort an in-flight download; attached readers see a failed segment."""
+        entry = self._entries.get(url)
+        if entry is None or entry.complete or entry.task is None or entry.task.done():
+            return False
+        entry.task.cancel()
+        return True
+
+    async def _download(self, entry: SegmentEntry, on_done: Optional[Callable[[], None]] = None):
+        try:
+            await self._fetch(entry.url, entry)
+        except asyncio.CancelledError:
+            entry.fail(ConnectionError("Segment download cancelled"))
+            self._discard(entry)
+            raise
+        except Exception as e:
+            logger.warning(f"Segment download failed for {entry.url}: {str(e)}")
+            entry.fail(e)
+            self._discard(entry)
+            return
+        finally:
+            if on_done is not None:
+                on_done()
+        entry.finish()
+        self.upstream_bytes += entry.size
+        if self._on_complete is not None:
+            self._on_complete(entry)
+        if self._entries.get(entry.url) is not entry:
+            return
+        if entry.size > self.max_entry_bytes:
+            # Too large to keep, current readers still hold a reference
+            self._discard(entry)
+            return
+        self.bytes += entry.size
+        self._evict()
+
+    def _discard(self, entry: SegmentEntry):
+        if self._entries.get(entry.url) is entry:
+            self._remove(entry.url)
+
+    def _remove(self, url: str):
+        entry = self._entries.pop(url)
+        if entry.complete and entry.size <= self.max_entry_bytes:
+            self.bytes -= entry.size
+
+    def _evict(self):
+        now = time.time()
+        for url in [u for u, e in self._entries.items() if e.complete and now - e.created > self.ttl]:
+            self._remove(url)
+        for url in list(self._entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if self._entries[url].complete:
+                self._remove(url)
+                self.evictions += 1
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "joins": self.joins,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "upstream_bytes": self.upstream_bytes,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DiskSpool:
+    """Content-addressed file store shared by every worker in a container.
+
+    Files are named by the SHA-256 of their upstream URL and written
+    atomically, so any worker can serve a segment or key another worker
+    fetched. Point it at tmpfs (e.g. /dev/shm) to keep it in memory.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, max_ages: Optional[Dict[str, float]] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_ages = max_ages or {}  # kind -> seconds a file stays valid
+        self.default_max_age = 120.0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.removed = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, kind: str, url: str) -> str:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{digest}")
+
+    def max_age(self, kind: str) -> float:
+        return self.max_ages.get(kind, self.default_max_age)
+
+    async def lookup(self, kind: str, url: str) -> Optional[str]:
+        """Return the path of a fresh spooled file for url, or None."""
+        path = self.path_for(kind, url)
+        try:
+            stat = await asyncio.to_thread(os.stat, path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        if time.time() - stat.st_mtime > self.max_age(kind):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    async def read(self, kind: str, url: str) -> Optional[bytes]:
+        path = await self.lookup(kind, url)
+        if path is None:
+            return None
+        try:
+            return await asyncio.to_thread(read_file, path)
+        except FileNotFoundError:
+            return None  # Removed by a janitor between lookup and read
+
+    async def store(self, kind: str, url: str, chunks: List[bytes]):
+        path = self.path_for(kind, url)
+        try:
+            await asyncio.to_thread(write_atomic, path, chunks)
+            self.writes += 1
+        except OSError as e:
+            logger.warning(f"Failed to spool {kind} to {path}: {str(e)}")
+
+    def _sweep(self) -> int:
+        """Delete expired files, then the oldest ones until under the size budget."""
+        now = time.time()
+        files = []
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                kind = entry.name.split("-", 1)[0]
+                if now - stat.st_mtime > self.max_age(kind):
+                    removed += _unlink(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            removed += _unlink(path)
+            total -= size
+        return removed
+
+    async def janitor(self, interval: float = 10.0):
+        """Periodically enforce the spool's age and size limits."""
+        while True:
+            try:
+                self.removed += await asyncio.to_thread(self._sweep)
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                logger.info("Spool janitor task cancelled")
+                break
+            except Exception as e:
+                logger.error(f"Unexpected error in spool janitor: {str(e)}")
+                await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "removed": self.removed,
+        }
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_atomic(path: str, chunks: List[bytes]):
+    tmp_path = f"{path}.{os.getpid()}-{os.urandom(4).hex()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(chunks)
+    os.replace(tmp_path, path)
+
+
+def _unlink(path: str) -> int:
+    try:
+        os.unlink(path)
+        return 1
+    except FileNotFoundError:
+        return 0
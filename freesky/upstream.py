@@ -0,0 +1,231 @@
+"""
+Upstream HTTP layer shared by the provider scraper and the proxy.
+
+Provider pages (channel list, stream resolution, keys, schedule) go through
+an impersonating curl_cffi session; CDN segments, logos and cluster peers go
+through httpx. Each pool sits behind a ConnectionGate that caps connections
+globally and per host and hands free slots out by purpose, so segment and
+key traffic is served before metadata calls when connections are scarce.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from curl_cffi import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# Request purposes, highest priority first
+SEGMENT = 0
+KEY = 1
+PLAYLIST = 2
+METADATA = 3
+PURPOSES = {SEGMENT: "segment", KEY: "key", PLAYLIST: "playlist", METADATA: "metadata"}
+
+
+class _PurposeStats:
+    def __init__(self):
+        self.requests = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.active = 0
+
+
+class ConnectionGate:
+    """Connection slots for one pool, capped globally and per host, granted in purpose order.
+
+    Metadata requests may not take the last `reserved` slots of the pool or
+    of a host, which stay free for segments, keys and playlists.
+    """
+
+    def __init__(self, max_active: int, per_host: int, reserved: int = 0):
+        self.max_active = max_active
+        self.per_host = per_host
+        self.reserved = reserved
+        self.active = 0
+        self.peak = 0
+        self.new_connections = 0
+        self._hosts: Dict[str, int] = {}
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []  # heap of (purpose, seq, host, future)
+        self._seq = itertools.count()
+        self._stats = {purpose: _PurposeStats() for purpose in PURPOSES}
+
+    def _fits(self, host: str, purpose: int) -> bool:
+        reserve = self.reserved if purpose == METADATA else 0
+        return self.active < self.max_active - reserve and self._hosts.get(host, 0) < self.per_host - reserve
+
+    def _grant(self, host: str, purpose: int):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self._hosts[host] = self._hosts.get(host, 0) + 1
+        self._stats[purpose].active += 1
+
+    async def acquire(self, host: str, purpose: int):
+        stats = self._stats[purpose]
+        stats.requests += 1
+        if not self._waiters and self._fits(host, purpose):
+            self._grant(host, purpose)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (purpose, next(self._seq), host, future))
+        self._dispatch()  # Queued work for full hosts shouldn't hold up a host with room
+        if future.done():
+            return
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(host, purpose)  # Granted just as the caller went away
+            future.cancel()
+            raise
+        finally:
+            waited = time.monotonic() - started
+            stats.waited += 1
+            stats.wait_time += waited
+            stats.max_wait = max(stats.max_wait, waited)
+
+    def release(self, host: str, purpose: int):
+        self.active -= 1
+        self._stats[purpose].active -= 1
+        remaining = self._hosts[host] - 1
+        if remaining:
+            self._hosts[host] = remaining
+        else:
+            del self._hosts[host]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to waiters in purpose order, skipping those whose host is full."""
+        skipped = []
+        while self._waiters and self.active < self.max_active:
+            waiter = heapq.heappop(self._waiters)
+            purpose, _, host, future = waiter
+            if future.done():
+                continue
+            if self._fits(host, purpose):
+                self._grant(host, purpose)
+                future.set_result(None)
+            else:
+                skipped.append(waiter)
+        for waiter in skipped:
+            heapq.heappush(self._waiters, waiter)
+
+    @asynccontextmanager
+    async def slot(self, host: str, purpose: int):
+        await self.acquire(host, purpose)
+        try:
+            yield
+        finally:
+            self.release(host, purpose)
+
+    def stats(self) -> dict:
+        requests = sum(stats.requests for stats in self._stats.values())
+        return {
+            "active": self.active,
+            "peak": self.peak,
+            "max_active": self.max_active,
+            "queued": len(self._waiters),
+            "hosts": dict(self._hosts),
+            "new_connections": self.new_connections,
+            "reuse_ratio": round(1 - min(self.new_connections, requests) / requests, 3) if requests else 0.0,
+            "purposes": {
+                PURPOSES[purpose]: {
+                    "requests": stats.requests,
+                    "active": stats.active,
+                    "waited": stats.waited,
+                    "wait_time_total": round(stats.wait_time, 3),
+                    "max_wait": round(stats.max_wait, 3),
+                }
+                for purpose, stats in self._stats.items()
+                if stats.requests
+            },
+        }
+
+
+class UpstreamClient:
+    """Pooled upstream client: a curl_cffi session for provider pages and an httpx client for media."""
+
+    def __init__(
+        self,
+        max_connections: int = 200,
+        per_host: int = 50,
+        session_connections: int = 32,
+        keepalive: float = 60.0,
+        reserved: int = 4,
+        proxy: Optional[str] = None,
+    ):
+        session_config = {
+            "timeout": 30,  # Add timeout to prevent hanging requests
+            "impersonate": "chrome110",  # Better browser impersonation
+            "max_redirects": 5,  # Limit redirects
+            "max_clients": session_connections,
+        }
+        if proxy:
+            session_config["proxy"] = proxy
+        self.session = AsyncSession(**session_config)
+        self.http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(
+                max_keepalive_connections=per_host,
+                max_connections=max_connections,
+                keepalive_expiry=keepalive,
+            ),
+            follow_redirects=True
+        )
+        self.session_gate = ConnectionGate(session_connections, session_connections, reserved)
+        self.http_gate = ConnectionGate(max_connections, per_host, reserved)
+        self._curl_connections: "OrderedDict[tuple, None]" = OrderedDict()  # Recently seen curl sockets
+
+    async def request(self, method: str, url: str, purpose: int, **kwargs):
+        """Send a request through the impersonating curl_cffi session."""
+        async with self.session_gate.slot(urlparse(url).netloc, purpose):
+            response = await getattr(self.session, method.lower())(url, **kwargs)
+        self._track_curl(response)
+        return response
+
+    async def fetch(self, method: str, url: str, purpose: int, **kwargs) -> httpx.Response:
+        """Send a request through httpx and read the whole body."""
+        async with self.http_gate.slot(urlparse(url).netloc, purpose):
+            return await self.http.request(method, url, extensions={"trace": self._trace}, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, purpose: int, **kwargs):
+        """Stream a response through httpx, holding a connection slot until the body is consumed."""
+        async with self.http_gate.slot(urlparse(url).netloc, purpose):
+            async with self.http.stream(method, url, extensions={"trace": self._trace}, **kwargs) as response:
+                yield response
+
+    async def _trace(self, event: str, info: dict):
+        if event == "connection.connect_tcp.complete":
+            self.http_gate.new_connections += 1
+
+    def _track_curl(self, response):
+        # curl_cffi doesn't report reuse directly; a socket pair seen before was a kept-alive connection
+        local_port = getattr(response, "local_port", 0)
+        if not local_port:
+            return
+        connection = (response.local_ip, local_port, response.primary_ip, response.primary_port)
+        if connection in self._curl_connections:
+            self._curl_connections.move_to_end(connection)
+            return
+        self.session_gate.new_connections += 1
+        self._curl_connections[connection] = None
+        if len(self._curl_connections) > 4096:
+            self._curl_connections.popitem(last=False)
+
+    async def aclose(self):
+        await self.http.aclose()
+        await self.session.close()
+
+    def stats(self) -> dict:
+        return {"provider": self.session_gate.stats(), "media": self.http_gate.stats()}
@@ -1,27 +1,258 @@
 import os
 import re
 import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-key_bytes = os.urandom(64)
+# Token layout: format, key id, expiry (unix seconds, 0 = never), channel id length,
+# then the channel id, the XORed URL and a truncated keyed BLAKE2b MAC over all of it
+TOKEN_FORMAT = 1
+_HEADER = struct.Struct(">BBIB")
+_MAC_SIZE = 8
 
 
-def encrypt(input_string: str):
-    input_bytes = input_string.encode()
-    result = xor(input_bytes)
-    return base64.urlsafe_b64encode(result).decode().rstrip('=')
+class TokenError(ValueError):
+    """A URL token that is malformed, forged or signed with a retired key."""
 
 
-def decrypt(input_string: str):
-    padding_needed = 4 - (len(input_string) % 4)
-    if padding_needed:
-        input_string += '=' * padding_needed
-    input_bytes = base64.urlsafe_b64decode(input_string)
-    result = xor(input_bytes)
-    return result.decode()
+class TokenExpired(TokenError):
+    """A URL token past its expiry."""
+
+
+class Token(NamedTuple):
+    url: str
+    channel_id: str
+    expires: int
+
+
+class TokenKey:
+    """One token secret: a keystream for hiding URLs and a MAC key for authenticating tokens."""
+
+    def __init__(self, key_id: int, secret: bytes):
+        self.id = key_id
+        self.key_bytes = hashlib.sha512(b"freesky-token-xor" + secret).digest()
+        self.mac_key = hashlib.sha256(b"freesky-token-mac" + secret).digest()
+        # Repeated key, extended on demand so any input can be XORed in one big-int operation
+        self._keystream = self.key_bytes * 8
+
+    def xor(self, input_bytes):
+        length = len(input_bytes)
+        if length > len(self._keystream):
+            self._keystream = self.key_bytes * (length // len(self.key_bytes) + 1)
+        mixed = int.from_bytes(input_bytes, "little") ^ int.from_bytes(self._keystream[:length], "little")
+        return mixed.to_bytes(length, "little")
+
+    def mac(self, body: bytes) -> bytes:
+        return hashlib.blake2b(body, key=self.mac_key, digest_size=_MAC_SIZE).digest()
+
+
+def parse_token_secrets(value: str) -> List[Tuple[int, bytes]]:
+    """Parse "id:secret,id:secret"; the first entry signs new tokens, the rest only verify."""
+    secrets = []
+    for item in value.split(","):
+        if ":" in item:
+            key_id, secret = item.strip().split(":", 1)
+            key_id = int(key_id)
+            if not 0 <= key_id <= 255:
+                # The key id is a single byte of the token header
+                raise ValueError(f"Token key id {key_id} is out of range 0-255")
+            secrets.append((key_id, secret.encode()))
+    return secrets
+
+
+def _configured_keys() -> List[TokenKey]:
+    # Every worker and node configured with the same secrets can decode every token.
+    # Without any, share_token_secret() has to distribute one before tokens are minted.
+    secrets = parse_token_secrets(os.environ.get("TOKEN_SECRETS", ""))
+    if not secrets and os.environ.get("CLUSTER_SECRET"):
+        secrets = [(1, os.environ["CLUSTER_SECRET"].encode())]
+    return [TokenKey(key_id, secret) for key_id, secret in secrets]
+
+
+token_keys: Dict[int, TokenKey] = {}
+current_key: Optional[TokenKey] = None
+key_bytes: bytes = b""
+token_keys_shared = False  # Whether every worker decodes the tokens minted here
+SHARED_SECRET_KEY = "token_secret"
+
+
+def set_token_keys(keys: List[TokenKey]):
+    """Install signing/verification keys, e.g. after rotating secrets."""
+    global current_key, key_bytes
+    token_keys.clear()
+    token_keys.update((key.id, key) for key in keys)
+    current_key = keys[0]
+    key_bytes = current_key.key_bytes
+
+
+_keys = _configured_keys()
+token_keys_shared = bool(_keys)
+# Until a secret is shared, tokens are only valid in the process that minted them
+set_token_keys(_keys or [TokenKey(0, os.urandom(32))])
+
+
+def tokens_portable() -> bool:
+    return token_keys_shared
+
+
+async def share_token_secret(backend) -> bool:
+    """Without configured secrets, adopt one secret per shared cache backend.
+
+    The first worker to start stores a random secret in the backend and the
+    rest adopt it, so tokens minted by any worker decode in all of them.
+    Returns whether tokens are portable; a per-process backend can't make them so.
+    """
+    global token_keys_shared
+    if token_keys_shared:
+        return True
+    if not backend.shared:
+        return False
+    secret = await backend.claim(SHARED_SECRET_KEY, os.urandom(32).hex().encode())
+    set_token_keys([TokenKey(0, secret)])
+    tokens.clear()  # Memoized tokens were minted with the process-local key
+    token_keys_shared = True
+    return True
 
 
 def xor(input_bytes):
-    return bytes([input_bytes[i] ^ key_bytes[i % len(key_bytes)] for i in range(len(input_bytes))])
+    return current_key.xor(input_bytes)
+
+
+def encrypt(input_string: str, channel_id: str = "", expires: int = 0) -> str:
+    """Mint a token for a URL, optionally tied to a channel and valid until expires."""
+    channel = channel_id.encode()
+    body = _HEADER.pack(TOKEN_FORMAT, current_key.id, expires, len(channel)) + channel + current_key.xor(input_string.encode())
+    return base64.urlsafe_b64encode(body + current_key.mac(body)).decode().rstrip('=')
+
+
+def open_token(input_string: str) -> Token:
+    """Verify and decode a token, raising TokenExpired or TokenError."""
+    try:
+        raw = base64.urlsafe_b64decode(input_string + '=' * (-len(input_string) % 4))
+    except (binascii.Error, ValueError):
+        raise TokenError("Malformed token")
+    if len(raw) < _HEADER.size + _MAC_SIZE:
+        raise TokenError("Malformed token")
+    token_format, key_id, expires, channel_length = _HEADER.unpack_from(raw)
+    # Expiry is checked before the MAC so stale links are turned away cheaply
+    if expires and expires < time.time():
+        raise TokenExpired("Token expired")
+    key = token_keys.get(key_id)
+    if token_format != TOKEN_FORMAT or key is None:
+        raise TokenError("Unknown token version or key")
+    body, mac = raw[:-_MAC_SIZE], raw[-_MAC_SIZE:]
+    if not hmac.compare_digest(key.mac(body), mac):
+        raise TokenError("Invalid token signature")
+    start = _HEADER.size + channel_length
+    try:
+        return Token(key.xor(body[start:]).decode(), body[_HEADER.size:start].decode(), expires)
+    except UnicodeDecodeError:
+        raise TokenError("Malformed token")
+
+
+def decrypt(input_string: str) -> str:
+    return open_token(input_string).url
+
+
+class TokenCache:
+    """Bounded two-way memo of URL <-> token, so repeated playlist URLs are encrypted once.
+
+    With a ttl, expiries are rounded up to ttl/2 steps so a URL keeps the same
+    token for half the ttl, and every token stays valid for ttl/2 to ttl.
+    """
+
+    def __init__(self, maxsize: int = 20000, ttl: int = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._tokens: "OrderedDict[Tuple[str, str], str]" = OrderedDict()  # (url, channel_id) -> token, in LRU order
+        self._decoded: Dict[str, Token] = {}  # token -> contents
+        self.encode_hits = 0
+        self.encode_misses = 0
+        self.decode_hits = 0
+        self.decode_misses = 0
+        self.expired = 0
+
+    def _expiry(self) -> int:
+        if not self.ttl:
+            return 0
+        step = max(1, self.ttl // 2)
+        return (int(time.time()) // step + 2) * step
+
+    def encode(self, url: str, channel_id: str = "", expires: Optional[int] = None) -> str:
+        """Token for url; expires overrides the ttl-based expiry (0 = never)."""
+        key = (url, channel_id)
+        if expires is None:
+            expires = self._expiry()
+        token = self._tokens.get(key)
+        if token is not None and self._decoded[token].expires == expires:
+            self._tokens.move_to_end(key)
+            self.encode_hits += 1
+            return token
+        self.encode_misses += 1
+        token = encrypt(url, channel_id, expires)
+        self._remember(token, Token(url, channel_id, expires))
+        return token
+
+    def resolve(self, token: str) -> Token:
+        """Contents of a token, raising TokenExpired or TokenError."""
+        contents = self._decoded.get(token)
+        if contents is not None:
+            if contents.expires and contents.expires < time.time():
+                self.expired += 1
+                raise TokenExpired("Token expired")
+            self.decode_hits += 1
+            return contents
+        self.decode_misses += 1
+        try:
+            contents = open_token(token)
+        except TokenExpired:
+            self.expired += 1
+            raise
+        self._remember(token, contents)
+        return contents
+
+    def decode(self, token: str) -> str:
+        return self.resolve(token).url
+
+    def clear(self):
+        self._tokens.clear()
+        self._decoded.clear()
+
+    def _remember(self, token: str, contents: Token):
+        key = (contents.url, contents.channel_id)
+        previous = self._tokens.pop(key, None)
+        if previous is not None and previous != token:
+            self._decoded.pop(previous, None)
+        self._tokens[key] = token
+        self._decoded[token] = contents
+        while len(self._tokens) > self.maxsize:
+            _, old_token = self._tokens.popitem(last=False)
+            self._decoded.pop(old_token, None)
+
+    def stats(self) -> dict:
+        encodes = self.encode_hits + self.encode_misses
+        decodes = self.decode_hits + self.decode_misses
+        return {
+            "entries": len(self._tokens),
+            "encode_hit_rate": round(self.encode_hits / encodes, 3) if encodes else 0.0,
+            "decode_hit_rate": round(self.decode_hits / decodes, 3) if decodes else 0.0,
+            "encode_hits": self.encode_hits,
+            "encode_misses": self.encode_misses,
+            "decode_hits": self.decode_hits,
+            "decode_misses": self.decode_misses,
+            "expired": self.expired,
+            "key_id": current_key.id,
+        }
+
+
+tokens = TokenCache(int(os.environ.get("TOKEN_CACHE_SIZE", "20000")), ttl=int(os.environ.get("TOKEN_TTL", "0")))
 
 
 def urlsafe_base64(input_string: str) -> str:
@@ -39,10 +270,28 @@ def urlsafe_base64_decode(base64_string: str) -> str:
     return decoded_bytes.decode("utf-8")
 
 
+@lru_cache(maxsize=32)
+def _atob_var_pattern(var_name: str) -> re.Pattern:
+    return re.compile(rf'var\s+{re.escape(var_name)}\s*=\s*atob\("([^"]+)"\);')
+
+
 def extract_and_decode_var(var_name: str, response: str) -> str:
-    pattern = rf'var\s+{re.escape(var_name)}\s*=\s*atob\("([^"]+)"\);'
-    matches = re.findall(pattern, response)
+    matches = _atob_var_pattern(var_name).findall(response)
     if not matches:
         raise ValueError(f"Variable '{var_name}' not found in response")
     b64 = matches[-1]
     return base64.b64decode(b64).decode("utf-8")
+
+
+_PARENTHESIZED = re.compile(r"\s*\(.*?\)")
+_APOSTROPHES = re.compile(r"['\u2019`]")
+_NON_ALNUM = re.compile(r"[^\w+]+|_+")
+
+
+@lru_cache(maxsize=4096)  # The same ~700 names come back on every refresh
+def normalize_name(name: str) -> str:
+    """Normalize a channel name for lookups: drop parenthesized suffixes, case, accents and punctuation."""
+    name = _PARENTHESIZED.sub("", name)
+    name = "".join(c for c in unicodedata.normalize("NFKD", name.casefold()) if not unicodedata.combining(c))
+    name = _APOSTROPHES.sub("", name.replace("&", " and "))
+    return " ".join(_NON_ALNUM.sub(" ", name).split())
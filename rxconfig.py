@@ -12,6 +12,15 @@ backend_uri = os.environ.get("BACKEND_URI", f"http://localhost:{backend_port}")
 daddylive_uri = os.environ.get("DADDYLIVE_URI", "https://thedaddy.click")
 proxy_content = os.environ.get("PROXY_CONTENT", "TRUE").lower() == "true"
 socks5 = os.environ.get("SOCKS5", "")
+session_ttl = int(os.environ.get("SESSION_TTL", "600"))  # Seconds a resolved channel session is reused
+max_bitrate = int(os.environ.get("MAX_BITRATE", "0"))  # Drop master-playlist variants above this (bits/s, 0 = no cap)
+upstream_max_connections = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "200"))  # Media (segment/logo) pool size
+upstream_host_connections = int(os.environ.get("UPSTREAM_HOST_CONNECTIONS", "50"))  # Per media host
+upstream_session_connections = int(os.environ.get("UPSTREAM_SESSION_CONNECTIONS", "32"))  # Provider (curl) pool size
+upstream_keepalive = float(os.environ.get("UPSTREAM_KEEPALIVE", "60"))  # Seconds idle connections are kept
+upstream_reserved = int(os.environ.get("UPSTREAM_RESERVED", "4"))  # Slots metadata calls may never take
+breaker_failures = int(os.environ.get("BREAKER_FAILURES", "5"))  # Consecutive upstream failures that open a host's circuit
+breaker_reset = float(os.environ.get("BREAKER_RESET", "30"))  # Seconds before an open circuit lets a probe through
 
 # Create config
 config = rx.Config(
@@ -36,6 +45,15 @@ config = rx.Config(
     backend_uri=backend_uri,
     proxy_content=proxy_content,
     socks5=socks5,
+    session_ttl=session_ttl,
+    max_bitrate=max_bitrate,
+    upstream_max_connections=upstream_max_connections,
+    upstream_host_connections=upstream_host_connections,
+    upstream_session_connections=upstream_session_connections,
+    upstream_keepalive=upstream_keepalive,
+    upstream_reserved=upstream_reserved,
+    breaker_failures=breaker_failures,
+    breaker_reset=breaker_reset,
     # Configure CSP headers with broader permissions for development
     frontend_headers={
         "Content-Security-Policy": (
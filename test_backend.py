@@ -3,10 +3,13 @@
 Simple test script to verify backend functionality
 """
 import os
+import json
+import time
 import asyncio
 import httpx
 import pytest
-from freesky.free_sky import StepDaddy
+from freesky import backend
+from freesky.free_sky import StepDaddy, ChannelSession
 from freesky.backend import fastapi_app
 from fastapi.testclient import TestClient
 
@@ -23,4 +26,1210 @@ def test_health():
 def test_ping():
     response = client.get("/ping")
     assert response.status_code == 200
-    assert response.json()["status"] == "ok" 
\ No newline at end of file
+    assert response.json()["status"] == "ok"
+
+def test_stream_single_flight(monkeypatch):
+    calls = []
+
+    async def fake_stream(channel_id, variant=None):
+        calls.append(channel_id)
+        await asyncio.sleep(0.05)
+        return "#EXTM3U\n"
+
+    monkeypatch.setattr(backend.free_sky, "stream", fake_stream)
+    backend.stream_cache.clear()
+    before = backend.stream_resolutions.stats()
+
+    async def run():
+        return await asyncio.gather(*(backend.stream("9001") for _ in range(5)))
+
+    responses = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r.body == b"#EXTM3U\n" for r in responses)
+    stats = backend.stream_resolutions.stats()
+    assert stats["leaders"] - before["leaders"] == 1
+    assert stats["coalesced"] - before["coalesced"] == 4
+
+
+class FakeResponse:
+    def __init__(self, text="", status_code=200, content=b""):
+        self.text = text
+        self.status_code = status_code
+        self.content = content
+
+
+def test_channel_session_reused_until_upstream_rejects(monkeypatch):
+    step_daddy = StepDaddy()
+    resolved = []
+    statuses = [200, 200, 403, 200]
+
+    async def fake_resolve(channel_id):
+        resolved.append(channel_id)
+        return ChannelSession(
+            channel_id=channel_id,
+            source_url="https://source.example/embed",
+            channel_key="premium51",
+            server_url="https://cdn.example/premium51/mono.m3u8",
+            key_host="source.example",
+            expires_at=time.time() + 600,
+        )
+
+    async def fake_get(url, **kwargs):
+        return FakeResponse("#EXTM3U\n", statuses.pop(0))
+
+    monkeypatch.setattr(step_daddy, "_resolve_session", fake_resolve)
+    monkeypatch.setattr(step_daddy.upstream.session, "get", fake_get)
+
+    async def run():
+        await step_daddy.stream("51")
+        await step_daddy.stream("51")
+        await step_daddy.stream("51")
+
+    asyncio.run(run())
+    # One handshake for the first two refreshes, one more after the 403
+    assert resolved == ["51", "51"]
+    assert statuses == []
+
+
+def test_request_rates_rank_hot_channels(monkeypatch):
+    rates = backend.RequestRates()
+    now = time.time()
+    monkeypatch.setattr(backend.time, "time", lambda: now)
+    for _ in range(5):
+        rates.hit("hot")
+    rates.hit("warm")
+    monkeypatch.setattr(backend.time, "time", lambda: now - 120)
+    rates.hit("idle")
+    monkeypatch.setattr(backend.time, "time", lambda: now)
+    assert rates.hottest(2, idle_cutoff=60) == ["hot", "warm"]
+    assert rates.hottest(5, idle_cutoff=60) == ["hot", "warm"]
+
+
+def test_prewarm_refreshes_requested_variants_and_backs_off(monkeypatch):
+    calls = []
+    failing = {"ch1"}
+
+    async def fake_fetch_playlist(channel_id, variant=None):
+        calls.append((channel_id, variant))
+        if channel_id in failing:
+            raise RuntimeError("upstream down")
+        return "#EXTM3U\n"
+
+    monkeypatch.setattr(backend, "fetch_playlist", fake_fetch_playlist)
+    monkeypatch.setattr(backend, "stream_rates", backend.RequestRates())
+    monkeypatch.setattr(backend, "requested_variants", {})
+    monkeypatch.setattr(backend, "prewarm_backoff", {})
+    monkeypatch.setattr(backend, "prewarm_stats", {"refreshes": 0, "failures": 0})
+    backend.stream_cache.clear()
+    backend.note_stream_request("ch1", "v1")
+    backend.note_stream_request("ch2", "v2")
+
+    asyncio.run(backend.prewarm_tick())
+    # Only the variant playlists players poll are refreshed, never the unrequested masters
+    assert sorted(calls) == [("ch1", "v1"), ("ch2", "v2")]
+    assert backend.stream_cache.get(backend.stream_cache_key("ch2", "v2")) is not None
+    assert backend.prewarm_stats == {"refreshes": 1, "failures": 1}
+
+    calls.clear()
+    asyncio.run(backend.prewarm_tick())
+    # The failing variant backs off instead of being retried on every tick
+    assert calls == []
+    failures, retry_at = backend.prewarm_backoff[backend.stream_cache_key("ch1", "v1")]
+    assert failures == 1 and retry_at > time.time()
+
+    failing.clear()
+    monkeypatch.setattr(backend.time, "time", lambda: retry_at + 0.1)
+    asyncio.run(backend.prewarm_tick())
+    assert calls == [("ch1", "v1")]
+    assert backend.prewarm_backoff == {}
+
+
+def test_segment_cache_fans_out_in_flight_download():
+    from freesky.segment_cache import SegmentCache
+
+    fetches = []
+
+    async def fake_fetch(url, entry):
+        fetches.append(url)
+        entry.start(6)
+        for chunk in (b"ab", b"cd", b"ef"):
+            await asyncio.sleep(0.01)
+            entry.append(chunk)
+
+    async def read(entry):
+        await entry.ready()
+        return b"".join([chunk async for chunk in entry.iter_chunks()])
+
+    async def run():
+        cache = SegmentCache(fake_fetch, max_bytes=1024)
+        first = cache.get("https://cdn.example/seg1.ts")
+        await asyncio.sleep(0.015)  # Second viewer arrives mid-download
+        second = cache.get("https://cdn.example/seg1.ts")
+        bodies = await asyncio.gather(read(first), read(second))
+        third = cache.get("https://cdn.example/seg1.ts")
+        return bodies + [await read(third)], cache.stats()
+
+    bodies, stats = asyncio.run(run())
+    assert bodies == [b"abcdef"] * 3
+    assert fetches == ["https://cdn.example/seg1.ts"]
+    assert (stats["misses"], stats["joins"], stats["hits"]) == (1, 1, 1)
+    assert stats["bytes"] == 6
+
+
+def test_admission_round_robins_flows_and_rejects_when_saturated():
+    from freesky.admission import AdmissionController, Saturated
+
+    async def run():
+        controller = AdmissionController(max_active=10, per_host=1, max_wait=0.2, max_queue=3)
+        held = await controller.acquire("edge.example", "busy")
+        order = []
+
+        async def wait(flow):
+            slot = await controller.acquire("edge.example", flow)
+            order.append(flow)
+            slot.release()
+
+        waiters = [asyncio.create_task(wait(flow)) for flow in ("busy", "busy", "quiet")]
+        await asyncio.sleep(0)
+        with pytest.raises(Saturated):
+            await controller.acquire("edge.example", "other")  # Queue is full
+        held.release()
+        await asyncio.gather(*waiters)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(run())
+    # The quiet channel is served before the busy channel's second request
+    assert order == ["busy", "quiet", "busy"]
+    assert stats["rejected_full"] == 1
+    assert stats["active"] == 0
+
+
+def test_segment_relay_slices_cached_body_without_copies():
+    from freesky.segment_cache import SegmentEntry
+
+    payload = os.urandom(1024 * 1024)
+    entry = SegmentEntry("https://cdn.example/seg2.ts")
+    entry.start(len(payload))
+    for i in range(0, len(payload), 16 * 1024):
+        entry.append(payload[i:i + 16 * 1024])
+    entry.finish()
+
+    async def read():
+        return [piece async for piece in entry.iter_chunks()]
+
+    pieces = asyncio.run(read())
+    assert entry.body_length() == len(payload)
+    assert all(isinstance(piece, memoryview) for piece in pieces)
+    assert len(pieces) < 16
+    assert b"".join(pieces) == payload
+
+
+def test_disk_spool_round_trip_and_janitor(tmp_path):
+    from freesky.spool import DiskSpool
+
+    spool = DiskSpool(str(tmp_path), max_bytes=10, max_ages={"segment": 60, "key": 600})
+
+    async def run():
+        await spool.store("segment", "https://cdn.example/a.ts", [b"12345", b"678"])
+        await spool.store("key", "https://keys.example/k", [b"abcdef"])
+        path = await spool.lookup("segment", "https://cdn.example/a.ts")
+        with open(path, "rb") as f:
+            body = f.read()
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        expired = await spool.lookup("segment", "https://cdn.example/a.ts")
+        removed = spool._sweep()
+        return body, expired, removed, await spool.read("key", "https://keys.example/k")
+
+    body, expired, removed, key = asyncio.run(run())
+    assert body == b"12345678"
+    assert expired is None
+    assert removed == 1
+    assert key == b"abcdef"
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_key_cache_serves_repeat_requests_and_evicts_on_error(monkeypatch):
+    from freesky.utils import encrypt
+
+    fetched = []
+
+    async def fake_key(url, host):
+        fetched.append(url)
+        return b"0123456789abcdef"
+
+    monkeypatch.setattr(backend.free_sky, "key", fake_key)
+    path = f"/key/{encrypt('https://keys.example/premium51/1')}/{encrypt('source.example')}"
+    before = dict(backend.key_stats)
+
+    assert client.get(path).content == b"0123456789abcdef"
+    assert client.get(path).content == b"0123456789abcdef"
+    assert len(fetched) == 1
+    assert backend.key_stats["hits"] - before["hits"] == 1
+
+    async def failing_key(url, host):
+        raise Exception("Failed to get key")
+
+    backend.key_cache["https://keys.example/premium51/1"] = (b"stale", 0)
+    asyncio.run(backend.shared_cache.delete("key:https://keys.example/premium51/1"))
+    monkeypatch.setattr(backend.free_sky, "key", failing_key)
+    assert client.get(path).status_code == 500
+    assert "https://keys.example/premium51/1" not in backend.key_cache
+
+
+def test_playlist_is_precomputed_with_etag_and_gzip(monkeypatch):
+    import gzip
+    from freesky.free_sky import Channel
+
+    monkeypatch.setattr(backend.free_sky, "channels", [
+        Channel(id="51", name="ABC USA", tags=["news"], logo="/missing.png"),
+    ])
+    response = client.get("/playlist.m3u8", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "ABC USA" in response.text  # The test client transparently decodes gzip
+    etag = response.headers["etag"]
+
+    cached = client.get("/api/playlist.m3u8", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag and cached.headers["vary"] == "Accept-Encoding"
+
+    # Each encoding is its own representation: the gzip validator doesn't revalidate the identity body
+    identity = client.get("/playlist.m3u8", headers={"If-None-Match": etag, "Accept-Encoding": "identity"})
+    assert identity.status_code == 200 and "content-encoding" not in identity.headers
+    assert identity.headers["etag"] != etag and identity.headers["etag"] == backend.free_sky.playlist_snapshot.etag
+    assert etag == backend.free_sky.playlist_snapshot.etags["gzip"]
+    assert gzip.decompress(backend.free_sky.playlist_snapshot.variants["gzip"]) == backend.free_sky.playlist_snapshot.body
+
+
+def test_channel_registry_lookups_and_fallback_parsed_once(monkeypatch):
+    from freesky.free_sky import Channel
+
+    monkeypatch.setattr(backend.free_sky, "channels", [
+        Channel(id="51", name="ABC USA", tags=["News"], logo="/missing.png"),
+        Channel(id="65", name="Sky Sports Main Event (UK)", tags=["sports"], logo="/missing.png"),
+    ])
+    assert backend.get_channel("65").name == "Sky Sports Main Event (UK)"
+    assert backend.get_channel("missing") is None
+
+    monkeypatch.setattr(backend.free_sky, "channels", [])
+    assert backend.load_fallback_channels() is backend.load_fallback_channels()
+    fallback = backend.load_fallback_channels()
+    if fallback:
+        assert backend.get_channel(fallback[0].id) is fallback[0]
+
+
+def test_xor_cipher_matches_per_byte_reference():
+    from freesky import utils
+
+    for length in (0, 1, 63, 64, 65, 150, 300, 4096):
+        data = os.urandom(length)
+        expected = bytes(b ^ utils.key_bytes[i % len(utils.key_bytes)] for i, b in enumerate(data))
+        assert utils.xor(data) == expected
+    url = "https://zekonew.newkso.ru/zeko/premium51/segment-1.ts"
+    assert utils.decrypt(utils.encrypt(url)) == url
+
+
+def test_token_cache_reuses_tokens_and_resolves_without_decrypt():
+    from freesky.utils import TokenCache, decrypt
+
+    cache = TokenCache(maxsize=2)
+    first = cache.encode("https://cdn.example/1.ts")
+    assert cache.encode("https://cdn.example/1.ts") == first
+    assert cache.decode(first) == "https://cdn.example/1.ts" == decrypt(first)
+    cache.encode("https://cdn.example/2.ts")
+    cache.encode("https://cdn.example/3.ts")  # Evicts the oldest URL and its token
+    assert cache.decode(first) == "https://cdn.example/1.ts"
+    stats = cache.stats()
+    assert (stats["encode_hits"], stats["decode_hits"], stats["decode_misses"]) == (1, 1, 1)
+    assert stats["entries"] == 2
+
+
+def test_m3u8_rewriter_handles_hls_tags_and_relative_uris():
+    from freesky import m3u8
+
+    playlist = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        '#EXT-X-KEY:METHOD=AES-128,URI="/keys/k1",IV=0x01',
+        '#EXT-X-MAP:URI="init.mp4"',
+        "#EXTINF:6.0,",
+        "seg-1.ts",
+        "#EXTINF:6.0,",
+        "https://other.example/seg-2.ts",
+        '#EXT-X-KEY:METHOD=SAMPLE-AES,URI="skd://fairplay"',
+        "",
+    ])
+    seen = []
+
+    def rewrite_uri(kind, url, tag):
+        seen.append((kind, url))
+        return f"<{kind}>"
+
+    out = m3u8.rewrite(playlist, "https://edge.example/live/ch51/mono.m3u8", rewrite_uri)
+    assert seen == [
+        ("key", "https://edge.example/keys/k1"),
+        ("segment", "https://edge.example/live/ch51/init.mp4"),
+        ("segment", "https://edge.example/live/ch51/seg-1.ts"),
+        ("segment", "https://other.example/seg-2.ts"),
+    ]
+    assert '#EXT-X-KEY:METHOD=AES-128,URI="<key>",IV=0x01' in out
+    assert '#EXT-X-KEY:METHOD=SAMPLE-AES,URI="skd://fairplay"' in out
+
+    master = "\n".join([
+        "#EXTM3U",
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="en",URI="audio/en.m3u8"',
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,AUDIO="aud"',
+        "low/index.m3u8",
+    ])
+    variants = []
+    m3u8.rewrite(master, "https://edge.example/live/master.m3u8", lambda kind, url, tag: variants.append((kind, url, m3u8.bandwidth(tag))))
+    assert m3u8.is_master(master)
+    assert variants == [
+        ("media", "https://edge.example/live/audio/en.m3u8", None),
+        ("variant", "https://edge.example/live/low/index.m3u8", 800000),
+    ]
+
+
+def test_master_playlist_variants_are_proxied_and_capped(monkeypatch):
+    from rxconfig import config
+    from freesky.utils import TokenError, encrypt, tokens
+
+    step_daddy = StepDaddy()
+    session = ChannelSession(
+        channel_id="51",
+        source_url="https://source.example/embed",
+        channel_key="premium51",
+        server_url="https://cdn.example/premium51/master.m3u8",
+        key_host="source.example",
+        expires_at=time.time() + 600,
+    )
+    master = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=1920x1080",
+        "hd/index.m3u8",
+        "#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=854x480",
+        "sd/index.m3u8",
+        '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=3000000,URI="hd/iframe.m3u8"',
+        '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=200000,URI="sd/iframe.m3u8"',
+        "",
+    ])
+    fetched = []
+
+    async def fake_get(url, **kwargs):
+        fetched.append(url)
+        return FakeResponse(master if url.endswith("master.m3u8") else "#EXTM3U\n#EXTINF:4,\nseg-1.ts\n")
+
+    async def fake_session(channel_id):
+        return session
+
+    monkeypatch.setattr(step_daddy.upstream.session, "get", fake_get)
+    monkeypatch.setattr(step_daddy, "channel_session", fake_session)
+    monkeypatch.setattr(config, "max_bitrate", 2000000)
+
+    out = asyncio.run(step_daddy.stream("51"))
+    sd_token = tokens.encode("https://cdn.example/premium51/sd/index.m3u8", "51", expires=0)
+    assert f"/api/stream/51/{sd_token}.m3u8" in out
+    # Variant URLs are re-polled for the whole session, so they must not expire
+    assert tokens.resolve(sd_token).expires == 0
+    assert "BANDWIDTH=6000000" not in out and "hd/index" not in out
+    # Over-cap I-frame playlists are dropped whole, under-cap ones proxied
+    assert "BANDWIDTH=3000000" not in out and "object" not in out
+    iframe_token = tokens.encode("https://cdn.example/premium51/sd/iframe.m3u8", "51", expires=0)
+    assert f'#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=200000,URI="/api/stream/51/{iframe_token}.m3u8"' in out
+
+    variant = asyncio.run(step_daddy.stream("51", sd_token))
+    assert fetched[-1] == "https://cdn.example/premium51/sd/index.m3u8"
+    assert "/api/content/" in variant
+
+    # A variant token only plays on the channel it was minted for, and bad tokens never reach upstream
+    fetched.clear()
+    with pytest.raises(TokenError):
+        asyncio.run(step_daddy.stream("52", sd_token))
+    assert client.get(f"/stream/52/{sd_token}.m3u8").status_code == 403
+    assert client.get("/stream/51/bm90LWEtdG9rZW4.m3u8").status_code == 403
+    expired = encrypt("https://cdn.example/premium51/sd/index.m3u8", "51", expires=int(time.time()) - 1)
+    assert client.get(f"/stream/51/{expired}.m3u8").status_code == 410
+    assert fetched == []
+
+
+def test_prefetcher_fills_cache_with_newest_segments():
+    from freesky.admission import AdmissionController
+    from freesky.prefetch import Prefetcher
+    from freesky.segment_cache import SegmentCache
+    from freesky.utils import tokens
+
+    fetched = []
+
+    async def fake_fetch(url, entry):
+        fetched.append(url)
+        entry.start(4)
+        entry.append(b"data")
+
+    urls = [f"https://cdn.example/premium51/{i}.ts" for i in range(4)]
+    playlist = "#EXTM3U\n" + "".join(f"#EXTINF:4,\n/api/content/{tokens.encode(url)}\n" for url in urls)
+    playlist += "#EXTINF:4,\n/api/content/bm90LWEtdG9rZW4\n"  # Undecodable tokens are skipped
+
+    async def run():
+        cache = SegmentCache(fake_fetch, max_bytes=1024)
+        prefetcher = Prefetcher(cache, AdmissionController(), depth=2, concurrency=2)
+        task = asyncio.create_task(prefetcher.run(interval=0.01))
+        prefetcher.schedule("51", playlist)
+        prefetcher.schedule("51", playlist)  # Already queued segments are not queued twice
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if prefetcher.completed == 2:
+                break
+        prefetcher.claim(urls[3])
+        task.cancel()
+        await task
+        return cache, prefetcher.stats()
+
+    cache, stats = asyncio.run(run())
+    assert sorted(fetched) == urls[2:]
+    assert cache.cached(urls[3]) is not None
+    assert (stats["scheduled"], stats["completed"], stats["hits"]) == (2, 2, 1)
+
+    # A fresh cached playlist is served as-is even if its tokens don't decode here
+    backend.stream_cache["stream_77"] = (playlist, time.time())
+    served = dict(backend.stale_stats)
+    response = client.get("/stream/77.m3u8")
+    assert response.status_code == 200 and "warning" not in response.headers
+    assert backend.stale_stats == served
+
+
+def test_prefetch_joined_in_flight_counts_as_hit():
+    from freesky.admission import AdmissionController
+    from freesky.prefetch import Prefetcher
+    from freesky.segment_cache import SegmentCache
+    from freesky.utils import tokens
+
+    url = "https://cdn.example/premium51/0.ts"
+
+    async def slow_fetch(url, entry):
+        entry.start(4)
+        await asyncio.sleep(0.05)
+        entry.append(b"data")
+
+    async def run():
+        cache = SegmentCache(slow_fetch, max_bytes=1024)
+        prefetcher = Prefetcher(cache, AdmissionController(), depth=1, concurrency=1)
+        task = asyncio.create_task(prefetcher.run(interval=0.01))
+        prefetcher.schedule("51", f"#EXTM3U\n#EXTINF:4,\n/api/content/{tokens.encode(url)}\n")
+        while url not in prefetcher._inflight:
+            await asyncio.sleep(0.005)
+        # A viewer asks while the prefetch is still downloading and shares its entry
+        prefetcher.claim(url)
+        await cache.get(url).wait_done()
+        cache.ttl = 0  # Anything left unclaimed is swept as waste right away
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await task
+        return prefetcher.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["completed"], stats["hits"], stats["wasted"]) == (1, 1, 0)
+    assert stats["hit_ratio"] == 1.0
+
+
+def test_redis_backend_resolves_once_per_cluster():
+    fakeredis = pytest.importorskip("fakeredis")
+    from freesky.cache_backend import RedisBackend
+
+    server = fakeredis.FakeServer()
+    workers = [RedisBackend(fakeredis.FakeAsyncRedis(server=server)) for _ in range(3)]
+    resolved = []
+
+    async def resolve():
+        resolved.append(1)
+        await asyncio.sleep(0.1)
+        return b"#EXTM3U\n"
+
+    async def run():
+        values = await asyncio.gather(*(w.single_flight("stream_51", 30, resolve) for w in workers))
+        # A copy about to expire is refreshed rather than reused
+        refreshed = await workers[0].single_flight("stream_51", 30, resolve, min_ttl=60)
+        held = await workers[1]._client.get("freesky:lock:stream_51")
+        return values, refreshed, held
+
+    values, refreshed, held = asyncio.run(run())
+    assert values == [b"#EXTM3U\n"] * 3
+    assert refreshed == b"#EXTM3U\n"
+    assert len(resolved) == 2
+    assert held is None
+    assert sum(w.leaders for w in workers) == 2
+    assert sum(w.followers for w in workers) == 2
+
+
+def test_single_flight_waiters_share_leader_failure_and_respect_budget():
+    from freesky.cache_backend import LeaderFailed, MemoryBackend
+    from freesky.latency import budget
+
+    workers = MemoryBackend()  # One lock table, as Redis gives every worker
+    calls = []
+
+    async def failing():
+        calls.append("failing")
+        await asyncio.sleep(0.1)
+        raise RuntimeError("upstream down")
+
+    async def stuck():
+        calls.append("stuck")
+        await asyncio.sleep(1)
+        return b"#EXTM3U\n"
+
+    async def wait_within(seconds):
+        with budget(seconds):
+            return await workers.single_flight("stream_52", 30, stuck)
+
+    async def run():
+        failures = await asyncio.gather(
+            *(workers.single_flight("stream_51", 30, failing) for _ in range(3)), return_exceptions=True
+        )
+        leader = asyncio.create_task(workers.single_flight("stream_52", 30, stuck))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await wait_within(0.2)
+        waited = time.monotonic() - started
+        await leader
+        return failures, waited
+
+    failures, waited = asyncio.run(run())
+    # The leader's error reaches its waiters instead of each retrying upstream in turn
+    assert calls == ["failing", "stuck"]
+    assert isinstance(failures[0], RuntimeError)
+    assert all(isinstance(failure, LeaderFailed) for failure in failures[1:])
+    # A waiter gives up when its request budget runs out, not after lock_ttl
+    assert waited < 0.5
+    assert workers.failed == 2 and workers.fallbacks == 0
+
+
+def test_cluster_forwards_to_channel_owner(monkeypatch):
+    from freesky.cache_backend import MemoryBackend
+    from freesky.cluster import Cluster
+
+    members = [f"http://node-{i}:8005" for i in range(4)]
+    cluster = Cluster(members[0], members, secret="s3cret")
+    owners = {str(channel_id): cluster.owner(str(channel_id)) for channel_id in range(1000)}
+    assert set(owners.values()) == set(members)
+
+    # Removing a node only moves the channels it owned
+    smaller = Cluster(members[0], members[:3])
+    moved = [c for c, owner in owners.items() if smaller.owner(c) != owner]
+    assert all(owners[c] == members[3] for c in moved)
+
+    async def register():
+        registry = MemoryBackend()
+        await registry.register("cluster", members[1], 15)
+        await registry.register("cluster", members[2], -1)
+        return await registry.members("cluster")
+
+    assert asyncio.run(register()) == [members[1]]
+
+    # Route requests to a remote owner back into this app, standing in for that node
+    remote = next(c for c, owner in owners.items() if owner != members[0])
+    requested = []
+
+    async def fake_stream(channel_id, variant=None):
+        return "#EXTM3U\n"
+
+    async def record(request):
+        requested.append((str(request.url), request.headers.get("x-freesky-cluster")))
+
+    monkeypatch.setattr(backend, "cluster", cluster)
+    monkeypatch.setattr(backend.free_sky, "stream", fake_stream)
+
+    async def run():
+        monkeypatch.setattr(backend.upstream, "http", httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=fastapi_app), event_hooks={"request": [record]}
+        ))
+        return await backend.fetch_playlist(remote)
+
+    assert asyncio.run(run()) == "#EXTM3U\n"
+    assert requested == [(f"{owners[remote]}/cluster/stream/{remote}.m3u8", "s3cret")]
+    assert client.get(f"/cluster/stream/{remote}.m3u8").status_code == 403
+
+    # An owner that refuses (e.g. a token minted with another secret) is skipped and the work done here
+    def refusing_owner(request):
+        if request.url.path.startswith("/cluster/"):
+            return httpx.Response(403)
+        return httpx.Response(200, stream=httpx.ByteStream(b"segment"))
+
+    segment_url = next(
+        f"https://cdn.example/{c}/seg-1.ts" for c in range(1000)
+        if cluster.owner(backend.segment_owner_key(f"https://cdn.example/{c}/seg-1.ts")) not in (members[0], owners[remote])
+    )
+
+    async def refused():
+        monkeypatch.setattr(backend.upstream, "http", httpx.AsyncClient(transport=httpx.MockTransport(refusing_owner)))
+        playlist = await backend.fetch_playlist(remote)
+        entry = backend.SegmentEntry(segment_url)
+        await backend.fetch_segment(segment_url, entry)
+        return playlist, b"".join(entry.chunks)
+
+    assert asyncio.run(refused()) == ("#EXTM3U\n", b"segment")
+    assert cluster.forward_failures == 2 and cluster.stats()["down"]
+    assert cluster.remote_owner(remote) is None  # Served locally until the owner's down period ends
+
+
+def test_upstream_gate_serves_segments_before_metadata():
+    from freesky.upstream import ConnectionGate, SEGMENT, KEY, METADATA
+
+    async def run():
+        gate = ConnectionGate(max_active=2, per_host=2, reserved=1)
+        await gate.acquire("cdn", SEGMENT)
+        order = []
+
+        async def request(host, purpose, name):
+            async with gate.slot(host, purpose):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        # Metadata may not take the last (reserved) slot, so it queues behind later key/segment work
+        tasks = [asyncio.create_task(request("provider", METADATA, "channels"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("provider", KEY, "key")))
+        await asyncio.sleep(0)
+        gate.release("cdn", SEGMENT)
+        tasks.append(asyncio.create_task(request("cdn", SEGMENT, "segment")))
+        await asyncio.gather(*tasks)
+        return order, gate.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["key", "segment", "channels"]
+    assert stats["active"] == 0 and stats["peak"] == 2
+    assert stats["purposes"]["metadata"]["waited"] == 1
+    assert stats["purposes"]["segment"]["requests"] == 2
+
+
+def test_latency_tracker_hedges_slow_hops_within_budget():
+    from freesky.latency import LatencyTracker, budget
+
+    tracker = LatencyTracker(min_samples=5)
+    calls = []
+
+    async def send(timeout):
+        calls.append(timeout)
+        # Only the first request of the slow round stalls
+        await asyncio.sleep(1.0 if len(calls) == 6 else 0.01)
+        return len(calls)
+
+    async def run():
+        for _ in range(5):
+            await tracker.call("m3u8", send, hedge=True)
+        hedged = await tracker.call("m3u8", send, hedge=True)
+        with budget(3.0):
+            # Typical time for later hops is kept free: 0.5 s for unmeasured server_lookup, ~0.01 s for m3u8
+            capped = tracker.timeout("auth", then=("server_lookup", "m3u8"))
+        return hedged, capped
+
+    started = time.monotonic()
+    hedged, capped = asyncio.run(run())
+    stats = tracker.stats()["m3u8"]
+    assert hedged == 7  # The hedge answered first
+    assert time.monotonic() - started < 0.8
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+    assert stats["p95"] < 0.2
+    assert stats["timeout"] == tracker.floor
+    assert 2.4 < capped <= 2.5
+
+
+def test_circuit_breaker_opens_and_stale_playlist_is_served(monkeypatch):
+    from freesky.breaker import CircuitBreaker, CircuitOpen
+    from freesky.upstream import METADATA
+
+    step_daddy = StepDaddy()
+    step_daddy.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    requests = []
+
+    async def failing_get(url, **kwargs):
+        requests.append(url)
+        return FakeResponse("", 502)
+
+    monkeypatch.setattr(step_daddy.upstream.session, "get", failing_get)
+
+    async def fetch():
+        return await step_daddy._request("GET", "https://provider.example/schedule", METADATA)
+
+    asyncio.run(fetch())
+    asyncio.run(fetch())
+    with pytest.raises(CircuitOpen):
+        asyncio.run(fetch())  # Rejected without touching upstream
+    assert len(requests) == 2
+    assert step_daddy.breaker.stats()["provider.example"]["state"] == "open"
+
+    time.sleep(0.06)
+    step_daddy.breaker.check("provider.example")  # The single half-open probe
+    with pytest.raises(CircuitOpen):
+        step_daddy.breaker.check("provider.example")
+    step_daddy.breaker.success("provider.example")
+    assert step_daddy.breaker.state("provider.example") == "closed"
+
+    # A budget used up by earlier hops times out before sending, which isn't the host's failure
+    from freesky.latency import budget
+
+    async def out_of_budget():
+        with budget(0):
+            await step_daddy._hop("source", "GET", "https://slow-budget.example/embed")
+
+    for _ in range(3):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(out_of_budget())
+    assert step_daddy.breaker.state("slow-budget.example") == "closed"
+    assert "slow-budget.example" not in step_daddy.breaker.stats()
+
+    async def open_circuit(channel_id, variant=None):
+        raise CircuitOpen("provider.example", 30)
+
+    monkeypatch.setattr(backend.free_sky, "stream", open_circuit)
+    backend.stream_cache[backend.stream_cache_key("9002")] = ("#EXTM3U\n#stale\n", time.time() - 60)
+    response = client.get("/stream/9002.m3u8")
+    assert response.status_code == 200
+    assert response.text == "#EXTM3U\n#stale\n"
+    assert "Stale" in response.headers["warning"]
+    assert client.get("/stream/9003.m3u8").status_code == 503
+
+
+def test_url_tokens_are_portable_signed_and_expire(monkeypatch):
+    from freesky import utils
+
+    url = "https://cdn.example/premium51/seg-1.ts"
+    cache = utils.TokenCache(ttl=60)
+    token = cache.encode(url, "51")
+    assert cache.encode(url, "51") == token  # Stable within an expiry step
+    # Another worker configured with the same secret resolves it from scratch
+    assert utils.open_token(token) == (url, "51", cache._decoded[token].expires)
+    assert 30 <= cache._decoded[token].expires - time.time() <= 60
+
+    old_key = utils.current_key
+    monkeypatch.setattr(utils, "token_keys", dict(utils.token_keys))
+    utils.set_token_keys([utils.TokenKey(7, b"rotated"), old_key])
+    try:
+        assert utils.decrypt(token) == url  # Tokens from the previous key still verify
+        assert utils.open_token(utils.encrypt(url))[:2] == (url, "")
+        assert utils.encrypt(url)[:4] != token[:4]  # New tokens carry the new key id
+    finally:
+        utils.set_token_keys([old_key])
+
+    tampered = token[:12] + ("A" if token[12] != "A" else "B") + token[13:]
+    with pytest.raises(utils.TokenError):
+        utils.open_token(tampered)
+    with pytest.raises(utils.TokenExpired):
+        utils.open_token(utils.encrypt(url, "51", expires=int(time.time()) - 1))
+
+    assert client.get(f"/content/{utils.encrypt(url, '51', expires=1)}").status_code == 410
+    assert client.get(f"/content/{tampered}").status_code == 403
+
+
+def test_token_secrets_are_validated_and_fallback_is_shared_through_the_cache(monkeypatch):
+    from freesky import utils
+    from freesky.cache_backend import MemoryBackend
+
+    assert utils.parse_token_secrets("2:new, 1:old") == [(2, b"new"), (1, b"old")]
+    with pytest.raises(ValueError):
+        utils.parse_token_secrets("256:too-big")
+
+    old_key = utils.current_key
+    monkeypatch.setattr(utils, "token_keys", dict(utils.token_keys))
+    monkeypatch.setattr(utils, "token_keys_shared", False)
+    try:
+        # Workers with only a per-process cache could never decode each other's tokens
+        monkeypatch.setattr(backend, "workers", 4)
+        with pytest.raises(RuntimeError):
+            asyncio.run(backend.startup_event())
+
+        shared = MemoryBackend()
+        shared.shared = True  # Stands in for Redis
+        assert asyncio.run(utils.share_token_secret(shared))
+        first = utils.current_key
+        # The next worker to start adopts the stored secret instead of its own
+        utils.set_token_keys([utils.TokenKey(0, b"process-local")])
+        monkeypatch.setattr(utils, "token_keys_shared", False)
+        assert asyncio.run(utils.share_token_secret(shared))
+        assert utils.current_key.mac_key == first.mac_key
+    finally:
+        utils.set_token_keys([old_key])
+
+
+def test_shared_playlists_decode_in_another_worker(monkeypatch):
+    from freesky import utils
+    from freesky.cache_backend import MemoryBackend
+
+    url = "https://cdn.example/premium51/seg-1.ts"
+
+    async def fake_fetch_playlist(channel_id, variant=None):
+        return f"#EXTM3U\n#EXTINF:4,\n/api/content/{utils.tokens.encode(url, channel_id)}\n"
+
+    shared = MemoryBackend()
+    shared.shared = True  # Stands in for Redis
+    monkeypatch.setattr(backend, "fetch_playlist", fake_fetch_playlist)
+    monkeypatch.setattr(backend, "shared_cache", shared)
+    monkeypatch.setattr(utils, "token_keys", dict(utils.token_keys))
+    monkeypatch.setattr(utils, "token_keys_shared", False)
+    old_key = utils.current_key
+    try:
+        # Process-local tokens never reach the shared cache
+        backend.stream_cache.clear()
+        asyncio.run(backend.resolve_stream("51"))
+        assert asyncio.run(shared.get(backend.stream_cache_key("51"))) is None
+
+        assert asyncio.run(utils.share_token_secret(shared))
+        backend.stream_cache.clear()
+        asyncio.run(backend.resolve_stream("51"))
+        payload = asyncio.run(shared.get(backend.stream_cache_key("51")))
+        token = json.loads(payload)["data"].split("/api/content/")[1].strip()
+
+        # A second worker: its own key until it adopts the shared secret, and a cold token cache
+        utils.set_token_keys([utils.TokenKey(0, b"second-worker")])
+        monkeypatch.setattr(utils, "token_keys_shared", False)
+        with pytest.raises(utils.TokenError):
+            utils.TokenCache().resolve(token)
+        assert asyncio.run(utils.share_token_secret(shared))
+        assert utils.TokenCache().resolve(token)[:2] == (url, "51")
+    finally:
+        utils.set_token_keys([old_key])
+        utils.tokens.clear()
+
+
+def test_logo_store_dedupes_fetches_and_serves_conditional_requests(monkeypatch, tmp_path):
+    from freesky import logos
+    from freesky.utils import urlsafe_base64
+
+    png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+    fetched = []
+
+    async def fake_fetch(url):
+        fetched.append(url)
+        await asyncio.sleep(0.01)
+        if "missing" in url:
+            raise logos.LogoNotFound(url)
+        return png + url.encode()
+
+    store = logos.LogoStore(str(tmp_path), fake_fetch, backend.SingleFlight())
+
+    async def run():
+        # Same file name on two hosts must not collide
+        return await asyncio.gather(*(
+            store.get(f"https://{host}.example/logo.png") for host in ("a", "b") for _ in range(5)
+        ))
+
+    results = asyncio.run(run())
+    assert len(fetched) == 2
+    assert results[0].body != results[5].body
+    assert results[0].media_type == "image/png"
+
+    # A fresh process reads originals back from disk instead of upstream
+    store = logos.LogoStore(str(tmp_path), fake_fetch, backend.SingleFlight())
+    monkeypatch.setattr(backend, "logos", store)
+    path = f"/logo/{urlsafe_base64('https://a.example/logo.png')}"
+    response = client.get(path)
+    assert response.status_code == 200 and response.content == results[0].body
+    assert len(fetched) == 2 and store.stats()["disk"] == 1
+    assert client.get(path, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    assert store.stats()["memory"] == 1
+    assert client.get(f"/logo/{urlsafe_base64('https://a.example/missing.png')}").status_code == 404
+
+    # Thumbnails snap to the served sizes; undecodable images fall back to the original
+    assert logos.snap_size(40) == 64 and logos.snap_size(100) == 128 and logos.snap_size(500) == 0
+    assert client.get(f"{path}?size=64").content == results[0].body
+    memory_hits = store.stats()["memory"]
+    assert client.get(f"{path}?size=64").content == results[0].body
+    assert store.stats()["memory"] == memory_hits + 1  # The fallback is remembered, not re-decoded
+    if logos.Image is not None:
+        import io
+
+        image = io.BytesIO()
+        logos.Image.new("RGB", (400, 200), "red").save(image, "PNG")
+        thumb = logos.thumbnail(image.getvalue(), 128)
+        assert logos.media_type(thumb) == "image/webp"
+        assert logos.Image.open(io.BytesIO(thumb)).size == (128, 64)
+
+
+@pytest.mark.parametrize("pillow", [True, False])
+def test_channel_refresh_prewarms_logos_into_versioned_manifest(monkeypatch, tmp_path, pillow):
+    import io
+    from freesky import logos
+    from freesky.free_sky import Channel
+    from freesky.utils import urlsafe_base64
+
+    if pillow:
+        Image = pytest.importorskip("PIL.Image")
+    else:
+        monkeypatch.setattr(logos, "Image", None)
+    fetched = []
+
+    async def fake_fetch(url):
+        fetched.append(url)
+        if not pillow:
+            return b"\x89PNG\r\n\x1a\n" + b"\x00" * 64 + url.encode()
+        out = io.BytesIO()
+        Image.new("RGB", (256, 256), tuple(url.encode()[-3:])).save(out, "PNG")  # A distinct colour per URL
+        return out.getvalue()
+
+    store = logos.LogoStore(str(tmp_path), fake_fetch, backend.SingleFlight())
+    monkeypatch.setattr(backend, "logos", store)
+    monkeypatch.setattr(backend, "logo_manifest", {"payload": None, "manifest": None, "checked": 0.0})
+    shared = f"/api/logo/{urlsafe_base64('https://a.example/shared.png')}"
+    channels = [
+        Channel(id="1", name="One", tags=[], logo=shared),
+        Channel(id="2", name="Two", tags=[], logo=shared),
+        Channel(id="3", name="Three", tags=[], logo=f"/api/logo/{urlsafe_base64('https://b.example/3.png')}"),
+        Channel(id="4", name="Four", tags=[], logo="/missing.png"),
+    ]
+    monkeypatch.setattr(backend.free_sky, "channels", [])
+    monkeypatch.setattr(backend, "logo_prewarm_stats", dict(backend.logo_prewarm_stats, runs=0, skipped=0, version=None))
+
+    async def refresh():
+        backend.free_sky.commit_channels(channels)  # As load_channels does with a freshly scraped list
+        await backend.logo_prewarm_task
+
+    asyncio.run(refresh())
+    assert sorted(fetched) == ["https://a.example/shared.png", "https://b.example/3.png"]
+    version = backend.logo_prewarm_stats["version"]
+
+    # A no-op refresh with the manifest still shared doesn't redo the pre-warm
+    resolved = store.stats()
+    asyncio.run(refresh())
+    assert backend.logo_prewarm_stats["runs"] == 1 and backend.logo_prewarm_stats["skipped"] == 1
+    assert store.stats() == resolved
+
+    manifest = client.get("/logos/manifest.json")
+    assert manifest.json()["version"] == version
+    assert client.get("/logos/manifest.json", headers={"If-None-Match": manifest.headers["etag"]}).status_code == 304
+    grid = {ch["id"]: ch["thumbnail"] for ch in client.get("/channels").json()["channels"]}
+    assert grid["1"] == grid["2"] == manifest.json()["logos"][shared]
+    assert grid["1"].startswith(f"{shared}?size=128&v=") and grid["4"] == "/missing.png"
+    response = client.get(grid["3"].removeprefix("/api"))
+    assert "immutable" in response.headers["cache-control"]
+    assert len(fetched) == 2  # The grid is served entirely from the pre-warmed store
+
+    sprite = manifest.json()["sprite"]
+    if pillow:
+        assert response.headers["content-type"] == "image/webp"
+        assert set(sprite["positions"]) == {shared, channels[2].logo}
+        assert client.get(sprite["src"].removeprefix("/api")).headers["content-type"] == "image/webp"
+    else:
+        assert sprite is None
+    assert logos.tile_position(0, 3, 2) == "0% 0%" and logos.tile_position(5, 3, 2) == "100% 100%"
+
+
+def test_meta_index_matches_upstream_name_variants_and_caches_by_mtime(tmp_path):
+    import json
+    import re
+    from freesky import meta_index
+
+    with open(meta_index.META_PATH, "r") as f:
+        meta = json.load(f)
+    variants = []
+    for name in meta:
+        variants += [name.upper(), f"{name.lower()} (HD)"]
+        if "&" in name or "'" in name:
+            variants.append(name.replace("&", "and").replace("'", ""))
+    variants += ["Galavisión USA", "beIN SPORTS en Español", "Hallmark Movies & Mysteries"]
+
+    index = meta_index.build_index()
+    exact = sum(1 for name in variants if re.sub(r"\s*\(.*?\)", "", name) in meta) / len(variants)
+    matched = sum(1 for name in variants if index.lookup(name)) / len(variants)
+    assert exact < 0.5
+    assert matched >= 0.99
+    assert index.lookup("Galavisión USA") == meta["Galavisi贸n USA"]
+
+    # Renames now live in meta_aliases.json
+    assert index.display_name("666", "Nick Jr Music") == "Nick Music"
+    assert index.display_name("666", "#0 Spain") == "Movistar Plus+"
+    # Renamed channels are looked up by their new name, so the rename alone finds their metadata
+    assert index.lookup(index.display_name("", "#0 Spain")) == meta["Movistar Plus+"]
+    step_daddy = StepDaddy()
+    channel = step_daddy._get_channel(("stream/stream-609.php", "", "Yas (UAE)"))
+    assert channel.name == "Yas TV UAE" and channel.tags == meta["Yas TV UAE"]["tags"]
+
+    meta_path, aliases_path, cache_path = (str(tmp_path / name) for name in ("meta.json", "aliases.json", "index.pickle"))
+    with open(meta_path, "w") as f:
+        json.dump({"Sky Sports UK": {"tags": ["sports"]}}, f)
+    with open(aliases_path, "w") as f:
+        json.dump({"aliases": {"Sky Sports": "Sky Sports UK"}}, f)
+    assert meta_index.load_index(meta_path, aliases_path, cache_path).source == "json"
+    cached = meta_index.load_index(meta_path, aliases_path, cache_path)
+    assert cached.source == "pickle" and cached.lookup("SKY SPORTS (1080p)") == {"tags": ["sports"]}
+    with open(meta_path, "w") as f:
+        json.dump({"Sky Sports UK": {"tags": ["football"]}}, f)
+    os.utime(meta_path, ns=(0, 1))  # A changed mtime invalidates the cache even at the same size
+    rebuilt = meta_index.load_index(meta_path, aliases_path, cache_path)
+    assert rebuilt.source == "json" and rebuilt.lookup("sky sports") == {"tags": ["football"]}
+
+
+def test_noop_channel_refresh_keeps_streams_cached_and_diffs_changes(monkeypatch):
+    from freesky.free_sky import Channel
+
+    resolved = []
+
+    async def fake_stream(channel_id, variant=None):
+        resolved.append(channel_id)
+        return f"#EXTM3U\n#{channel_id}\n"
+
+    channels = [
+        Channel(id="51", name="ABC USA", tags=["news"], logo="/missing.png"),
+        Channel(id="65", name="Sky Sports Main Event", tags=["sports"], logo="/missing.png"),
+        Channel(id="70", name="Sky Sports Football", tags=["sports"], logo="/missing.png"),
+    ]
+    monkeypatch.setattr(backend.free_sky, "stream", fake_stream)
+    monkeypatch.setattr(backend.free_sky, "channels", channels)
+    backend.stream_cache.clear()
+    diffs = []
+    monkeypatch.setattr(backend.free_sky, "channel_listeners", backend.free_sky.channel_listeners + [diffs.append])
+
+    async def watch():
+        for channel_id in ("51", "65", "70"):
+            await backend.stream(channel_id)
+
+    async def refresh(new_channels):
+        backend.free_sky.commit_channels(new_channels, source="shared")
+        await asyncio.gather(*backend.invalidation_tasks)
+
+    async def run():
+        for channel_id in ("51", "65", "70"):
+            await backend.shared_cache.delete(backend.stream_cache_key(channel_id))
+        await watch()
+        # A refresh that brings back the same list (as another worker's JSON copy) invalidates nothing
+        await refresh([Channel(**channel.dict()) for channel in channels])
+        await watch()
+        await refresh([
+            Channel(id="51", name="ABC USA", tags=["news"], logo="/api/logo/abc"),
+            Channel(id="65", name="Sky Sports Premier League", tags=["sports"], logo="/missing.png"),
+            Channel(id="99", name="New Channel", tags=[], logo="/missing.png"),
+        ])
+        await watch()
+
+    asyncio.run(run())
+    noop, change = diffs
+    assert not noop and noop.stale_ids == []
+    assert resolved[:3] == ["51", "65", "70"] and len(resolved) == 3 + 0 + 2
+    assert sorted(resolved[3:]) == ["65", "70"]  # Only the renamed and removed channels re-resolved
+    assert [c.id for c in change.added] == ["99"] and [c.id for c in change.removed] == ["70"]
+    assert [(old.name, new.name) for old, new in change.renamed] == [("Sky Sports Main Event", "Sky Sports Premier League")]
+    assert [new.id for _, new in change.changed] == ["51"]
+    assert backend.channel_refresh_stats["unchanged"] >= 1
+
+
+async def idle():
+    await asyncio.Event().wait()
+
+
+def boot_reflex_app(monkeypatch):
+    """The ASGI app Reflex serves (start.sh runs `reflex run --backend-only`), with quiet background tasks."""
+    from freesky import freesky as frontend
+
+    async def noop():
+        pass
+
+    monkeypatch.setattr(backend, "active_tasks", {})
+    monkeypatch.setattr(backend, "update_channels", idle)
+    monkeypatch.setattr(backend, "prewarm_streams", idle)
+    # Shutdown closes the module-level clients other tests still use
+    monkeypatch.setattr(backend.segment_cache, "close", noop)
+    monkeypatch.setattr(backend.upstream, "aclose", noop)
+    monkeypatch.setattr(backend.shared_cache, "close", noop)
+    monkeypatch.setattr(frontend.app, "_compile", lambda *args, **kwargs: None)  # No frontend build
+    # Other tests already started fastapi_app; let Reflex add its middleware and rebuild the stack
+    monkeypatch.setattr(backend.fastapi_app, "middleware_stack", None)
+    return frontend.app()
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_reflex_app_lifespan_starts_background_tasks(monkeypatch):
+    started = []
+
+    class FakePrefetcher:
+        async def run(self):
+            started.append("prefetch")
+            await idle()
+
+    monkeypatch.setattr(backend, "prefetcher", FakePrefetcher())
+    with TestClient(boot_reflex_app(monkeypatch)) as reflex_client:
+        assert reflex_client.get("/ping").status_code == 200
+        wait_for(lambda: started)
+        tasks = dict(backend.active_tasks)
+    assert started == ["prefetch"]
+    assert {"channel_update", "prefetch"} <= set(tasks)
+    assert all(task.done() for task in tasks.values())  # Cancelled when the lifespan ends
+
+
+def test_reflex_app_lifespan_shares_token_secret(monkeypatch):
+    from freesky import utils
+    from freesky.cache_backend import MemoryBackend
+
+    old_key = utils.current_key
+    monkeypatch.setattr(utils, "token_keys", dict(utils.token_keys))
+    monkeypatch.setattr(utils, "token_keys_shared", False)
+    monkeypatch.setattr(backend, "workers", 6)
+    try:
+        # A per-process cache can't share the secret, so several workers refuse to start
+        with pytest.raises(RuntimeError):
+            with TestClient(boot_reflex_app(monkeypatch)):
+                pass
+
+        shared = MemoryBackend()
+        shared.shared = True  # Stands in for Redis
+        monkeypatch.setattr(backend, "shared_cache", shared)
+        with TestClient(boot_reflex_app(monkeypatch)):
+            assert utils.tokens_portable()
+            assert asyncio.run(shared.get(utils.SHARED_SECRET_KEY)) is not None
+    finally:
+        utils.set_token_keys([old_key])
+        utils.tokens.clear()
+
+
+def test_reflex_app_lifespan_runs_playlist_prewarmer(monkeypatch):
+    ticks = []
+
+    async def fake_tick(interval=1.0):
+        ticks.append(interval)
+
+    prewarm_streams = backend.prewarm_streams
+    app = boot_reflex_app(monkeypatch)
+    monkeypatch.setattr(backend, "prewarm_streams", prewarm_streams)
+    monkeypatch.setattr(backend, "prewarm_tick", fake_tick)
+    monkeypatch.setattr(backend, "prewarm_top_n", 4)
+    with TestClient(app):
+        wait_for(lambda: ticks)
+        task = backend.active_tasks["prewarm"]
+    assert ticks and task.done()
+
+
+def test_reflex_app_lifespan_runs_spool_janitor(monkeypatch, tmp_path):
+    from freesky.spool import DiskSpool
+
+    spool = DiskSpool(str(tmp_path))
+    expired = tmp_path / "segment-expired"
+    expired.write_bytes(b"x" * 16)
+    os.utime(expired, (time.time() - 3600, time.time() - 3600))
+    monkeypatch.setattr(backend, "spool", spool)
+    with TestClient(boot_reflex_app(monkeypatch)):
+        wait_for(lambda: not expired.exists())
+        task = backend.active_tasks["spool_janitor"]
+    assert not expired.exists() and spool.removed == 1
+    assert task.done()
+
+
+def test_reflex_app_lifespan_keeps_cluster_membership(monkeypatch):
+    from freesky.cache_backend import MemoryBackend
+    from freesky.cluster import Cluster
+
+    registry = MemoryBackend()
+    asyncio.run(registry.register("cluster", "http://node-1:8005", 60))
+    cluster = Cluster("http://node-0:8005", backend=registry, secret="s3cret")
+    monkeypatch.setattr(backend, "cluster", cluster)
+    with TestClient(boot_reflex_app(monkeypatch)):
+        wait_for(lambda: len(cluster.members) == 2)
+        members = asyncio.run(registry.members("cluster"))
+    # The heartbeat registered this node and picked up its peer; shutdown takes it out again
+    assert members == ["http://node-0:8005", "http://node-1:8005"]
+    assert cluster.members == members
+    assert asyncio.run(registry.members("cluster")) == ["http://node-1:8005"]